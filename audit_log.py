@@ -0,0 +1,490 @@
+"""
+This module keeps an audit trail of every scan as NDJSON events: the start
+and end of the scan, each page fetched, each non-compliant user found and
+the outcome of each delivery.
+
+Events are queued by the scan and written by a background thread in
+batches, each with a single write, so recording an event only costs the
+scan a queue put. When the log reaches its size limit it is compressed into
+a numbered segment, one gzip member per batch, and the oldest segments are
+removed. A sidecar index lists every batch with its byte range, time span,
+tenants and emails, so queries only read the batches that can match.
+
+A crash while rotating may leave a batch both in the log and in the new
+segment; it is then returned twice by queries.
+"""
+
+import gzip
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+# Size at which the log is compressed into a segment.
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# Compressed segments kept; older ones are removed.
+DEFAULT_BACKUPS = 10
+# Longest time an event waits in memory before it is written, in seconds.
+FLUSH_INTERVAL = 1.0
+# Events written at most per batch.
+MAX_BATCH_EVENTS = 1000
+# Suffix of the sidecar index, next to the log.
+INDEX_SUFFIX = '.idx'
+SEGMENT_SUFFIX = '.gz'
+
+_STOP = object()
+
+
+def batch_entry(name, offset, data, events):
+    """
+    Describe a batch of events for the index.
+
+    Args:
+        name (str): The file holding the batch, relative to the log.
+        offset (int): The offset of the batch in the file.
+        data (bytes): The batch as stored in the file.
+        events (list): The events of the batch.
+
+    Returns:
+        dict: The file, offset and length of the batch, the time span of
+        its events, and the tenants and emails they name.
+    """
+    times = [event.get('ts', 0) for event in events]
+    return {
+        'file': name,
+        'offset': offset,
+        'length': len(data),
+        'events': len(events),
+        'start': min(times, default=0),
+        'end': max(times, default=0),
+        'tenants': sorted({str(event['tenant']) for event in events
+                           if event.get('tenant') is not None}),
+        'emails': sorted({event['email'].lower() for event in events
+                          if isinstance(event.get('email'), str)}),
+    }
+
+
+def read_index(index_path):
+    """
+    Read the entries of an index, skipping damaged lines.
+
+    Args:
+        index_path (str): The sidecar index.
+
+    Returns:
+        list: The batch entries, oldest first; see batch_entry.
+    """
+    try:
+        with open(index_path, encoding='utf-8') as index:
+            lines = index.read().splitlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict) and 'file' in entry:
+            entries.append(entry)
+    return entries
+
+
+def write_index(index_path, entries):
+    """
+    Replace an index in one step, so readers never see a partial index.
+
+    Args:
+        index_path (str): The sidecar index.
+        entries (list): The batch entries, oldest first.
+    """
+    directory = os.path.dirname(os.path.abspath(index_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.audit-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            for entry in entries:
+                tmp_file.write(json.dumps(entry, separators=(',', ':')))
+                tmp_file.write('\n')
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def append_file(path, data):
+    """
+    Append bytes to a file with a single write.
+
+    Args:
+        path (str): The file, created with owner-only permissions.
+        data (bytes): The bytes appended.
+
+    Returns:
+        int: The offset at which they were written.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        offset = os.fstat(fd).st_size
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    return offset
+
+
+def encode_events(events):
+    """
+    Serialise events as NDJSON.
+
+    Args:
+        events (list): The events.
+
+    Returns:
+        bytes: One JSON object per line.
+    """
+    return ''.join(json.dumps(event, separators=(',', ':'), default=str)
+                   + '\n' for event in events).encode('utf-8')
+
+
+def parse_events(data):
+    """
+    Parse NDJSON events, skipping damaged lines.
+
+    Args:
+        data (bytes): The NDJSON.
+
+    Returns:
+        list: The events.
+    """
+    events = []
+    for line in data.splitlines():
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(event, dict):
+            events.append(event)
+    return events
+
+
+class AuditLog:
+    """
+    Writes audit events to an NDJSON file from a background thread.
+
+    Args:
+        path (str): The log file; segments and the index are written next
+        to it.
+        max_bytes (int): The size at which the log is compressed into a
+        segment.
+        backups (int): The compressed segments kept.
+        flush_interval (float): The longest time an event is buffered, in
+        seconds.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES,
+                 backups=DEFAULT_BACKUPS, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.max_bytes = max_bytes
+        self.backups = max(0, backups)
+        self.flush_interval = flush_interval
+        self.thread = None
+        self._queue = queue.SimpleQueue()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def emit(self, event, **fields):
+        """
+        Queue an event for writing.
+
+        Args:
+            event (str): The event name, such as 'page'.
+            **fields: The fields of the event; values that are not JSON
+            types are written as strings.
+        """
+        self._queue.put(dict({'ts': round(time.time(), 6), 'event': event},
+                             **fields))
+
+    def start(self):
+        """
+        Index any events left unindexed by a crash and start the writer.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+        self.thread = threading.Thread(target=self.run, name='audit-writer',
+                                       daemon=True)
+        self.thread.start()
+
+    def flush(self, timeout=None):
+        """
+        Wait until the events queued so far are written.
+
+        Args:
+            timeout (float): The longest wait, in seconds.
+        """
+        if self.thread is not None:
+            written = threading.Event()
+            self._queue.put(written)
+            written.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Write the queued events and stop the writer.
+
+        Args:
+            timeout (float): The longest wait for the writer, in seconds.
+        """
+        if self.thread is not None:
+            self._queue.put(_STOP)
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self):
+        """
+        Write queued events in batches until closed.
+
+        A batch is written once 'flush_interval' has passed since its first
+        event, once it holds MAX_BATCH_EVENTS events, or on flush and close.
+        """
+        stopping = False
+        while not stopping:
+            batch = []
+            waiters = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stopping or waiters or len(batch) >= MAX_BATCH_EVENTS:
+                    break
+                try:
+                    item = self._queue.get(
+                        timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.write_batch(batch)
+                except OSError as e:
+                    print(f"Error writing audit log: {e}", file=sys.stderr)
+            for waiter in waiters:
+                waiter.set()
+
+    def write_batch(self, events):
+        """
+        Append a batch of events to the log and index it.
+
+        Args:
+            events (list): The events.
+        """
+        data = encode_events(events)
+        offset = append_file(self.path, data)
+        entry = batch_entry(os.path.basename(self.path), offset, data,
+                            events)
+        append_file(self.index_path,
+                    json.dumps(entry, separators=(',', ':')).encode('utf-8')
+                    + b'\n')
+        if offset + len(data) >= self.max_bytes:
+            self.rotate()
+
+    def recover(self):
+        """
+        Bring the index in line with the log after a crash.
+
+        A partial last line is cut off, index entries past the end of the
+        log are dropped, and events written but not indexed are indexed as
+        one batch.
+        """
+        name = os.path.basename(self.path)
+        try:
+            with open(self.path, 'rb') as log:
+                data = log.read()
+        except FileNotFoundError:
+            data = b''
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            with open(self.path, 'r+b') as log:
+                log.truncate(complete)
+        entries = read_index(self.index_path)
+        kept = [entry for entry in entries if entry['file'] != name
+                or entry['offset'] + entry['length'] <= complete]
+        indexed = max((entry['offset'] + entry['length'] for entry in kept
+                       if entry['file'] == name), default=0)
+        if indexed < complete:
+            tail = data[indexed:complete]
+            kept.append(batch_entry(name, indexed, tail, parse_events(tail)))
+        if kept != entries:
+            write_index(self.index_path, kept)
+
+    def segments(self):
+        """
+        List the compressed segments of the log.
+
+        Returns:
+            list: (number, file name) pairs, oldest first.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + '.'
+        found = []
+        for name in os.listdir(directory):
+            number = name[len(prefix):-len(SEGMENT_SUFFIX)]
+            if name.startswith(prefix) and name.endswith(SEGMENT_SUFFIX) \
+                    and number.isdigit():
+                found.append((int(number), name))
+        return sorted(found)
+
+    def rotate(self):
+        """
+        Compress the log into a new segment and start an empty one.
+
+        Each batch becomes its own gzip member, so the index can still
+        point queries at single batches. Segments beyond 'backups' are
+        removed, oldest first.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        name = os.path.basename(self.path)
+        segments = self.segments()
+        number = segments[-1][0] + 1 if segments else 1
+        segment = f"{name}.{number}{SEGMENT_SUFFIX}"
+        entries = read_index(self.index_path)
+        with open(self.path, 'rb') as log:
+            data = log.read()
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.audit-')
+        moved = []
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                offset = 0
+                for entry in entries:
+                    if entry['file'] != name:
+                        continue
+                    member = gzip.compress(
+                        data[entry['offset']:entry['offset']
+                             + entry['length']])
+                    tmp_file.write(member)
+                    moved.append(dict(entry, file=segment, offset=offset,
+                                      length=len(member)))
+                    offset += len(member)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, os.path.join(directory, segment))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        segments.append((number, segment))
+        expired = {old for _, old in segments[:len(segments) - self.backups]}
+        kept = [entry for entry in entries
+                if entry['file'] != name and entry['file'] not in expired]
+        kept.extend(entry for entry in moved if segment not in expired)
+        write_index(self.index_path, kept)
+        os.remove(self.path)
+        for old in expired:
+            os.remove(os.path.join(directory, old))
+
+
+def entry_matches(entry, tenant, email, since, until):
+    """
+    Tell whether a batch can hold events matching a query.
+
+    Args:
+        entry (dict): The index entry of the batch.
+        tenant (str): The tenant wanted, or None.
+        email (str): The lower-cased email wanted, or None.
+        since (float): The earliest time wanted, or None.
+        until (float): The latest time wanted, or None.
+
+    Returns:
+        bool: False when the batch can be skipped.
+    """
+    if since is not None and entry.get('end', 0) < since:
+        return False
+    if until is not None and entry.get('start', 0) > until:
+        return False
+    if tenant is not None and tenant not in entry.get('tenants', ()):
+        return False
+    return email is None or email in entry.get('emails', ())
+
+
+def query(path, tenant=None, email=None, since=None, until=None):
+    """
+    Find the audit events matching every given filter.
+
+    Only the batches whose index entry can match are read.
+
+    Args:
+        path (str): The log file.
+        tenant (str): Keep the events of this tenant.
+        email (str): Keep the events about this email, in any case.
+        since (float): Keep the events at or after this Unix time.
+        until (float): Keep the events at or before this Unix time.
+
+    Yields:
+        dict: Each matching event, oldest first.
+
+    Raises:
+        OSError: If a batch cannot be read.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    email = email.lower() if email is not None else None
+    for entry in read_index(path + INDEX_SUFFIX):
+        if not entry_matches(entry, tenant, email, since, until):
+            continue
+        try:
+            with open(os.path.join(directory, entry['file']), 'rb') as log:
+                log.seek(entry['offset'])
+                data = log.read(entry['length'])
+        except FileNotFoundError:
+            continue  # rotated away since the index was read
+        if entry['file'].endswith(SEGMENT_SUFFIX):
+            data = gzip.decompress(data)
+        for event in parse_events(data):
+            if since is not None and event.get('ts', 0) < since:
+                continue
+            if until is not None and event.get('ts', 0) > until:
+                continue
+            if tenant is not None and str(event.get('tenant')) != tenant:
+                continue
+            if email is not None \
+                    and str(event.get('email', '')).lower() != email:
+                continue
+            yield event
+
+
+def open_audit_log(config):
+    """
+    Start the audit log described by the configuration.
+
+    Args:
+        config (dict): The loaded configuration. 'audit_log' names the log
+        file and is disabled by default; 'audit_max_bytes' and
+        'audit_backups' set its rotation.
+
+    Returns:
+        AuditLog: The started log, or None when auditing is disabled.
+
+    Raises:
+        OSError: If the log directory cannot be created.
+    """
+    path = config.get('audit_log')
+    if not path:
+        return None
+    log = AuditLog(path,
+                   max_bytes=config.get('audit_max_bytes', DEFAULT_MAX_BYTES),
+                   backups=config.get('audit_backups', DEFAULT_BACKUPS))
+    log.start()
+    return log
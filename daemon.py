@@ -0,0 +1,294 @@
+"""
+This module keeps the scanner running as a long-lived process that scans on
+cron-style schedules, instead of cold-starting from cron for every run.
+"""
+
+import datetime
+import json
+import os
+import signal
+import sys
+import threading
+
+import snapshot_store
+
+# Schedule used when the configuration has no 'schedules' list: every
+# Friday at 08:00, like the cron job created by setup.py.
+DEFAULT_CRON = '0 8 * * 5'
+# Longest sleep between checks for due schedules and config changes.
+POLL_SECONDS = 30
+
+# (minimum, maximum) of each cron field.
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def parse_cron_field(field, minimum, maximum):
+    """
+    Expand one cron field into the set of values it matches.
+
+    Supports '*', single values, 'a-b' ranges, '/n' steps and
+    comma-separated lists.
+
+    Args:
+        field (str): The field text.
+        minimum (int): The smallest allowed value.
+        maximum (int): The largest allowed value.
+
+    Returns:
+        set: The matching values.
+
+    Raises:
+        ValueError: If the field is malformed or out of range.
+    """
+    values = set()
+    for part in field.split(','):
+        spec, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if spec == '*':
+            start, end = minimum, maximum
+        elif '-' in spec:
+            start, end = (int(value) for value in spec.split('-', 1))
+        else:
+            start = end = int(spec)
+            if step != 1:
+                end = maximum
+        if step < 1 or start < minimum or end > maximum or start > end:
+            raise ValueError(f"Invalid cron field: {field!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    A five-field cron expression: minute, hour, day of month, month and
+    day of week (0 or 7 is Sunday).
+
+    As in cron, when both the day of month and the day of week are
+    restricted, a day matching either one matches.
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression: {expression!r}")
+        self.expression = expression
+        (self.minutes, self.hours, self.days, self.months,
+         weekdays) = (parse_cron_field(field, *limits)
+                      for field, limits in zip(fields, FIELD_RANGES))
+        self.weekdays = {day % 7 for day in weekdays}
+        # Cron treats any field starting with '*', such as '*/2', as
+        # unrestricted when combining the day fields
+        self.any_day = fields[2].startswith('*')
+        self.any_weekday = fields[4].startswith('*')
+
+    def matches_day(self, day):
+        """
+        Check whether a date matches the day and month fields.
+
+        Args:
+            day (datetime.date): The date to check.
+
+        Returns:
+            bool: True when the schedule can fire on that date.
+        """
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        # date.weekday() counts from Monday; cron counts from Sunday.
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        """
+        Find the first time the schedule fires after a moment.
+
+        Args:
+            moment (datetime.datetime): The moment to start from.
+
+        Returns:
+            datetime.datetime: The next firing time, to the minute.
+
+        Raises:
+            ValueError: If the schedule never fires, e.g. on 31 February.
+        """
+        start = moment.replace(second=0, microsecond=0) \
+            + datetime.timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 8):
+            if self.matches_day(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = datetime.datetime.combine(
+                            day, datetime.time(hour, minute))
+                        if candidate >= start:
+                            return candidate
+            day += datetime.timedelta(days=1)
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+
+def schedules_from_config(config):
+    """
+    Build the schedules of a configuration.
+
+    Each entry of the optional 'schedules' list holds a 'cron' expression
+    and may override any configuration key for its runs, e.g. 'customer',
+    'customer_domains' or 'poc_email'. Schedules scanning different
+    'customer_domains' need their own 'snapshot_db', or each scan would
+    mark the other schedules' users as removed.
+
+    Args:
+        config (dict): The loaded configuration.
+
+    Returns:
+        list: (CronSchedule, config for the run) pairs.
+
+    Raises:
+        ValueError: If a cron expression is invalid, or if schedules with
+        different customer domains share a snapshot database.
+    """
+    base = {key: value for key, value in config.items()
+            if key != 'schedules'}
+    entries = config.get('schedules') or [{'cron': DEFAULT_CRON}]
+    schedules = []
+    for entry in entries:
+        overrides = {key: value for key, value in entry.items()
+                     if key != 'cron'}
+        schedules.append((CronSchedule(entry.get('cron', DEFAULT_CRON)),
+                          dict(base, **overrides)))
+    domains_by_db = {}
+    for _, run_config in schedules:
+        path = run_config.get('snapshot_db', snapshot_store.DEFAULT_DB_PATH)
+        if not path:
+            continue
+        domains = sorted(domain.lower() for domain
+                         in run_config.get('customer_domains') or [])
+        path = os.path.abspath(path)
+        if domains_by_db.setdefault(path, domains) != domains:
+            raise ValueError(
+                f"Schedules with different customer_domains share the "
+                f"snapshot database {path}; give each one its own "
+                f"'snapshot_db'")
+    return schedules
+
+
+class Daemon:
+    """
+    Runs scans on schedule until stopped.
+
+    Scans run one at a time on the daemon's own thread, so they never
+    overlap; occurrences missed while a scan was running are skipped. The
+    Plextrac clients are kept open between scans, and the configuration is
+    reloaded whenever its file changes.
+
+    Args:
+        config_path (str): The path of the JSON configuration.
+        run_scan (callable): Called with a configuration and the dict of
+        open clients for every due schedule.
+        now (callable): Returns the current local time; for tests.
+    """
+
+    def __init__(self, config_path, run_scan, now=datetime.datetime.now):
+        self.config_path = config_path
+        self.run_scan = run_scan
+        self.now = now
+        self.clients = {}
+        self.config = {}
+        self.schedules = []
+        self.next_runs = []
+        self.config_mtime = None
+        self.stopping = threading.Event()
+
+    def stop(self, *_):
+        """
+        Ask the daemon to exit once the current scan, if any, finishes.
+        """
+        self.stopping.set()
+
+    def reload_if_changed(self):
+        """
+        Reload the configuration when its file has changed.
+
+        A configuration that fails to load is reported and ignored, and the
+        previous one stays in effect.
+
+        Returns:
+            bool: True when a new configuration was loaded.
+        """
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+        except OSError as e:
+            print(f"Cannot read {self.config_path}: {e}", file=sys.stderr)
+            return False
+        if mtime == self.config_mtime:
+            return False
+        self.config_mtime = mtime
+        try:
+            with open(self.config_path, encoding='utf-8') as config_file:
+                config = json.load(config_file)
+            schedules = schedules_from_config(config)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring invalid configuration {self.config_path}: {e}",
+                  file=sys.stderr)
+            return False
+        now = self.now()
+        self.config = config
+        self.schedules = schedules
+        self.next_runs = [schedule.next_after(now)
+                          for schedule, _ in schedules]
+        self.close_clients()
+        print(f"Loaded {len(schedules)} schedule(s) from {self.config_path}",
+              file=sys.stderr)
+        return True
+
+    def close_clients(self):
+        """
+        Close the open Plextrac clients.
+        """
+        for client in self.clients.values():
+            client.close()
+        self.clients.clear()
+
+    def run_due(self):
+        """
+        Run every schedule whose next run time has passed.
+        """
+        for index, (schedule, config) in enumerate(self.schedules):
+            if self.stopping.is_set():
+                return
+            if self.next_runs[index] > self.now():
+                continue
+            try:
+                self.run_scan(config, self.clients)
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Scheduled scan '{schedule.expression}' failed: {e}",
+                      file=sys.stderr)
+            self.next_runs[index] = schedule.next_after(self.now())
+
+    def seconds_until_next_run(self):
+        """
+        Work out how long to sleep before the next check.
+
+        Returns:
+            float: Seconds until the next due run, at most POLL_SECONDS.
+        """
+        if not self.next_runs:
+            return POLL_SECONDS
+        wait = (min(self.next_runs) - self.now()).total_seconds()
+        return max(0.0, min(POLL_SECONDS, wait))
+
+    def run_forever(self):
+        """
+        Scan on schedule until SIGTERM or SIGINT is received.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        try:
+            while not self.stopping.is_set():
+                self.reload_if_changed()
+                self.run_due()
+                self.stopping.wait(self.seconds_until_next_run())
+        finally:
+            self.close_clients()
+        print("Daemon stopped", file=sys.stderr)
@@ -0,0 +1,134 @@
+"""
+This module matches email addresses against customer domains using a hashed
+set of exact domains and a suffix trie of reversed domain labels.
+"""
+
+# Trie markers are not strings, so no domain label can be mistaken for one.
+# Trie marker: the domain itself and all of its subdomains match.
+SUBTREE = object()
+# Trie marker: only subdomains of the domain match.
+WILDCARD = object()
+
+
+def email_domain(email):
+    """
+    Extract the normalised domain of an email address.
+
+    Args:
+        email (str): The email address.
+
+    Returns:
+        str: The lower-cased domain, or an empty string when there is none
+        or it holds an empty label, as in 'a..example.com'.
+    """
+    _, sep, domain = email.rpartition('@')
+    if not sep:
+        return ''
+    domain = domain.strip().rstrip('.').lower()
+    if '' in domain.split('.'):
+        return ''
+    return domain
+
+
+class DomainIndex:
+    """
+    An index of customer domains.
+
+    Entries are matched on whole labels, so 'example.com' matches
+    'example.com' and 'mail.example.com' but not 'notexample.com'. An entry
+    written as '*.example.com' matches subdomains only. Lookups cost one set
+    probe plus at most one trie step per label of the email domain.
+
+    Entries may be added on behalf of several owners, such as customers;
+    owners_of then routes a domain to every owner whose entries cover it.
+
+    Args:
+        domains (iterable): The domain entries.
+        owner (object): The owner of the entries.
+    """
+
+    def __init__(self, domains=(), owner=None):
+        self.exact = set()
+        self.trie = {}
+        self.add(domains, owner)
+
+    def add(self, domains, owner=None):
+        """
+        Add domain entries to the index.
+
+        Args:
+            domains (iterable): The domain entries.
+            owner (object): The owner of the entries.
+        """
+        for entry in domains:
+            entry = entry.strip().lstrip('@').rstrip('.').lower()
+            if not entry:
+                continue
+            marker = SUBTREE
+            if entry.startswith('*.'):
+                entry = entry[2:]
+                marker = WILDCARD
+            else:
+                self.exact.add(entry)
+            node = self.trie
+            for label in reversed(entry.split('.')):
+                node = node.setdefault(label, {})
+            node.setdefault(marker, set()).add(owner)
+
+    def match_domain(self, domain):
+        """
+        Check whether a domain is covered by the index.
+
+        Args:
+            domain (str): A normalised domain, as returned by email_domain.
+
+        Returns:
+            bool: True when the domain matches one of the entries.
+        """
+        if domain in self.exact:
+            return True
+        labels = domain.split('.')
+        node = self.trie
+        for depth in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[depth])
+            if node is None:
+                return False
+            if depth and (SUBTREE in node or WILDCARD in node):
+                return True
+        return SUBTREE in node
+
+    def owners_of(self, domain):
+        """
+        Find the owners of the entries covering a domain.
+
+        Args:
+            domain (str): A normalised domain, as returned by email_domain.
+
+        Returns:
+            set: The owners, empty when no entry matches.
+        """
+        owners = set()
+        labels = domain.split('.')
+        node = self.trie
+        for depth in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[depth])
+            if node is None:
+                return owners
+            if depth:
+                owners.update(node.get(SUBTREE, ()))
+                owners.update(node.get(WILDCARD, ()))
+        owners.update(node.get(SUBTREE, ()))
+        return owners
+
+    def match(self, email):
+        """
+        Check whether an email address belongs to one of the domains.
+
+        Args:
+            email (str): The email address.
+
+        Returns:
+            bool: True when the address matches one of the entries.
+        """
+        domain = email_domain(email)
+        return bool(domain) and self.match_domain(domain)
@@ -0,0 +1,550 @@
+"""
+This module scans one or more Plextrac instances and tenants concurrently,
+merges their customer users into a single de-duplicated list and routes
+them to the customers they belong to.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import domain_index
+import plextrac_api
+import records
+import token_cache
+
+# Number of instances or tenants scanned at the same time.
+MAX_CONCURRENT_SCANS = 4
+
+# Keys of an 'instances' entry that are inherited from the top-level config.
+TARGET_KEYS = (
+    'plextrac_url', 'plextrac_username', 'plextrac_password',
+    'customer_domains', 'page_size', 'prefetch_pages', 'json_stream',
+    'filter_pushdown', 'noncompliant_only'
+)
+
+
+def customer_configs(config):
+    """
+    Build the configuration of each customer reported on.
+
+    Each entry of the optional 'customers' list may override any
+    configuration key for its report, e.g. 'customer', 'customer_domains',
+    'poc_email', 'report_mode' or 'report_formats'. Without 'customers',
+    the top-level settings describe the only customer.
+
+    Args:
+        config (dict): The loaded configuration.
+
+    Returns:
+        list: One configuration per customer.
+    """
+    base = {key: value for key, value in config.items()
+            if key != 'customers'}
+    customers = config.get('customers') or [{}]
+    return [dict(base, **customer) for customer in customers]
+
+
+def scan_targets(config):
+    """
+    Build the list of instances and tenants to scan from the configuration.
+
+    Each entry of the optional 'instances' list overrides the top-level
+    Plextrac settings, so an entry only needs the keys that differ. An
+    entry may also set 'tenant_id' to scan a tenant other than the one
+    returned on authentication. Without 'instances', the top-level settings
+    describe the only target. With 'customers', targets look for the
+    domains of every customer, so each tenant is fetched once.
+
+    Args:
+        config (dict): The loaded configuration.
+
+    Returns:
+        list: One settings dict per target.
+    """
+    defaults = {key: config[key] for key in TARGET_KEYS if key in config}
+    if config.get('customers'):
+        defaults['customer_domains'] = list(dict.fromkeys(
+            domain for customer in customer_configs(config)
+            for domain in customer.get('customer_domains', [])))
+    instances = config.get('instances') or [{}]
+    return [dict(defaults, **instance) for instance in instances]
+
+
+def target_label(target):
+    """
+    Describe a target for messages without exposing its credentials.
+
+    Args:
+        target (dict): The settings of one target.
+
+    Returns:
+        str: The instance URL, followed by the tenant when one is set.
+    """
+    label = target.get('plextrac_url', '<unknown instance>')
+    if target.get('tenant_id'):
+        label += f" (tenant {target['tenant_id']})"
+    return label
+
+
+def iter_matches(users, search_terms, noncompliant_only=False,
+                 batch_size=records.BATCH_SIZE):
+    """
+    Filter a stream of users down to emails matching the customer domains.
+
+    Users are converted to columnar batches, and each distinct domain is
+    matched once per scan rather than once per user.
+
+    Args:
+        users (iterable): The user entries returned by the API.
+        search_terms (list): The customer domains to look for; see
+        domain_index.DomainIndex for the matching rules.
+        noncompliant_only (bool): Also drop the users with MFA enabled.
+        batch_size (int): The number of entries matched per batch; no
+        user is yielded before its batch is full or the stream ends.
+
+    Yields:
+        records.UserRecord: Each user whose email matches one of the
+        domains, batch by batch.
+    """
+    index = domain_index.DomainIndex(search_terms)
+    cache = {}
+    for table in records.iter_tables(users, batch_size):
+        rows = table.match_domains(index, cache)
+        if noncompliant_only:
+            rows = table.noncompliant_rows(rows)
+        yield from table.records(rows)
+
+
+def search_emails_in_data(users, search_terms, noncompliant_only=False):
+    """
+    Search a stream of users for emails matching the customer domains.
+
+    Args:
+        users (iterable): The user entries returned by the API.
+        search_terms (list): The customer domains to look for; see
+        domain_index.DomainIndex for the matching rules.
+        noncompliant_only (bool): Also drop the users with MFA enabled.
+
+    Returns:
+        list: records.UserRecord objects for the users whose email matches
+        one of the domains.
+    """
+    return list(iter_matches(users, search_terms, noncompliant_only))
+
+
+def is_noncompliant(user):
+    """
+    Check whether a user has MFA disabled.
+
+    Args:
+        user (records.UserRecord): The user.
+
+    Returns:
+        bool: True when MFA is not enabled for the user.
+    """
+    return not user.mfa_enabled
+
+
+def is_unauthorized(error):
+    """
+    Check whether an API error means the bearer token was rejected.
+
+    Args:
+        error (requests.exceptions.HTTPError): The error raised by a request.
+
+    Returns:
+        bool: True for a 401 response.
+    """
+    return error.response is not None and error.response.status_code == 401
+
+
+def tenant_filter(target):
+    """
+    Build the filter pushed down to the API for a target.
+
+    Args:
+        target (dict): The settings of one target. 'filter_pushdown' set to
+        true enables pushdown; 'noncompliant_only' also pushes down the MFA
+        state, when users with MFA enabled are not needed.
+
+    Returns:
+        plextrac_api.UserFilter: The filter, or None when disabled.
+    """
+    if not target.get('filter_pushdown', False):
+        return None
+    return plextrac_api.UserFilter(
+        tuple(target['customer_domains']),
+        False if target.get('noncompliant_only') else None)
+
+
+def iter_tenant_users(target, auth, client, on_page=None):
+    """
+    Stream the user entries of a target with a given token.
+
+    With 'filter_pushdown', the customer domains, and the MFA state when
+    only non-compliant users are wanted, are pushed down to the API where
+    it supports it; entries outside them may still be returned.
+
+    Args:
+        target (dict): The settings of one target.
+        auth (dict): The authentication payload holding 'token' and
+        'tenant_id'.
+        client (plextrac_api.PlextracClient): The client of the instance.
+        on_page (callable): Called with the offset, user count and size of
+        each page; see plextrac_api.PlextracClient.iter_tenant_users.
+
+    Returns:
+        iterator: The user entries returned by the API.
+    """
+    return client.iter_tenant_users(
+        target.get('tenant_id') or auth['tenant_id'],
+        auth['token'],
+        page_size=target.get('page_size', plextrac_api.PAGE_SIZE),
+        prefetch=target.get('prefetch_pages', plextrac_api.PREFETCH_PAGES),
+        stream_json=target.get('json_stream', False),
+        user_filter=tenant_filter(target),
+        on_page=on_page
+    )
+
+
+def collect_customer_users(target, auth, client, metrics=None):
+    """
+    Collect the customer users of a target with a given token.
+
+    Args:
+        target (dict): The settings of one target.
+        auth (dict): The authentication payload holding 'token' and
+        'tenant_id'.
+        client (plextrac_api.PlextracClient): The client of the instance.
+        metrics (metrics.Metrics): Receives the 'fetch_filter' phase and
+        the users fetched and matched, labelled with the target, and the
+        audit events of each page and non-compliant user.
+
+    Returns:
+        list: The users of the customer domains.
+    """
+    noncompliant_only = target.get('noncompliant_only', False)
+    if metrics is None:
+        return search_emails_in_data(iter_tenant_users(target, auth, client),
+                                     target['customer_domains'],
+                                     noncompliant_only)
+    label = target_label(target)
+    tenant = target.get('tenant_id') or auth['tenant_id']
+
+    def on_page(offset, count, size):
+        metrics.event('page', target=label, tenant=tenant, offset=offset,
+                      users=count, bytes=size)
+
+    users = iter_tenant_users(target, auth, client, on_page)
+    with metrics.phase('fetch_filter', target=label):
+        matches = search_emails_in_data(
+            metrics.count_items(users, 'users_fetched', target=label),
+            target['customer_domains'], noncompliant_only)
+    metrics.add('users_matched', len(matches), target=label)
+    audit_noncompliant(metrics, matches, target=label, tenant=tenant)
+    return matches
+
+
+def audit_noncompliant(metrics, users, **fields):
+    """
+    Record an audit event for each non-compliant user.
+
+    Nothing is done when the run has no audit log.
+
+    Args:
+        metrics (metrics.Metrics): The metrics of the run.
+        users (list): records.UserRecord objects.
+        **fields: Fields added to each event, such as the target.
+    """
+    if metrics.audit is None:
+        return
+    for user in users:
+        if is_noncompliant(user):
+            metrics.event('noncompliant_user', email=user.email,
+                          name=user.name, domain=user.domain, **fields)
+
+
+def scan_target(target, client, cache=None, metrics=None):
+    """
+    Authenticate against one target and collect its customer users.
+
+    A token found in the cache is reused; if the API rejects it with a 401,
+    it is dropped and the scan is retried once with a fresh token.
+
+    Args:
+        target (dict): The settings of one target.
+        client (plextrac_api.PlextracClient): The client of the instance.
+        cache (token_cache.TokenCache): The token cache, if enabled.
+        metrics (metrics.Metrics): Receives the 'auth' and 'fetch_filter'
+        phases and the token cache hits, labelled with the target.
+
+    Returns:
+        list: The users of the customer domains.
+
+    Raises:
+        requests.exceptions.RequestException: If an API request fails.
+    """
+    key = target_cache_key(target)
+    auth = cache.get(key) if cache else None
+    if auth is not None:
+        if metrics is not None:
+            metrics.add('token_cache_hits', target=target_label(target))
+        try:
+            return collect_customer_users(target, auth, client, metrics)
+        except requests.exceptions.HTTPError as e:
+            if not is_unauthorized(e):
+                raise
+            cache.invalidate(key)
+
+    auth = authenticate_target(target, client, cache, metrics)
+    return collect_customer_users(target, auth, client, metrics)
+
+
+def iter_target_users(target, client, cache=None):
+    """
+    Stream the customer users of one target as its pages arrive.
+
+    Users are matched in batches of 'page_size' entries, so each one is
+    yielded once at most a page of entries has been read after it.
+    Tokens are reused and refreshed as in scan_target; a rejected cached
+    token is only retried when no user was yielded yet.
+
+    Args:
+        target (dict): The settings of one target.
+        client (plextrac_api.PlextracClient): The client of the instance.
+        cache (token_cache.TokenCache): The token cache, if enabled.
+
+    Yields:
+        records.UserRecord: Each user of the customer domains.
+
+    Raises:
+        requests.exceptions.RequestException: If an API request fails.
+    """
+    def matches(auth):
+        return iter_matches(iter_tenant_users(target, auth, client),
+                            target['customer_domains'],
+                            target.get('noncompliant_only', False),
+                            target.get('page_size', plextrac_api.PAGE_SIZE))
+
+    key = target_cache_key(target)
+    auth = cache.get(key) if cache else None
+    if auth is not None:
+        yielded = False
+        try:
+            for user in matches(auth):
+                yielded = True
+                yield user
+            return
+        except requests.exceptions.HTTPError as e:
+            if yielded or not is_unauthorized(e):
+                raise
+            cache.invalidate(key)
+
+    yield from matches(authenticate_target(target, client, cache))
+
+
+def target_cache_key(target):
+    """
+    Build the token cache key of a target.
+
+    Args:
+        target (dict): The settings of one target.
+
+    Returns:
+        str: The cache key; see token_cache.cache_key.
+    """
+    return token_cache.cache_key(target['plextrac_url'],
+                                 target['plextrac_username'],
+                                 target.get('tenant_id'))
+
+
+def authenticate_target(target, client, cache=None, metrics=None):
+    """
+    Authenticate against a target and cache the new token.
+
+    Args:
+        target (dict): The settings of one target.
+        client (plextrac_api.PlextracClient): The client of the instance.
+        cache (token_cache.TokenCache): The token cache, if enabled.
+        metrics (metrics.Metrics): Receives the 'auth' phase, labelled with
+        the target.
+
+    Returns:
+        dict: The authentication payload holding 'token' and 'tenant_id'.
+
+    Raises:
+        requests.exceptions.RequestException: If authentication fails.
+    """
+    if metrics is None:
+        auth = client.authenticate(target['plextrac_username'],
+                                   target['plextrac_password'])
+    else:
+        with metrics.phase('auth', target=target_label(target)):
+            auth = client.authenticate(target['plextrac_username'],
+                                       target['plextrac_password'])
+    if cache:
+        cache.put(target_cache_key(target), auth)
+    return auth
+
+
+def merge_users(results):
+    """
+    Merge per-target user lists into one entry per email.
+
+    The first entry of each email is kept, unless a later one has MFA
+    disabled: a user is non-compliant if any target says so.
+
+    Args:
+        results (iterable): Lists of records.UserRecord, one per target.
+
+    Returns:
+        list: The users in order of first appearance, one per email.
+    """
+    positions = {}
+    merged = []
+    for users in results:
+        for user in users:
+            key = user.email.strip().lower()
+            if key not in positions:
+                positions[key] = len(merged)
+                merged.append(user)
+            elif is_noncompliant(user) \
+                    and not is_noncompliant(merged[positions[key]]):
+                merged[positions[key]] = user
+    return merged
+
+
+def record_client_metrics(metrics, url, before, after):
+    """
+    Record the HTTP work of a client during a scan.
+
+    Args:
+        metrics (metrics.Metrics): Receives the counters, labelled with the
+        instance URL.
+        url (str): The instance URL.
+        before (dict): The client counters at the start of the scan.
+        after (dict): The client counters at the end of the scan.
+    """
+    for name, counter in (('http_requests', 'requests_sent'),
+                          ('http_retries', 'retries'), ('pages', 'pages'),
+                          ('http_response_bytes', 'bytes_received'),
+                          ('pushdown_records_saved',
+                           'pushdown_records_saved'),
+                          ('pushdown_bytes_saved', 'pushdown_bytes_saved')):
+        metrics.add(name, after[counter] - before[counter], instance=url)
+
+
+def route_users(users, customers):
+    """
+    Route users to the customers whose domains cover them, in one pass.
+
+    Each distinct domain is looked up once. A user whose domain is covered
+    by several customers is routed to each of them.
+
+    Args:
+        users (list): records.UserRecord objects found by a scan.
+        customers (list): The customer configurations; see
+        customer_configs.
+
+    Returns:
+        list: One list of users per customer, in the order of customers.
+    """
+    if len(customers) == 1:
+        return [list(users)]
+    index = domain_index.DomainIndex()
+    for position, customer in enumerate(customers):
+        index.add(customer.get('customer_domains', []), position)
+    routed = [[] for _ in customers]
+    owners = {}
+    for user in users:
+        positions = owners.get(user.domain)
+        if positions is None:
+            positions = owners[user.domain] = sorted(
+                index.owners_of(user.domain))
+        for position in positions:
+            routed[position].append(user)
+    return routed
+
+
+def route_delta(delta, customers):
+    """
+    Route the changes since the previous scan to each customer.
+
+    Args:
+        delta (snapshot_store.Delta): The changes, or None.
+        customers (list): The customer configurations; see
+        customer_configs.
+
+    Returns:
+        list: One snapshot_store.Delta, or None, per customer.
+    """
+    if delta is None:
+        return [None] * len(customers)
+    fields = [route_users(users, customers) for users in delta]
+    return [type(delta)(*(routed[position] for routed in fields))
+            for position in range(len(customers))]
+
+
+def scan_all(config, clients=None, metrics=None, cache=None):
+    """
+    Scan every configured target concurrently.
+
+    A failing target does not stop the others; its error is returned
+    alongside the users found on the remaining targets. Targets on the same
+    instance share one client and its connection pool.
+
+    Args:
+        config (dict): The loaded configuration. The optional
+        'max_concurrent_scans' key bounds how many targets run at once; the
+        token cache and HTTP settings are read by
+        token_cache.open_token_cache and plextrac_api.client_from_config.
+        clients (dict): Clients by instance URL to reuse and extend. They
+        are left open for the caller; by default clients are created for
+        this scan and closed at the end.
+        metrics (metrics.Metrics): Receives the phases of each target, the
+        HTTP work of each instance and the number of failed targets.
+        cache (token_cache.TokenCache): The token cache; by default the
+        one described by the configuration.
+
+    Returns:
+        tuple: The merged customer users and a list of
+        (target label, exception) pairs for the targets that failed.
+    """
+    targets = scan_targets(config)
+    if cache is None:
+        cache = token_cache.open_token_cache(config)
+    workers = max(1, min(len(targets),
+                         config.get('max_concurrent_scans',
+                                    MAX_CONCURRENT_SCANS)))
+    owned = clients is None
+    clients = {} if owned else clients
+    for target in targets:
+        url = target['plextrac_url']
+        if url not in clients:
+            clients[url] = plextrac_api.client_from_config(url, config)
+    urls = {target['plextrac_url'] for target in targets}
+    before = {url: clients[url].counters() for url in urls}
+    results = []
+    errors = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(scan_target, target,
+                                   clients[target['plextrac_url']], cache,
+                                   metrics)
+                       for target in targets]
+            for target, future in zip(targets, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:  # pylint: disable=broad-except
+                    errors.append((target_label(target), e))
+    finally:
+        if metrics is not None:
+            for url in urls:
+                record_client_metrics(metrics, url, before[url],
+                                      clients[url].counters())
+            metrics.add('errors', len(errors))
+        if owned:
+            for client in clients.values():
+                client.close()
+    return merge_users(results), errors
@@ -0,0 +1,168 @@
+"""
+This module parses the users payload of the Plextrac API incrementally,
+yielding each element of its 'data' array as soon as it has been read.
+"""
+
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+
+class _Reader:
+    """
+    A text buffer over an iterable of byte chunks.
+
+    Consumed text is dropped whenever more is read, so the buffer holds at
+    most one JSON value plus one chunk.
+    """
+
+    def __init__(self, chunks, encoding):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        # Decoding element by element loses the key sharing json.loads does
+        # within a document, so keys are shared here instead.
+        self.keys = {}
+        self.json_decoder = json.JSONDecoder(object_pairs_hook=self._object)
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _object(self, pairs):
+        keys = self.keys
+        return {keys.setdefault(key, key): value for key, value in pairs}
+
+    def fill(self):
+        """
+        Read the next chunk into the buffer.
+
+        Returns:
+            bool: False once the input is exhausted.
+        """
+        while not self.eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                text = self.decoder.decode(b'', final=True)
+            else:
+                text = self.decoder.decode(chunk)
+            if text:
+                self.buffer = self.buffer[self.pos:] + text
+                self.pos = 0
+                return True
+        return False
+
+    def error(self, message):
+        """
+        Build a decode error at the current position.
+        """
+        return json.JSONDecodeError(message, self.buffer, self.pos)
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character.
+
+        Returns:
+            str: The character, or an empty string at the end of input.
+        """
+        while True:
+            while self.pos < len(self.buffer) \
+                    and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def take(self, expected):
+        """
+        Consume the next character, which must be one of 'expected'.
+
+        Returns:
+            str: The character consumed.
+        """
+        char = self.peek()
+        if not char or char not in expected:
+            raise self.error(f"Expecting one of {expected!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next complete JSON value.
+
+        Returns:
+            object: The decoded value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer,
+                                                          self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number or literal ending at the buffer end may continue in
+            # the next chunk.
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_items(reader):
+    # The elements of an array whose opening bracket was just read
+    if reader.peek() == ']':
+        reader.take(']')
+        return
+    while True:
+        yield reader.value()
+        if reader.take(',]') == ']':
+            return
+
+
+def iter_array_items(chunks, key='data', encoding='utf-8', others=None):
+    """
+    Yield the elements of an array held under a key of a JSON object.
+
+    Other keys of the object are parsed and discarded, or stored in
+    'others'. Memory use is bounded by the largest single element, not by
+    the size of the document.
+
+    Args:
+        chunks (iterable): The document as byte chunks, e.g.
+        requests.Response.iter_content().
+        key (str): The key of the array in the top-level object, or None
+        when the document itself is the array.
+        encoding (str): The text encoding of the document.
+        others (dict): Receives the other keys of the top-level object and
+        their values, as they are read.
+
+    Yields:
+        object: Each element of the array, in order.
+
+    Raises:
+        json.JSONDecodeError: If the document is not a valid JSON object,
+        or array when 'key' is None.
+    """
+    reader = _Reader(chunks, encoding)
+    if key is None:
+        reader.take('[')
+        yield from _iter_items(reader)
+        return
+    reader.take('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.take(':')
+        if name == key and reader.peek() == '[':
+            reader.take('[')
+            yield from _iter_items(reader)
+        elif others is not None:
+            others[name] = reader.value()
+        else:
+            reader.value()
+        if reader.take(',}') == '}':
+            return
@@ -0,0 +1,486 @@
+"""
+This module queues rendered report messages in a crash-safe directory and
+delivers them in the background, so scans never wait on the mail server.
+
+The spool holds one JSON file per message. A file is written to 'tmp',
+flushed to disk and renamed into 'new', so a crash never leaves a partial
+message queued. A dispatcher claims a message by renaming it into 'cur',
+which only one worker can do, and removes it once delivered. Messages
+that keep failing, or fail permanently, are moved to 'dead'. Delivery is
+at least once: a crash between sending and removing a message sends it
+again.
+"""
+
+import collections
+import json
+import os
+import random
+import smtplib
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import mailer
+
+# Default location of the spool directory.
+DEFAULT_SPOOL_DIR = 'mail_spool'
+# Messages delivered at the same time, each over its own SMTP connection.
+DISPATCH_WORKERS = 2
+# Delivery attempts before a message is moved to the dead-letter directory.
+MAX_ATTEMPTS = 8
+# Base and maximum delay between delivery attempts, in seconds.
+RETRY_BACKOFF = 60
+MAX_RETRY_BACKOFF = 3600
+# Seconds between two passes of the background dispatcher.
+DISPATCH_INTERVAL = 15
+# Claimed messages older than this are assumed orphaned by a crash.
+CLAIM_TIMEOUT = 600
+
+
+class UndeliveredMail(Exception):
+    """
+    Raised when spooled messages are still waiting after a delivery pass,
+    or were dead-lettered by it.
+    """
+
+
+def is_permanent(error):
+    """
+    Check whether a delivery error is permanent.
+
+    5xx replies are permanent, except authentication failures, which are
+    usually fixed by correcting the configuration.
+
+    Args:
+        error (Exception): The error raised by the transport.
+
+    Returns:
+        bool: True when the message should not be retried.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) \
+        and 500 <= error.smtp_code < 600
+
+
+def fsync_directory(path):
+    """
+    Flush a directory entry to disk, where the platform allows it.
+
+    Args:
+        path (str): The directory.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class MailSpool:
+    """
+    A directory of messages waiting to be delivered.
+
+    The directory and its files are only readable by the current user, as
+    reports list user names and addresses.
+
+    Args:
+        path (str): The spool directory.
+    """
+
+    def __init__(self, path=DEFAULT_SPOOL_DIR):
+        self.path = path
+        for name in ('tmp', 'new', 'cur', 'dead'):
+            os.makedirs(os.path.join(path, name), mode=0o700, exist_ok=True)
+
+    def _path(self, state, name):
+        return os.path.join(self.path, state, name)
+
+    def _write(self, state, name, item):
+        tmp_path = self._path('tmp', name)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as item_file:
+            json.dump(item, item_file)
+            item_file.flush()
+            os.fsync(item_file.fileno())
+        os.replace(tmp_path, self._path(state, name))
+        fsync_directory(os.path.join(self.path, state))
+
+    def enqueue(self, message, recipients, sender=None):
+        """
+        Queue a message for delivery.
+
+        Args:
+            message (email.message.Message): The message.
+            recipients (list): The recipient addresses.
+            sender (str): The envelope sender; defaults to the From header.
+
+        Returns:
+            str: The name of the queued item.
+        """
+        return self.enqueue_raw(message.as_string(), recipients,
+                                sender or message['From'])
+
+    def enqueue_raw(self, payload, recipients, sender):
+        """
+        Queue an already serialised message for delivery.
+
+        Args:
+            payload (str): The message, as returned by as_string().
+            recipients (list): The recipient addresses.
+            sender (str): The envelope sender.
+
+        Returns:
+            str: The name of the queued item.
+        """
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+        self._write('new', name, {
+            'sender': sender,
+            'recipients': list(recipients),
+            'message': payload,
+            'queued_at': time.time(),
+            'attempts': 0,
+            'next_attempt': 0,
+            'last_error': None,
+        })
+        return name
+
+    def pending(self, state='new'):
+        """
+        List the items in a state, oldest first.
+
+        Args:
+            state (str): 'new', 'cur' or 'dead'.
+
+        Returns:
+            list: The item names.
+        """
+        return sorted(name for name in os.listdir(os.path.join(self.path,
+                                                               state))
+                      if name.endswith('.json'))
+
+    def claim(self, name, now=None):
+        """
+        Claim a queued item for delivery, if it is due.
+
+        Args:
+            name (str): The item name.
+            now (float): The current time; defaults to time.time().
+
+        Returns:
+            dict: The item, or None when it is not due or another worker
+            claimed it first.
+        """
+        now = time.time() if now is None else now
+        try:
+            with open(self._path('new', name), encoding='utf-8') as item_file:
+                item = json.load(item_file)
+        except (OSError, ValueError):
+            return None
+        if item.get('next_attempt', 0) > now:
+            return None
+        try:
+            os.rename(self._path('new', name), self._path('cur', name))
+        except FileNotFoundError:
+            return None
+        os.utime(self._path('cur', name))
+        return item
+
+    def complete(self, name):
+        """
+        Remove a delivered item.
+
+        Args:
+            name (str): The item name.
+        """
+        os.unlink(self._path('cur', name))
+
+    def retry(self, name, item, error, delay):
+        """
+        Return a claimed item to the queue after a failed attempt.
+
+        Args:
+            name (str): The item name.
+            item (dict): The item.
+            error (Exception): The error of the attempt.
+            delay (float): Seconds before the next attempt.
+        """
+        item = dict(item, next_attempt=time.time() + delay,
+                    last_error=str(error))
+        self._write('new', name, item)
+        os.unlink(self._path('cur', name))
+
+    def bury(self, name, item, error):
+        """
+        Move a claimed item to the dead-letter directory.
+
+        Args:
+            name (str): The item name.
+            item (dict): The item.
+            error (Exception): The error of the last attempt.
+        """
+        self._write('dead', name, dict(item, last_error=str(error),
+                                       failed_at=time.time()))
+        os.unlink(self._path('cur', name))
+
+    def recover(self, timeout=CLAIM_TIMEOUT):
+        """
+        Requeue items claimed by a worker that crashed.
+
+        Args:
+            timeout (float): Claims older than this many seconds are
+            considered orphaned.
+
+        Returns:
+            int: The number of items requeued.
+        """
+        recovered = 0
+        now = time.time()
+        for name in self.pending('cur'):
+            path = self._path('cur', name)
+            try:
+                if now - os.stat(path).st_mtime < timeout:
+                    continue
+                if os.path.exists(self._path('new', name)):
+                    # Requeued before the crash; the claimed copy is stale
+                    os.unlink(path)
+                else:
+                    os.rename(path, self._path('new', name))
+                    recovered += 1
+            except FileNotFoundError:
+                continue
+        return recovered
+
+
+class SpoolDispatcher:
+    """
+    Delivers spooled messages with bounded concurrency.
+
+    Each pass claims the due messages and sends them on 'workers' threads,
+    each with its own SMTP connection for the messages of one sender.
+    Failed messages are retried with exponential backoff and full jitter,
+    and moved to the dead-letter directory after 'max_attempts' attempts
+    or a permanent failure; both are reported on standard error.
+
+    The dispatcher counts the messages delivered, retried and
+    dead-lettered since it was created; see totals.
+
+    Args:
+        spool (MailSpool): The spool drained.
+        open_transport (callable): Called with the envelope sender of the
+        messages, returns a new mailer.SmtpTransport.
+        workers (int): The messages delivered at the same time.
+        max_attempts (int): The attempts before a message is dead-lettered.
+        backoff (float): The base delay between attempts, in seconds.
+        metrics (metrics.Metrics): Receives the delivery counters.
+    """
+
+    def __init__(self, spool, open_transport, workers=DISPATCH_WORKERS,
+                 max_attempts=MAX_ATTEMPTS, backoff=RETRY_BACKOFF,
+                 metrics=None):
+        self.spool = spool
+        self.open_transport = open_transport
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.metrics = metrics
+        self.totals = collections.Counter()
+        self._totals_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def retry_delay(self, attempts):
+        """
+        Pick the delay before the next attempt.
+
+        Args:
+            attempts (int): The attempts made so far.
+
+        Returns:
+            float: A random delay up to the exponential backoff cap.
+        """
+        return random.uniform(0, min(MAX_RETRY_BACKOFF,
+                                     self.backoff * 2 ** (attempts - 1)))
+
+    def count(self, name, value=1):
+        """
+        Add to a delivery counter, and to the metrics when they are
+        recorded.
+
+        Args:
+            name (str): The counter name; see metrics.COUNTERS.
+            value (int): The amount added.
+        """
+        with self._totals_lock:
+            self.totals[name] += value
+        if self.metrics is not None:
+            self.metrics.add(name, value)
+
+    def deliver(self, claimed):
+        """
+        Deliver claimed items over one SMTP connection.
+
+        Args:
+            claimed (list): (name, item) pairs claimed by this worker, all
+            with the same sender.
+
+        Returns:
+            int: The number of messages delivered.
+        """
+        delivered = 0
+        transport = self.open_transport(claimed[0][1]['sender'])
+        try:
+            for name, item in claimed:
+                if self.stopping.is_set():
+                    self.spool.retry(name, item, 'dispatcher stopped', 0)
+                    continue
+                attempts = item.get('attempts', 0) + 1
+                item = dict(item, attempts=attempts)
+                try:
+                    refused = transport.send_raw(
+                        item['message'], item['recipients'], item['sender'])
+                except (OSError, smtplib.SMTPException) as e:
+                    if is_permanent(e) or attempts >= self.max_attempts:
+                        print(f"Giving up on message {name}: {e}",
+                              file=sys.stderr)
+                        self.spool.bury(name, item, e)
+                        self.count('mail_dead_lettered')
+                    else:
+                        delay = self.retry_delay(attempts)
+                        print(f"Delivery of message {name} failed, retrying "
+                              f"in {delay:.0f}s: {e}", file=sys.stderr)
+                        self.spool.retry(name, item, e, delay)
+                        self.count('mail_retried')
+                    continue
+                if refused:
+                    print(f"Message {name} refused for "
+                          f"{', '.join(sorted(refused))}", file=sys.stderr)
+                self.spool.complete(name)
+                self.count('mail_sent')
+                delivered += 1
+        finally:
+            transport.close()
+            self.count('smtp_connections', transport.connections_opened)
+            self.count('smtp_round_trips', transport.round_trips)
+        return delivered
+
+    def dispatch_once(self):
+        """
+        Deliver every message that is due.
+
+        Returns:
+            int: The number of messages delivered.
+        """
+        self.spool.recover()
+        claimed = []
+        for name in self.spool.pending():
+            item = self.spool.claim(name)
+            if item is not None:
+                claimed.append((name, item))
+        if not claimed:
+            return 0
+        # Each connection sends as one sender, which may have its own
+        # SMTP settings
+        by_sender = collections.defaultdict(list)
+        for name, item in claimed:
+            by_sender[item['sender']].append((name, item))
+        batches = []
+        for items in by_sender.values():
+            workers = min(self.workers, len(items))
+            batches.extend(items[index::workers] for index in range(workers))
+        with ThreadPoolExecutor(
+                max_workers=min(self.workers, len(batches))) as pool:
+            return sum(pool.map(self.deliver, batches))
+
+    def run(self, interval=DISPATCH_INTERVAL):
+        """
+        Deliver due messages every 'interval' seconds until stopped.
+
+        Args:
+            interval (float): The seconds between two passes.
+        """
+        while not self.stopping.is_set():
+            try:
+                self.dispatch_once()
+            except OSError as e:
+                print(f"Mail spool error: {e}", file=sys.stderr)
+            self.stopping.wait(interval)
+
+    def start(self, interval=DISPATCH_INTERVAL):
+        """
+        Start delivering in a background thread.
+
+        Args:
+            interval (float): The seconds between two passes.
+        """
+        self.thread = threading.Thread(target=self.run, args=(interval,),
+                                       name='mail-dispatcher', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the background thread once its current message is sent.
+
+        Args:
+            timeout (float): The longest wait for the thread, in seconds.
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+
+def open_spool(config):
+    """
+    Create the mail spool described by the configuration.
+
+    Args:
+        config (dict): The loaded configuration. 'mail_spool_dir' sets the
+        spool directory, or disables spooling when null.
+
+    Returns:
+        MailSpool: The spool, or None when spooling is disabled.
+    """
+    path = config.get('mail_spool_dir', DEFAULT_SPOOL_DIR)
+    if not path:
+        return None
+    return MailSpool(path)
+
+
+def dispatcher_from_config(config, metrics=None, senders=None):
+    """
+    Create the dispatcher of the configured spool.
+
+    Args:
+        config (dict): The loaded configuration. 'mail_dispatch_workers',
+        'mail_max_attempts' and 'mail_retry_backoff' are optional; the SMTP
+        settings are read by mailer.open_transport.
+        metrics (metrics.Metrics): Receives the delivery counters.
+        senders (dict): Configurations by their 'gmail_username', whose
+        SMTP settings send the messages of that sender; 'config' sends the
+        others.
+
+    Returns:
+        SpoolDispatcher: The dispatcher, or None when spooling is disabled.
+    """
+    spool = open_spool(config)
+    if spool is None:
+        return None
+    senders = senders or {}
+    return SpoolDispatcher(
+        spool,
+        lambda sender: mailer.open_transport(senders.get(sender, config)),
+        workers=config.get('mail_dispatch_workers', DISPATCH_WORKERS),
+        max_attempts=config.get('mail_max_attempts', MAX_ATTEMPTS),
+        backoff=config.get('mail_retry_backoff', RETRY_BACKOFF),
+        metrics=metrics
+    )
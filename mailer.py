@@ -0,0 +1,201 @@
+"""
+This module delivers email through a reusable, authenticated SMTP
+connection that is reopened when dropped or after a number of messages.
+"""
+
+import smtplib
+
+# Defaults for Gmail over TLS (port 587); SSL (port 465) is deprecated.
+DEFAULT_SMTP_HOST = 'smtp.gmail.com'
+DEFAULT_SMTP_PORT = 587
+# Messages sent over one connection before it is recycled.
+MAX_MESSAGES_PER_CONNECTION = 100
+# Recipients placed on a single message envelope.
+MAX_RECIPIENTS_PER_MESSAGE = 50
+# Seconds allowed for connecting and for each SMTP reply.
+SMTP_TIMEOUT = 30
+
+
+def normalize_recipients(recipients):
+    """
+    Turn a recipient setting into a list of addresses.
+
+    Args:
+        recipients (str or list): One address, a comma-separated string of
+        addresses, or a list of addresses.
+
+    Returns:
+        list: The addresses, without blanks or duplicates.
+    """
+    if isinstance(recipients, str):
+        recipients = recipients.split(',')
+    addresses = []
+    for address in recipients or []:
+        address = address.strip()
+        if address and address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+class SmtpTransport:
+    """
+    An SMTP session shared by many messages.
+
+    The connection is opened on first use, upgraded with STARTTLS and
+    authenticated when both a username and a password are given. It is
+    closed and reopened after 'max_messages' messages, and reopened once if
+    the server drops it in the middle of a send.
+
+    'round_trips' counts the SMTP replies read from the server so far, the
+    greeting included, so each command and reply exchange counts once and
+    DATA twice (once for the go-ahead, once after the message).
+    """
+
+    def __init__(self, host=DEFAULT_SMTP_HOST, port=DEFAULT_SMTP_PORT,
+                 username=None, password=None, starttls=True,
+                 max_messages=MAX_MESSAGES_PER_CONNECTION,
+                 max_recipients=MAX_RECIPIENTS_PER_MESSAGE,
+                 timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.max_messages = max(1, max_messages)
+        self.max_recipients = max(1, max_recipients)
+        self.timeout = timeout
+        self.smtp = None
+        self.sent_on_connection = 0
+        self.connections_opened = 0
+        self.round_trips = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self):
+        """
+        Open and authenticate a new connection.
+
+        Raises:
+            smtplib.SMTPException: If the server rejects the session.
+        """
+        self.close()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        # The greeting was read while connecting
+        self.round_trips += 1
+        smtp.getreply = self._counted(smtp.getreply)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except (OSError, smtplib.SMTPException):
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.sent_on_connection = 0
+        self.connections_opened += 1
+
+    def _counted(self, getreply):
+        # Wrap SMTP.getreply, through which smtplib reads every reply
+        def counted_getreply():
+            self.round_trips += 1
+            return getreply()
+        return counted_getreply
+
+    def close(self):
+        """
+        Close the current connection, if any.
+        """
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (OSError, smtplib.SMTPException):
+            self.smtp.close()
+        finally:
+            self.smtp = None
+
+    def _send_envelope(self, sender, recipients, payload):
+        if self.smtp is None or self.sent_on_connection >= self.max_messages:
+            self.connect()
+        try:
+            refused = self.smtp.sendmail(sender, recipients, payload)
+        except smtplib.SMTPServerDisconnected:
+            self.connect()
+            refused = self.smtp.sendmail(sender, recipients, payload)
+        self.sent_on_connection += 1
+        return refused
+
+    def send(self, message, recipients, sender=None):
+        """
+        Send a message to any number of recipients.
+
+        Recipients are batched 'max_recipients' to an envelope, so large
+        recipient lists take a handful of SMTP transactions.
+
+        Args:
+            message (email.message.Message): The message to send.
+            recipients (str or list): The recipient addresses.
+            sender (str): The envelope sender; defaults to the From header.
+
+        Returns:
+            dict: The recipients refused by the server, as returned by
+            smtplib.SMTP.sendmail.
+
+        Raises:
+            smtplib.SMTPException: If the message cannot be delivered.
+        """
+        return self.send_raw(message.as_string(), recipients,
+                             sender or message['From'])
+
+    def send_raw(self, payload, recipients, sender):
+        """
+        Send an already serialised message to any number of recipients.
+
+        Args:
+            payload (str): The message, as returned by as_string().
+            recipients (str or list): The recipient addresses.
+            sender (str): The envelope sender.
+
+        Returns:
+            dict: The recipients refused by the server.
+
+        Raises:
+            smtplib.SMTPException: If the message cannot be delivered.
+        """
+        recipients = normalize_recipients(recipients)
+        refused = {}
+        for start in range(0, len(recipients), self.max_recipients):
+            batch = recipients[start:start + self.max_recipients]
+            refused.update(self._send_envelope(sender, batch, payload) or {})
+        return refused
+
+
+def open_transport(config):
+    """
+    Create the SMTP transport described by the configuration.
+
+    Args:
+        config (dict): The loaded configuration. 'smtp_host', 'smtp_port',
+        'smtp_starttls', 'smtp_max_messages' and 'smtp_timeout' are
+        optional and default to Gmail over STARTTLS; 'gmail_username' and
+        'gmail_app_password' are used to log in, unless the password is
+        empty.
+
+    Returns:
+        SmtpTransport: The transport, not yet connected.
+    """
+    return SmtpTransport(
+        host=config.get('smtp_host', DEFAULT_SMTP_HOST),
+        port=config.get('smtp_port', DEFAULT_SMTP_PORT),
+        username=config.get('gmail_username'),
+        password=config.get('gmail_app_password'),
+        starttls=config.get('smtp_starttls', True),
+        max_messages=config.get('smtp_max_messages',
+                                MAX_MESSAGES_PER_CONNECTION),
+        timeout=config.get('smtp_timeout', SMTP_TIMEOUT)
+    )
@@ -1,13 +1,42 @@
 """
 This module authenticates with the Plextrac API, searches for specific emails,
 and sends an email notification using Gmail SMTP.
+
+Run it as a command:
+
+    python main.py [scan|report|send|dispatch|audit] [--dry-run]
+                   [--config PATH]
+
+The HTTP, database and mail stacks are imported inside the functions that
+need them, so each command only pays for the modules it uses.
 """
+# pylint: disable=import-outside-toplevel
 
-import smtplib
+import argparse
 import json
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import requests
+import os
+import subprocess
+import sys
+
+CONFIG_PATH = 'config.json'
+COMMANDS = ('scan', 'report', 'send', 'dispatch', 'audit')
+# Project modules each command imports, measured by --import-profile.
+COMMAND_MODULES = {
+    'scan': ('engine', 'snapshot_store'),
+    'report': ('engine', 'snapshot_store', 'report'),
+    'send': ('engine', 'snapshot_store', 'report', 'mailer', 'mail_spool',
+             'metrics', 'notify', 'email.mime.multipart', 'email.mime.text',
+             'email.mime.application'),
+    'dispatch': ('mailer', 'mail_spool', 'metrics'),
+    'audit': ('audit_log',),
+}
+# Number of imports listed by --import-profile.
+IMPORT_PROFILE_TOP = 15
+# Number of customer reports generated at the same time.
+MAX_CONCURRENT_REPORTS = 4
+# Environment variables setting --profile and --profile-rate.
+PROFILE_ENV = 'PLEXTRAC_MFA_PROFILE'
+PROFILE_RATE_ENV = 'PLEXTRAC_MFA_PROFILE_RATE'
 
 
 def authenticate_and_send_email():
@@ -25,107 +54,1038 @@ def authenticate_and_send_email():
     Raises:
         requests.exceptions.RequestException: If an error occurs during API
         requests.
-        smtplib.SMTPException: If an error occurs during SMTP operations.
+        smtplib.SMTPException: If an error occurs during SMTP operations
+        while sending inline ('mail_spool_dir' set to null), so that the
+        report reaches no sink.
+        mail_spool.UndeliveredMail: If the report is still queued in the
+        mail spool after the delivery pass.
 
     Notes:
         - Ensure 'config.json' contains 'plextrac_username',
         'plextrac_password', 'plextrac_url','gmail_username',
         'gmail_app_password', and 'customer_domains' fields.
         - Use TLS (port 587) for SMTP as SSL (port 465) is deprecated.
+        'smtp_host' and 'smtp_port' point delivery at another server.
+        - 'poc_email' may hold one address or a list of recipients.
         - Specify customer email domains in 'customer_domains' key in
         config.json.
+        - Optional 'page_size' and 'prefetch_pages' keys tune how users are
+        paged from the API.
+        - An optional 'instances' list scans several Plextrac instances or
+        tenants in one run; see engine.scan_targets.
+        - Each scan is stored in the 'snapshot_db' SQLite file. Set
+        'report_mode' to 'delta' to only report changes since the previous
+        scan.
+        - 'report_formats' lists any of 'plain', 'html' and 'csv'; reports
+        larger than 'max_message_bytes' are split across messages.
+        - An optional 'customers' list reports on several customers of the
+        same tenants from a single fetch; each entry may override
+        'customer', 'customer_domains', 'poc_email' and the report options.
+        See engine.customer_configs.
+        - The timings and counters of each phase are written to the
+        Prometheus textfile named by 'metrics_textfile' and the JSON
+        summary named by 'metrics_json', when set.
+        - Messages are queued in the 'mail_spool_dir' directory and
+        delivered from there, with retries; see mail_spool. Set it to null
+        to send inline.
+        - Events of each scan are written to the NDJSON file named by
+        'audit_log', when set; see audit_log.
     """
-    # Load configuration from config.json
-    with open('config.json', encoding='utf-8') as config_file:
-        config = json.load(config_file)
-
-    # Authenticate with Plextrac API
-    response = requests.post(
-        url=f"{config['plextrac_url']}/api/v1/authenticate",
-        json={
-            "username": config['plextrac_username'],
-            "password": config['plextrac_password']
-        },
-        timeout=10  # Add timeout
-    )
-    response.raise_for_status()  # Raise exception for bad response status
-
-    # Set authorization headers for subsequent requests
-    headers = {
-        "Authorization": f"Bearer {response.json()['token']}"
-    }
-
-    def search_emails_in_data(json_obj):
-        """
-        Helper function to search for specific emails in JSON data.
-        """
-        search_terms = config['customer_domains']  # Read domains from config
-        matches = []
-
-        if isinstance(json_obj, dict) and 'data' in json_obj \
-                and isinstance(json_obj['data'], list):
-            for item in json_obj['data']:
-                if isinstance(item, dict) and 'email' in item:
-                    email = item['email']
-                    if any(term in email for term in search_terms):
-                        matches.append(item)
-        return matches
-
-    # Retrieve users from Plextrac API based on authenticated session
-    user_endpoint = requests.get(
-        url=f"{config['plextrac_url']}/api/v2/tenants/"
-            f"{response.json()['tenant_id']}/users",
-        params={'limit': 100},
-        headers=headers,
-        timeout=10  # Add timeout
-    )
-    user_endpoint.raise_for_status()  # Raise exception for bad response status
-    user_data = user_endpoint.json()
+    run_scan(load_config(), deliver=True)
 
-    # Search for users matching specified criteria
-    customer_users = search_emails_in_data(user_data)
 
-    # Prepare the email body with user information
-    body = (
-        f"The following users are not compliant with the {config['customer']} "
-        f"requirement for MFA enabled on the Plextrac Platform:\n\n"
-    )
-    for user in customer_users:
-        if not user['mfa']['enabled']:
-            body += f"Name: {user['fullName']}\nEmail: {user['email']}\n\n"
+def load_config(path=CONFIG_PATH):
+    """
+    Load the configuration file.
+
+    Args:
+        path (str): The path of the JSON configuration.
+
+    Returns:
+        dict: The configuration.
+
+    Raises:
+        json.JSONDecodeError: If the file is not valid JSON.
+    """
+    with open(path, encoding='utf-8') as config_file:
+        return json.load(config_file)
+
+
+def scans_noncompliant_only(config):
+    """
+    Tell whether a scan leaves out the users with MFA enabled.
+
+    Without snapshots only non-compliant users are ever reported, so when
+    filters are pushed down the API is only asked for those. Counts of
+    customer users then cover the non-compliant ones only.
+
+    Args:
+        config (dict): The configuration.
+
+    Returns:
+        bool: True when only non-compliant users are fetched.
+    """
+    import snapshot_store
+
+    return bool(config.get('filter_pushdown')) \
+        and not config.get('snapshot_db', snapshot_store.DEFAULT_DB_PATH)
+
+
+def scan_users(config, clients=None, dry_run=False, metrics=None,
+               cache=None):
+    """
+    Scan every target and record the result in the snapshot store.
+
+    When 'input_path' names a user dump, it is scanned instead of the API
+    and the result is compared with the last scan without being stored.
+
+    Args:
+        config (dict): The configuration.
+        clients (dict): Plextrac clients by instance URL, kept open across
+        calls by long-running callers; see engine.scan_all.
+        dry_run (bool): Compute the delta without storing the scan.
+        metrics (metrics.Metrics): Receives the phases and counters of the
+        scan, and its 'scan_start' and 'scan_end' audit events.
+        cache (token_cache.TokenCache): The token cache, kept across
+        calls by long-running callers; by default the one described by
+        the configuration.
+
+    Returns:
+        tuple: The customer users and the snapshot_store.Delta, or None
+        when snapshots are disabled.
+
+    Raises:
+        requests.exceptions.RequestException: If every target fails.
+        OSError: If the user dump cannot be read.
+        ValueError: If the user dump is not valid JSON or NDJSON.
+    """
+    import engine
+    import snapshot_store
+
+    scan_config = config
+    if scans_noncompliant_only(config):
+        scan_config = dict(config, noncompliant_only=True)
+
+    targets = engine.scan_targets(config)
+    if metrics is not None:
+        metrics.event('scan_start',
+                      targets=[engine.target_label(target)
+                               for target in targets],
+                      input=config.get('input_path'), dry_run=dry_run)
+    if config.get('input_path'):
+        import user_dump
+
+        # Read a saved dump in place of the API
+        customer_users, errors = user_dump.scan_dump(scan_config, metrics)
+    else:
+        # Scan every configured instance and tenant concurrently
+        customer_users, errors = engine.scan_all(scan_config, clients,
+                                                 metrics, cache)
+    for label, error in errors:
+        print(f"Error scanning {label}: {error}", file=sys.stderr)
+    failed = bool(errors) and len(errors) == len(targets)
+    if metrics is not None:
+        metrics.event('scan_end', success=not failed,
+                      users=len(customer_users),
+                      noncompliant=sum(1 for user in customer_users
+                                       if engine.is_noncompliant(user)),
+                      errors=[{'target': label, 'error': str(error)}
+                              for label, error in errors])
+    if failed:
+        raise errors[0][1]
+
+    # Persist the scan and work out what changed since the previous one;
+    # dumps are compared with the last scan but never stored, and neither
+    # are scans missing a failed target, whose users would look removed
+    delta = None
+    persist = not dry_run and not config.get('input_path')
+    store = snapshot_store.open_snapshot_store(config)
+    if store is not None:
+        if errors and persist:
+            print("Scan incomplete; snapshot not saved", file=sys.stderr)
+        with store:
+            if metrics is None:
+                delta = store.record_scan(customer_users, persist=persist,
+                                          complete=not errors)
+            else:
+                with metrics.phase('snapshot'):
+                    delta = store.record_scan(customer_users,
+                                              persist=persist,
+                                              complete=not errors)
+    return customer_users, delta
+
+
+def report_sections(config, customer_users, delta):
+    """
+    Choose the introduction and sections of the report.
+
+    Args:
+        config (dict): The configuration.
+        customer_users (list): The customer users found by the scan.
+        delta (snapshot_store.Delta): The changes since the previous scan,
+        or None.
+
+    Returns:
+        tuple: The introduction and the (heading, users) sections.
+    """
+    import engine
+    import report
+
+    return report.report_sections(config, customer_users, delta,
+                                  engine.is_noncompliant)
+
+
+def send_report(config, intro, sections, dry_run=False, metrics=None):
+    """
+    Render the report and deliver it to every notification sink.
+
+    The report is rendered once and handed to the sinks concurrently; see
+    notify.open_sinks. Email goes to the 'poc_email' recipients.
+
+    Args:
+        config (dict): The configuration.
+        intro (str): The introduction of the report.
+        sections (list): The (heading, users) sections of the report.
+        dry_run (bool): Build the messages without delivering them.
+        metrics (metrics.Metrics): Receives the 'render' phase, a 'send'
+        phase per sink, the report size and the delivery work, labelled
+        with the customer, and a 'delivery' audit event per sink.
+
+    Raises:
+        ValueError: If a notification sink is misconfigured.
+        Exception: The error of the first sink, if every sink fails, so
+        a report that reached no one fails the run.
+    """
+    import mailer
+    import metrics as metrics_module
+    import notify
+    import report
+
+    if metrics is None:
+        metrics = metrics_module.Metrics()
+    customer = config.get('customer', '')
+    subject = "MFA Non-compliant Users"
+    sinks = notify.open_sinks(config)
+    recipients = mailer.normalize_recipients(config.get('poc_email'))
+
+    # Render the report, split into several messages if it is too large
+    with metrics.phase('render', customer=customer):
+        messages = report.build_messages(
+            intro, sections, subject,
+            formats=config.get('report_formats', report.DEFAULT_FORMATS),
+            max_bytes=config.get('max_message_bytes',
+                                 report.MAX_MESSAGE_BYTES)
+        )
+        for message in messages:
+            message['From'] = config['gmail_username']
+            message['To'] = ', '.join(recipients)
+        notification = notify.build_notification(
+            customer, subject, intro, sections, recipients, messages)
+    metrics.add('report_messages', len(messages), customer=customer)
+
+    if dry_run:
+        # Nothing is serialised for delivery, so measure the messages here
+        size = sum(len(message.as_string()) for message in messages)
+        metrics.add('report_bytes', size, customer=customer)
+        print(f"Dry run: {len(messages)} message(s), {size} bytes, not sent "
+              f"to {', '.join(sink.name for sink in sinks)}", file=sys.stderr)
+        for sink in sinks:
+            metrics.event('delivery', customer=customer, sink=sink.name,
+                          status='dry_run')
+        return
+
+    errors = notify.fan_out(sinks, notification, metrics)
+    for name, error in errors:
+        print(f"Error sending report to {name}: {error}", file=sys.stderr)
+    if errors and len(errors) == len(sinks):
+        raise errors[0][1]
+
+
+def report_customer(config, customer_users, delta, dry_run=False,
+                    metrics=None):
+    """
+    Build and send the report of one customer.
+
+    Args:
+        config (dict): The configuration of the customer.
+        customer_users (list): The users of the customer.
+        delta (snapshot_store.Delta): The changes of the customer since the
+        previous scan, or None.
+        dry_run (bool): Build the messages without connecting to SMTP.
+        metrics (metrics.Metrics): Receives the phases and counters of the
+        report.
+    """
+    intro, sections = report_sections(config, customer_users, delta)
+    send_report(config, intro, sections, dry_run, metrics)
+
+
+def report_customers(config, customer_users, delta, dry_run=False,
+                     metrics=None):
+    """
+    Route the users of one scan to their customers and report on each.
+
+    Reports are generated and sent concurrently, up to
+    'max_concurrent_reports' at a time. A failing report does not stop the
+    others.
+
+    Args:
+        config (dict): The configuration.
+        customer_users (list): The users found by the scan.
+        delta (snapshot_store.Delta): The changes since the previous scan,
+        or None.
+        dry_run (bool): Build the messages without connecting to SMTP.
+        metrics (metrics.Metrics): Receives the phases and counters of each
+        report.
+
+    Raises:
+        Exception: The first error, if every report fails.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import engine
+
+    customers = engine.customer_configs(config)
+    routed = engine.route_users(customer_users, customers)
+    deltas = engine.route_delta(delta, customers)
+    workers = max(1, min(len(customers),
+                         config.get('max_concurrent_reports',
+                                    MAX_CONCURRENT_REPORTS)))
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(report_customer, customer, users,
+                               customer_delta, dry_run, metrics)
+                   for customer, users, customer_delta
+                   in zip(customers, routed, deltas)]
+        for customer, future in zip(customers, futures):
+            try:
+                future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Error reporting {customer.get('customer')}: {e}",
+                      file=sys.stderr)
+                errors.append(e)
+    if errors and len(errors) == len(customers):
+        raise errors[0]
+
+
+def start_profiler(profile):
+    """
+    Start profiling a run, when it is sampled.
+
+    Args:
+        profile (profiling.ProfileSettings): The profiling settings, or
+        None when profiling is disabled.
+
+    Returns:
+        profiling.RunProfiler: The started profiler, or None.
+    """
+    if profile is None:
+        return None
+    import profiling
+
+    profiler = profiling.sampled_profiler(profile)
+    if profiler is not None:
+        profiler.start()
+    return profiler
+
+
+def stop_profiler(profiler):
+    """
+    Stop profiling a run and write its profiles.
+
+    Args:
+        profiler (profiling.RunProfiler): The profiler, or None.
+    """
+    if profiler is None:
+        return
+    try:
+        print(f"Profile written to {profiler.stop()}", file=sys.stderr)
+    except OSError as e:
+        print(f"Error writing profile: {e}", file=sys.stderr)
+
+
+def open_audit_log(config):
+    """
+    Start the audit log of a run, when 'audit_log' is set.
+
+    A log that cannot be opened is reported and the run goes on without
+    it.
+
+    Args:
+        config (dict): The configuration.
+
+    Returns:
+        audit_log.AuditLog: The started log, or None.
+    """
+    if not config.get('audit_log'):
+        return None
+    import audit_log
+
+    try:
+        return audit_log.open_audit_log(config)
+    except OSError as e:
+        print(f"Error opening audit log: {e}", file=sys.stderr)
+        return None
+
+
+def close_audit_log(audit):
+    """
+    Write the remaining events of a run and stop its audit log.
+
+    Args:
+        audit (audit_log.AuditLog): The log, or None.
+    """
+    if audit is not None:
+        audit.close()
+
+
+def shared_audit_log(config, audit_logs, lock):
+    """
+    Open the audit log of a daemon run once per file and process.
+
+    The daemon's scans and spool retries run on different threads. Runs
+    sharing one log keep a single writer per file, so recovery, rotation
+    and index updates never race. The logs are left open for later runs.
+
+    Args:
+        config (dict): The configuration of the run.
+        audit_logs (dict): The open logs by absolute path.
+        lock (threading.Lock): Guards 'audit_logs'.
+
+    Returns:
+        audit_log.AuditLog: The log, or None when 'audit_log' is not set
+        or cannot be opened.
+    """
+    path = config.get('audit_log')
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    with lock:
+        audit = audit_logs.get(path)
+        if audit is None:
+            audit = open_audit_log(config)
+            if audit is not None:
+                audit_logs[path] = audit
+        return audit
+
+
+def print_audit(config, tenant=None, email=None, since=None, until=None):
+    """
+    Print the audit events matching the given filters, as NDJSON.
+
+    Args:
+        config (dict): The configuration; 'audit_log' names the log.
+        tenant (str): Keep the events of this tenant.
+        email (str): Keep the events about this email.
+        since (float): Keep the events at or after this Unix time.
+        until (float): Keep the events at or before this Unix time.
+
+    Returns:
+        int: 1 when no audit log is configured, 0 otherwise.
+    """
+    if not config.get('audit_log'):
+        print("No audit log configured; set 'audit_log' in the "
+              "configuration", file=sys.stderr)
+        return 1
+    import audit_log
+
+    for event in audit_log.query(config['audit_log'], tenant, email, since,
+                                 until):
+        print(json.dumps(event, separators=(',', ':')))
+    return 0
+
+
+def sender_configs(configs):
+    """
+    Find the configuration sending as each sender address.
+
+    Args:
+        configs (list): The configurations whose messages may be spooled.
+
+    Returns:
+        dict: The configuration of each customer by its 'gmail_username';
+        the first one wins when several customers share an address.
+    """
+    import engine
+
+    senders = {}
+    for config in configs:
+        for customer in engine.customer_configs(config):
+            senders.setdefault(customer.get('gmail_username'), customer)
+    return senders
+
 
-    # Create a multipart message and set headers
-    message = MIMEMultipart()
-    message['From'] = config['gmail_username']
-    message['To'] = "user@example.com"  # Replace with the recipient's email
-    # address
-    message['Subject'] = "MFA Non-compliant Users"
+def deliver_spool(config, metrics=None, configs=None):
+    """
+    Deliver the messages waiting in the mail spool, once each.
+
+    Messages that fail stay queued with a backoff, for the next pass; each
+    failure is reported on standard error by the dispatcher. Messages are
+    sent with the SMTP settings of the customer whose 'gmail_username'
+    sent them.
+
+    Args:
+        config (dict): The configuration.
+        metrics (metrics.Metrics): Receives the 'deliver' phase and the
+        delivery counters.
+        configs (list): The configurations whose messages may be spooled,
+        such as those of every schedule; defaults to 'config' alone.
+
+    Returns:
+        int: The number of messages delivered.
+
+    Raises:
+        mail_spool.UndeliveredMail: If messages are still queued after the
+        pass, or were dead-lettered by it.
+    """
+    import mail_spool
+    import metrics as metrics_module
+
+    if metrics is None:
+        metrics = metrics_module.Metrics()
+    try:
+        dispatcher = mail_spool.dispatcher_from_config(
+            config, metrics, sender_configs(configs or [config]))
+        if dispatcher is None:
+            return 0
+        with metrics.phase('deliver'):
+            delivered = dispatcher.dispatch_once()
+        waiting = len(dispatcher.spool.pending())
+    except OSError as e:
+        raise mail_spool.UndeliveredMail(
+            f"Error delivering spooled mail: {e}") from e
+    if delivered:
+        print(f"Delivered {delivered} spooled message(s)", file=sys.stderr)
+    dead = dispatcher.totals['mail_dead_lettered']
+    if waiting or dead:
+        raise mail_spool.UndeliveredMail(
+            f"{waiting} message(s) still queued in {dispatcher.spool.path} "
+            f"and {dead} dead-lettered")
+    return delivered
+
+
+def run_dispatch(config, configs=None, audit=None):
+    """
+    Deliver the mail spool as a run of its own.
+
+    The run is audited, and its metrics are exported when it attempted a
+    delivery, so idle passes do not replace the figures of the last scan.
+
+    Args:
+        config (dict): The configuration.
+        configs (list): The configurations whose messages may be spooled;
+        see deliver_spool.
+        audit (audit_log.AuditLog): A log shared with other runs, left
+        open; by default the run opens and closes its own 'audit_log'.
+
+    Returns:
+        int: The number of messages delivered.
+
+    Raises:
+        mail_spool.UndeliveredMail: If messages are still queued after the
+        pass, or were dead-lettered by it.
+    """
+    import metrics as metrics_module
+
+    own_audit = audit is None
+    if own_audit:
+        audit = open_audit_log(config)
+    metrics = metrics_module.Metrics(audit=audit)
+    success = False
+    try:
+        with metrics.phase('run'):
+            delivered = deliver_spool(config, metrics, configs)
+        success = True
+        return delivered
+    finally:
+        metrics.finish(success)
+        if own_audit:
+            close_audit_log(audit)
+        if any(metrics.total(name) for name in
+               ('mail_sent', 'mail_retried', 'mail_dead_lettered')):
+            try:
+                metrics_module.export(metrics, config)
+            except OSError as e:
+                print(f"Error writing metrics: {e}", file=sys.stderr)
+
+
+def daemon_token_cache(config, memory_caches):
+    """
+    Find the token cache of a daemon run.
+
+    Without a cache file, tokens are kept in memory for the life of the
+    daemon, as MfaComplianceScanner does, so scheduled runs do not log in
+    again while their tokens are valid.
+
+    Args:
+        config (dict): The configuration of the run.
+        memory_caches (dict): The in-memory caches by token lifetime,
+        kept across runs.
+
+    Returns:
+        token_cache.TokenCache: The file cache of the configuration, or
+        an in-memory cache when 'token_cache_path' is null.
+    """
+    import token_cache
+
+    cache = token_cache.open_token_cache(config)
+    if cache is not None:
+        return cache
+    ttl = config.get('token_ttl', token_cache.DEFAULT_TOKEN_TTL)
+    if ttl not in memory_caches:
+        memory_caches[ttl] = token_cache.MemoryTokenCache(ttl)
+    return memory_caches[ttl]
 
-    # Add body to email
-    message.attach(MIMEText(body, 'plain'))
 
+def retry_spool(scheduler, wake, audit_for):
+    """
+    Deliver the spooled messages of a daemon until it stops.
+
+    A pass runs every DISPATCH_INTERVAL seconds, and as soon as 'wake' is
+    set, such as after a scheduled scan queued its reports. Every pass is
+    built from the configuration the daemon has loaded last, so reloaded
+    and per-schedule SMTP settings apply.
+
+    Args:
+        scheduler (daemon.Daemon): The daemon whose schedules are used.
+        wake (threading.Event): Set to start a pass early.
+        audit_for (callable): Returns the shared audit log of a
+        configuration; see shared_audit_log.
+    """
+    import mail_spool
+
+    while not scheduler.stopping.is_set():
+        wake.wait(mail_spool.DISPATCH_INTERVAL)
+        wake.clear()
+        if scheduler.stopping.is_set() or not scheduler.schedules:
+            continue
+        config = scheduler.config
+        try:
+            run_dispatch(config,
+                         [config for _, config in scheduler.schedules],
+                         audit_for(config))
+        except mail_spool.UndeliveredMail:
+            pass  # each failed attempt was reported by the dispatcher
+
+
+def run_scan(config, clients=None, dry_run=False, profile=None,
+             deliver=False, audit=None, cache=None):
+    """
+    Scan, report and notify with an already loaded configuration.
+
+    See authenticate_and_send_email for the configuration keys.
+
+    Args:
+        config (dict): The configuration.
+        clients (dict): Plextrac clients by instance URL, kept open across
+        calls by long-running callers; see engine.scan_all.
+        dry_run (bool): Skip storing the scan and sending email.
+        profile (profiling.ProfileSettings): Profile the run, when it is
+        sampled.
+        deliver (bool): Deliver the spooled messages before returning,
+        for one-shot runs; the daemon leaves them to its dispatcher so
+        scans never wait on SMTP.
+        audit (audit_log.AuditLog): A log shared with other runs, left
+        open; by default the run opens and closes its own 'audit_log'.
+        cache (token_cache.TokenCache): The token cache; see scan_users.
+
+    Raises:
+        requests.exceptions.RequestException: If every target fails.
+        mail_spool.UndeliveredMail: If the report is still queued after
+        the delivery pass.
+    """
+    import engine
+    import metrics as metrics_module
+
+    profiler = start_profiler(profile)
+    own_audit = audit is None
+    if own_audit:
+        audit = open_audit_log(config)
+    metrics = metrics_module.Metrics(profiler, audit)
+    success = False
     try:
-        # Establish a SMTP connection to Gmail's server
-        smtp = smtplib.SMTP('smtp.gmail.com', 587)
+        with metrics.phase('run'):
+            customer_users, delta = scan_users(config, clients, dry_run,
+                                               metrics, cache)
+            metrics.add('users_noncompliant',
+                        sum(1 for user in customer_users
+                            if engine.is_noncompliant(user)))
+            report_customers(config, customer_users, delta, dry_run, metrics)
+            if deliver and not dry_run:
+                deliver_spool(config, metrics)
+        success = True
+    finally:
+        metrics.finish(success)
+        stop_profiler(profiler)
+        if own_audit:
+            close_audit_log(audit)
+        try:
+            metrics_module.export(metrics, config)
+        except OSError as e:
+            print(f"Error writing metrics: {e}", file=sys.stderr)
+
+
+def import_command_modules(command):
+    """
+    Import the modules a command needs, without running it.
+
+    Args:
+        command (str): One of COMMANDS.
+    """
+    import importlib
+
+    for module in COMMAND_MODULES[command]:
+        importlib.import_module(module)
+
+
+def parse_import_times(output):
+    """
+    Parse the report printed by 'python -X importtime'.
+
+    Args:
+        output (str): The captured standard error.
+
+    Returns:
+        list: (module, self microseconds, cumulative microseconds, depth)
+        tuples in import order.
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue  # the header line
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        depth = (len(name) - len(module) - 1) // 2
+        entries.append((module, self_us, cumulative_us, depth))
+    return entries
+
+
+def profile_imports(command, budget_ms=None, top=IMPORT_PROFILE_TOP):
+    """
+    Print the import cost of a command, like 'python -X importtime'.
+
+    The imports run in a fresh interpreter so nothing is already cached.
+
+    Args:
+        command (str): One of COMMANDS.
+        budget_ms (float): Fail when the total import time exceeds it.
+        top (int): The number of slowest top-level imports listed.
+
+    Returns:
+        int: 1 when the budget is exceeded, 0 otherwise.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         f"import main; main.import_command_modules({command!r})"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    entries = parse_import_times(result.stderr)
+    total_ms = sum(entry[1] for entry in entries) / 1000
+    print(f"Import profile of '{command}': {total_ms:.1f} ms in "
+          f"{len(entries)} modules")
+    print(f"{'cumulative ms':>14}  {'self ms':>8}  module")
+    roots = sorted((entry for entry in entries if entry[3] == 0),
+                   key=lambda entry: entry[2], reverse=True)
+    for module, self_us, cumulative_us, _ in roots[:top]:
+        print(f"{cumulative_us / 1000:>14.1f}  {self_us / 1000:>8.1f}  "
+              f"{module}")
+    if budget_ms is not None and total_ms > budget_ms:
+        print(f"Import time of {total_ms:.1f} ms exceeds the budget of "
+              f"{budget_ms:.1f} ms", file=sys.stderr)
+        return 1
+    return 0
 
-        # Start TLS encryption
-        smtp.starttls()
 
-        # Login to Gmail SMTP server
-        smtp.login(config['gmail_username'], config['gmail_app_password'])
+def profiled_metrics(profiler, audit=None):
+    """
+    Create the metrics through which a command is profiled and audited.
 
-        # Send email
-        smtp.sendmail(config['gmail_username'], "user@example.com",
-                      message.as_string())
-        print(f"Email sent successfully to {config['poc_email']}")
+    Args:
+        profiler (profiling.RunProfiler): The profiler, or None.
+        audit (audit_log.AuditLog): The audit log, or None.
 
-    except (requests.exceptions.RequestException, smtplib.SMTPException) as e:
-        print(f"Error sending email: {e}")
+    Returns:
+        metrics.Metrics: Metrics feeding the profiler and audit log, or
+        None when the command is neither profiled nor audited.
+    """
+    if profiler is None and audit is None:
+        return None
+    import metrics
 
+    return metrics.Metrics(profiler, audit)
+
+
+def print_scan(config, dry_run=False, profile=None):
+    """
+    Scan and list the non-compliant users, without loading the mail stack.
+
+    Args:
+        config (dict): The configuration.
+        dry_run (bool): Skip storing the scan.
+        profile (profiling.ProfileSettings): Profile the scan, when it is
+        sampled.
+    """
+    import engine
+
+    profiler = start_profiler(profile)
+    audit = open_audit_log(config)
+    try:
+        customer_users, _ = scan_users(
+            config, dry_run=dry_run,
+            metrics=profiled_metrics(profiler, audit))
     finally:
-        # Close the SMTP connection
-        smtp.quit()
+        stop_profiler(profiler)
+        close_audit_log(audit)
+    noncompliant = [user for user in customer_users
+                    if engine.is_noncompliant(user)]
+    for user in noncompliant:
+        print(f"{user.email}\t{user.name}")
+    if scans_noncompliant_only(config):
+        print(f"{len(noncompliant)} customer user(s) have MFA disabled; "
+              f"users with MFA enabled were not fetched", file=sys.stderr)
+    else:
+        print(f"{len(noncompliant)} of {len(customer_users)} customer users "
+              f"have MFA disabled", file=sys.stderr)
+
+
+def write_report(config, report_format, output=None, dry_run=False,
+                 profile=None):
+    """
+    Scan and write the report to a file or standard output.
+
+    Args:
+        config (dict): The configuration.
+        report_format (str): 'plain' or 'html'.
+        output (str): The file written; standard output when None.
+        dry_run (bool): Skip storing the scan.
+        profile (profiling.ProfileSettings): Profile the scan and
+        rendering, when they are sampled.
+    """
+    import engine
+    import report
+
+    render = report.render_html if report_format == 'html' \
+        else report.render_plain
+    profiler = start_profiler(profile)
+    audit = open_audit_log(config)
+    try:
+        metrics = profiled_metrics(profiler, audit)
+        customer_users, delta = scan_users(config, dry_run=dry_run,
+                                           metrics=metrics)
+        customers = engine.customer_configs(config)
+        texts = []
+        for customer, users, customer_delta in zip(
+                customers, engine.route_users(customer_users, customers),
+                engine.route_delta(delta, customers)):
+            intro, sections = report_sections(customer, users,
+                                              customer_delta)
+            if metrics is None:
+                texts.append(render(intro, sections))
+            else:
+                with metrics.phase('render',
+                                   customer=customer.get('customer', '')):
+                    texts.append(render(intro, sections))
+        text = ''.join(texts)
+    finally:
+        stop_profiler(profiler)
+        close_audit_log(audit)
+    if output is None:
+        sys.stdout.write(text)
+        return
+    with open(output, 'w', encoding='utf-8') as output_file:
+        output_file.write(text)
+
+
+def profile_rate(value):
+    """
+    Parse the --profile-rate option.
+
+    Args:
+        value (str): The option value.
+
+    Returns:
+        float: The fraction of runs profiled.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value is not between 0 and 1.
+    """
+    try:
+        rate = float(value)
+    except ValueError:
+        rate = -1
+    if not 0 <= rate <= 1:
+        raise argparse.ArgumentTypeError(f"{value!r} is not between 0 and 1")
+    return rate
+
+
+def audit_time(value):
+    """
+    Parse the --since and --until options.
+
+    Args:
+        value (str): Unix seconds, or an ISO 8601 date or time; times
+        without an offset are UTC.
+
+    Returns:
+        float: The time in Unix seconds.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value is not a time.
+    """
+    from datetime import datetime, timezone
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a time") \
+            from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def main(argv=None):
+    """
+    Run a command, or keep scanning on schedule with --daemon.
+
+    Args:
+        argv (list): The command-line arguments; defaults to sys.argv.
+
+    Returns:
+        int: The exit status.
+    """
+    parser = argparse.ArgumentParser(
+        prog='main.py',
+        description='Report Plextrac users without MFA enabled.')
+    parser.add_argument('command', nargs='?', choices=COMMANDS,
+                        default='send',
+                        help='scan: list non-compliant users; report: '
+                             'write the report; send: email the report '
+                             '(default); dispatch: deliver the mail spool; '
+                             'audit: search the audit log')
+    parser.add_argument('--config', default=CONFIG_PATH,
+                        help='path of the JSON configuration')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='do not store the scan or send email')
+    parser.add_argument('--format', choices=('plain', 'html'),
+                        default='plain', help='format of the report command')
+    parser.add_argument('--output',
+                        help='file written by the report command')
+    parser.add_argument('--input', metavar='FILE',
+                        help='scan a JSON or NDJSON user dump, optionally '
+                             'gzipped, instead of the Plextrac API')
+    parser.add_argument('--tenant',
+                        help='with audit, only events of this tenant')
+    parser.add_argument('--email',
+                        help='with audit, only events about this email')
+    parser.add_argument('--since', type=audit_time, metavar='TIME',
+                        help='with audit, only events at or after TIME, in '
+                             'Unix seconds or ISO 8601 (UTC by default)')
+    parser.add_argument('--until', type=audit_time, metavar='TIME',
+                        help='with audit, only events at or before TIME')
+    parser.add_argument('--daemon', action='store_true',
+                        help='stay running and scan on the configured '
+                             'schedules')
+    parser.add_argument('--import-profile', action='store_true',
+                        help='print the import cost of the command and exit')
+    parser.add_argument('--import-budget', type=float, metavar='MS',
+                        help='with --import-profile, fail above this many '
+                             'milliseconds')
+    parser.add_argument('--profile', metavar='DIR',
+                        default=os.environ.get(PROFILE_ENV),
+                        help='write cProfile and tracemalloc profiles of '
+                             f'each run to DIR (default: ${PROFILE_ENV})')
+    parser.add_argument('--profile-rate', type=profile_rate, metavar='RATE',
+                        default=os.environ.get(PROFILE_RATE_ENV, '1'),
+                        help='fraction of runs profiled, from 0 to 1 '
+                             f'(default: ${PROFILE_RATE_ENV} or 1)')
+    args = parser.parse_args(argv)
+    if args.input and (args.daemon
+                       or args.command in ('dispatch', 'audit')):
+        parser.error('--input only applies to the scan, report and send '
+                     'commands')
+    if args.daemon and args.command == 'audit':
+        parser.error('--daemon does not apply to the audit command')
+
+    if args.import_profile:
+        return profile_imports(args.command, args.import_budget)
+    profile = None
+    if args.profile:
+        import profiling
+
+        profile = profiling.ProfileSettings(args.profile, args.profile_rate)
+    if args.daemon:
+        import threading
+        import daemon
+
+        audit_logs = {}
+        audit_lock = threading.Lock()
+        wake = threading.Event()
+        memory_caches = {}
+
+        def audit_for(config):
+            return shared_audit_log(config, audit_logs, audit_lock)
+
+        def scheduled_scan(config, clients):
+            try:
+                run_scan(config, clients, dry_run=args.dry_run,
+                         profile=profile, audit=audit_for(config),
+                         cache=daemon_token_cache(config, memory_caches))
+            finally:
+                wake.set()
+
+        # Scheduled runs only queue their reports; the dispatcher thread
+        # delivers them, and retries failures, between runs
+        scheduler = daemon.Daemon(args.config, scheduled_scan)
+        retrier = threading.Thread(target=retry_spool,
+                                   args=(scheduler, wake, audit_for),
+                                   name='mail-dispatcher', daemon=True)
+        retrier.start()
+        try:
+            scheduler.run_forever()
+        finally:
+            scheduler.stop()
+            wake.set()
+            retrier.join()
+            for audit in audit_logs.values():
+                close_audit_log(audit)
+        return 0
+
+    config = load_config(args.config)
+    if args.input:
+        config = dict(config, input_path=args.input)
+    if args.command == 'audit':
+        return print_audit(config, args.tenant, args.email, args.since,
+                           args.until)
+    if args.command == 'scan':
+        print_scan(config, args.dry_run, profile)
+        return 0
+    if args.command == 'report':
+        write_report(config, args.format, args.output, args.dry_run, profile)
+        return 0
+    import mail_spool
+
+    try:
+        if args.command == 'dispatch':
+            run_dispatch(config)
+        else:
+            run_scan(config, dry_run=args.dry_run, profile=profile,
+                     deliver=True)
+    except mail_spool.UndeliveredMail as e:
+        print(f"Mail not delivered: {e}", file=sys.stderr)
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    authenticate_and_send_email()
+    sys.exit(main())
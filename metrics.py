@@ -0,0 +1,338 @@
+"""
+This module records how long each phase of a scan takes and how much work
+it did, and exports the figures of the last run as a Prometheus
+node-exporter textfile and as a JSON summary. Events of the run are also
+passed on to its audit log, when it has one.
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Prefix of every exported Prometheus metric.
+PREFIX = 'plextrac_mfa'
+
+# Help text of the counters recorded by the scan, by name.
+COUNTERS = {
+    'http_requests': 'HTTP requests sent to the Plextrac API.',
+    'http_retries': 'HTTP requests retried after a transient failure.',
+    'http_response_bytes': 'Bytes of Plextrac API response bodies.',
+    'pages': 'Pages of users fetched from the Plextrac API.',
+    'pushdown_records_saved': 'Users the Plextrac API filtered out before '
+                              'sending them.',
+    'pushdown_bytes_saved': 'Estimated response bytes saved by filtering '
+                            'users on the Plextrac API.',
+    'users_fetched': 'Users returned by the Plextrac API.',
+    'users_matched': 'Users matching the customer domains.',
+    'users_noncompliant': 'Customer users with MFA disabled.',
+    'token_cache_hits': 'Scans that reused a cached bearer token.',
+    'report_messages': 'Report messages rendered.',
+    'report_bytes': 'Bytes of the report messages queued or sent by email.',
+    'smtp_connections': 'SMTP connections opened.',
+    'smtp_round_trips': 'SMTP command and reply exchanges.',
+    'mail_queued': 'Report messages queued in the mail spool.',
+    'mail_sent': 'Spooled messages delivered.',
+    'mail_retried': 'Spooled messages requeued after a failed attempt.',
+    'mail_dead_lettered': 'Spooled messages moved to the dead-letter '
+                          'directory.',
+    'notifications_sent': 'Reports delivered to a notification sink.',
+    'notifications_queued': 'Reports queued by a notification sink for '
+                            'later delivery.',
+    'notifications_failed': 'Reports a notification sink failed to '
+                            'deliver.',
+    'errors': 'Targets that failed to scan.',
+}
+
+
+class Metrics:
+    """
+    The timings and counters of one run.
+
+    Phases and counters carry labels such as the target scanned, so runs
+    against several tenants can be told apart. Recording is thread-safe, as
+    targets are scanned concurrently.
+
+    Args:
+        profiler (profiling.RunProfiler): Profiles each phase, when the
+        run is profiled.
+        audit (audit_log.AuditLog): Receives the events of the run, when
+        it is audited.
+    """
+
+    def __init__(self, profiler=None, audit=None):
+        self.profiler = profiler
+        self.audit = audit
+        self.run_id = os.urandom(8).hex()
+        self.started_at = time.time()
+        self.success = None
+        self.duration = None
+        self.timings = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name, **labels):
+        """
+        Time a block as a phase of the run.
+
+        The time of a phase entered several times with the same labels is
+        summed.
+
+        Args:
+            name (str): The phase name, such as 'auth' or 'render'.
+            **labels: Labels distinguishing this occurrence of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            if self.profiler is None:
+                yield
+            else:
+                with self.profiler.phase(name, tuple(sorted(labels.items()))):
+                    yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, **labels)
+
+    def add_time(self, name, seconds, **labels):
+        """
+        Add time to a phase.
+
+        Args:
+            name (str): The phase name.
+            seconds (float): The time spent.
+            **labels: Labels of the phase.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.timings[key] = self.timings.get(key, 0.0) + seconds
+
+    def add(self, name, value=1, **labels):
+        """
+        Add to a counter.
+
+        Args:
+            name (str): The counter name; see COUNTERS.
+            value (int): The amount added.
+            **labels: Labels of the counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def count_items(self, items, name, **labels):
+        """
+        Count the items of a stream as they are consumed.
+
+        The counter is only incremented once the stream is exhausted, so a
+        stream that fails part way, such as a fetch retried after a 401,
+        is not counted.
+
+        Args:
+            items (iterable): The stream.
+            name (str): The counter incremented for each item.
+            **labels: Labels of the counter.
+
+        Yields:
+            object: Each item of the stream.
+        """
+        count = 0
+        for item in items:
+            count += 1
+            yield item
+        self.add(name, count, **labels)
+
+    def event(self, event, **fields):
+        """
+        Record an event of the run in its audit log.
+
+        Events carry the id of the run, so those of concurrent or
+        successive runs can be told apart. Nothing is done when the run
+        has no audit log.
+
+        Args:
+            event (str): The event name, such as 'scan_start'.
+            **fields: The fields of the event.
+        """
+        if self.audit is not None:
+            self.audit.emit(event, run=self.run_id, **fields)
+
+    def finish(self, success):
+        """
+        Record the outcome and duration of the run.
+
+        Args:
+            success (bool): Whether the run completed.
+        """
+        self.success = success
+        self.duration = time.time() - self.started_at
+
+    def total(self, name):
+        """
+        Sum a counter across its labels.
+
+        Args:
+            name (str): The counter name.
+
+        Returns:
+            int: The total.
+        """
+        with self._lock:
+            return sum(value for (counter, _), value in self.counters.items()
+                       if counter == name)
+
+    def snapshot(self):
+        """
+        Copy the timings and counters recorded so far.
+
+        Returns:
+            tuple: Sorted ((name, labels), seconds) timings and
+            ((name, labels), value) counters.
+        """
+        with self._lock:
+            return (sorted(self.timings.items()),
+                    sorted(self.counters.items()))
+
+    def summary(self):
+        """
+        Describe the run as JSON-serialisable data.
+
+        Returns:
+            dict: The start time, duration, outcome, phases and counters.
+        """
+        timings, counters = self.snapshot()
+        return {
+            'started_at': self.started_at,
+            'duration_seconds': self.duration,
+            'success': self.success,
+            'phases': [dict(labels, phase=name, seconds=seconds)
+                       for (name, labels), seconds in timings],
+            'counters': [dict(labels, name=name, value=value)
+                         for (name, labels), value in counters],
+        }
+
+
+def escape_label(value):
+    """
+    Escape a label value for the Prometheus text format.
+
+    Args:
+        value (object): The label value.
+
+    Returns:
+        str: The escaped value.
+    """
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def format_sample(name, labels, value):
+    """
+    Format one Prometheus sample line.
+
+    Args:
+        name (str): The metric name.
+        labels (tuple): (label, value) pairs.
+        value (float): The sample value.
+
+    Returns:
+        str: The sample line.
+    """
+    if labels:
+        name += '{' + ','.join(f'{label}="{escape_label(text)}"'
+                               for label, text in labels) + '}'
+    return f"{name} {value!r}"
+
+
+def render_prometheus(metrics):
+    """
+    Render the metrics in the Prometheus text exposition format.
+
+    Every figure describes the last run, so all metrics are gauges.
+
+    Args:
+        metrics (Metrics): The metrics of the run.
+
+    Returns:
+        str: The textfile contents.
+    """
+    summary = metrics.summary()
+    lines = [
+        f"# HELP {PREFIX}_last_run_timestamp_seconds Start of the last run.",
+        f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge",
+        format_sample(f"{PREFIX}_last_run_timestamp_seconds", (),
+                      summary['started_at']),
+        f"# HELP {PREFIX}_last_run_duration_seconds Wall time of the last "
+        f"run.",
+        f"# TYPE {PREFIX}_last_run_duration_seconds gauge",
+        format_sample(f"{PREFIX}_last_run_duration_seconds", (),
+                      summary['duration_seconds'] or 0.0),
+        f"# HELP {PREFIX}_last_run_success Whether the last run completed.",
+        f"# TYPE {PREFIX}_last_run_success gauge",
+        format_sample(f"{PREFIX}_last_run_success", (),
+                      int(bool(summary['success']))),
+    ]
+    timings, counters = metrics.snapshot()
+    if timings:
+        name = f"{PREFIX}_phase_seconds"
+        lines.append(f"# HELP {name} Wall time of each phase of the last "
+                     f"run.")
+        lines.append(f"# TYPE {name} gauge")
+        for (phase, labels), seconds in timings:
+            lines.append(format_sample(name, (('phase', phase),) + labels,
+                                       seconds))
+    previous = None
+    for (counter, labels), value in counters:
+        name = f"{PREFIX}_{counter}"
+        if counter != previous:
+            help_text = COUNTERS.get(counter, counter.replace('_', ' '))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            previous = counter
+        lines.append(format_sample(name, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomic(path, text):
+    """
+    Replace a file in one step, so readers never see a partial file.
+
+    Args:
+        path (str): The file written.
+        text (str): The new contents.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def export(metrics, config):
+    """
+    Write the metrics to the exporters enabled in the configuration.
+
+    Args:
+        metrics (Metrics): The metrics of the run.
+        config (dict): The loaded configuration. 'metrics_textfile' names
+        the Prometheus textfile, usually in the node-exporter textfile
+        collector directory, and 'metrics_json' the JSON summary. Both are
+        disabled by default.
+
+    Raises:
+        OSError: If a file cannot be written.
+    """
+    textfile = config.get('metrics_textfile')
+    if textfile:
+        write_atomic(textfile, render_prometheus(metrics))
+    json_path = config.get('metrics_json')
+    if json_path:
+        write_atomic(json_path,
+                     json.dumps(metrics.summary(), indent=2) + '\n')
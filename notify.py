@@ -0,0 +1,386 @@
+"""
+This module delivers a rendered report to every configured notification
+sink at once: email, HTTP webhooks and local NDJSON files.
+
+Each sink type is a class built from its 'notification_sinks' entry by
+the factory registered in SINK_TYPES. Sinks run concurrently, each with
+its own timeout, so a slow webhook neither delays the email nor stops
+the other sinks when it fails.
+"""
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import requests
+
+import mail_spool
+import mailer
+import metrics as metrics_module
+
+# Sinks used when 'notification_sinks' is not configured.
+DEFAULT_SINKS = ({'type': 'smtp'},)
+# Seconds a sink may take to deliver, unless its entry sets 'timeout'.
+SINK_TIMEOUT = 30
+# Seconds waited beyond a sink's timeout before it is reported as failed.
+TIMEOUT_GRACE = 5
+
+# One rendered report. 'messages' are the email messages and 'body' the
+# JSON document sent to webhooks and files.
+Notification = collections.namedtuple(
+    'Notification',
+    ['customer', 'subject', 'recipients', 'messages', 'body'])
+
+# Serialises appends to the same file from concurrent reports.
+_FILE_LOCK = threading.Lock()
+
+
+def notification_document(customer, subject, intro, sections):
+    """
+    Describe a report as JSON-serialisable data.
+
+    Args:
+        customer (str): The customer reported on.
+        subject (str): The subject of the report.
+        intro (str): The introduction of the report.
+        sections (list): The (heading, users) sections of the report.
+
+    Returns:
+        dict: The report, with one entry per user of each section.
+    """
+    return {
+        'customer': customer,
+        'subject': subject,
+        'generated_at': time.time(),
+        'intro': intro,
+        'sections': [
+            {'heading': heading,
+             'users': [{'name': user.name, 'email': user.email,
+                        'mfa_enabled': user.mfa_enabled}
+                       for user in users]}
+            for heading, users in sections
+        ],
+    }
+
+
+def build_notification(customer, subject, intro, sections, recipients,
+                       messages):
+    """
+    Bundle a rendered report for the sinks.
+
+    Args:
+        customer (str): The customer reported on.
+        subject (str): The subject of the report.
+        intro (str): The introduction of the report.
+        sections (list): The (heading, users) sections of the report.
+        recipients (list): The email recipients.
+        messages (list): The rendered email messages.
+
+    Returns:
+        Notification: The report, serialised once for every sink.
+    """
+    document = notification_document(customer, subject, intro, sections)
+    body = json.dumps(document, separators=(',', ':')).encode('utf-8')
+    return Notification(customer, subject, recipients, messages, body)
+
+
+class SmtpSink:
+    """
+    Emails the report to the 'poc_email' recipients.
+
+    Messages are queued in the mail spool when it is enabled, and sent over
+    one SMTP connection otherwise.
+
+    Args:
+        config (dict): The configuration of the customer.
+        name (str): The name of the sink in logs and metrics.
+        timeout (float): Seconds allowed to connect and for each reply.
+    """
+
+    def __init__(self, config, name='smtp', timeout=SINK_TIMEOUT):
+        self.config = config
+        self.name = name
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, entry, config):
+        """
+        Create the sink of a 'notification_sinks' entry.
+
+        Args:
+            entry (dict): The entry; 'timeout' defaults to 'smtp_timeout'.
+            config (dict): The configuration of the customer.
+
+        Returns:
+            SmtpSink: The sink.
+        """
+        return cls(config, entry.get('name', 'smtp'),
+                   entry.get('timeout', config.get('smtp_timeout',
+                                                   SINK_TIMEOUT)))
+
+    def deliver(self, notification, metrics):
+        """
+        Queue or send the messages of the report.
+
+        Each message is serialised once, for the spool or the SMTP
+        session, and its size is added to 'report_bytes' from there.
+
+        Args:
+            notification (Notification): The report.
+            metrics (metrics.Metrics): Receives the report size and the
+            spool and SMTP work.
+
+        Returns:
+            str: 'queued' when the messages were spooled for later
+            delivery, None once they are sent.
+
+        Raises:
+            ValueError: If 'poc_email' lists no recipients.
+        """
+        recipients = notification.recipients
+        customer = notification.customer
+        if not recipients:
+            raise ValueError(
+                "No recipients configured in 'poc_email'; report not sent")
+
+        spool = mail_spool.open_spool(self.config)
+        if spool is not None:
+            for message in notification.messages:
+                payload = message.as_string()
+                metrics.add('report_bytes', len(payload), customer=customer)
+                spool.enqueue_raw(payload, recipients, message['From'])
+            metrics.add('mail_queued', len(notification.messages),
+                        customer=customer)
+            print(f"Queued {len(notification.messages)} message(s) for "
+                  f"{', '.join(recipients)}", file=sys.stderr)
+            return 'queued'
+
+        # Send over a pooled SMTP session (Gmail over TLS by default)
+        transport = mailer.open_transport(
+            dict(self.config, smtp_timeout=self.timeout))
+        try:
+            with transport:
+                for message in notification.messages:
+                    payload = message.as_string()
+                    metrics.add('report_bytes', len(payload),
+                                customer=customer)
+                    transport.send_raw(payload, recipients, message['From'])
+        finally:
+            metrics.add('smtp_connections', transport.connections_opened,
+                        customer=customer)
+            metrics.add('smtp_round_trips', transport.round_trips,
+                        customer=customer)
+        print(f"Email sent successfully to {', '.join(recipients)}",
+              file=sys.stderr)
+
+
+class WebhookSink:
+    """
+    Posts the report as JSON to an HTTP endpoint.
+
+    Args:
+        url (str): The endpoint.
+        headers (dict): Extra request headers, such as Authorization.
+        name (str): The name of the sink in logs and metrics.
+        timeout (float): Seconds allowed to connect and for each read.
+    """
+
+    def __init__(self, url, headers=None, name='webhook',
+                 timeout=SINK_TIMEOUT):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.name = name
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, entry, config):
+        """
+        Create the sink of a 'notification_sinks' entry.
+
+        Args:
+            entry (dict): The entry; 'url' is required, 'headers', 'name'
+            and 'timeout' are optional.
+            config (dict): The configuration of the customer.
+
+        Returns:
+            WebhookSink: The sink.
+        """
+        return cls(entry['url'], entry.get('headers'),
+                   entry.get('name', 'webhook'),
+                   entry.get('timeout', SINK_TIMEOUT))
+
+    def deliver(self, notification, metrics):
+        """
+        Post the report.
+
+        Args:
+            notification (Notification): The report.
+            metrics (metrics.Metrics): Unused; webhooks record no counters.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails or
+            the endpoint answers with an error status.
+        """
+        headers = dict({'Content-Type': 'application/json'}, **self.headers)
+        response = requests.post(self.url, data=notification.body,
+                                 headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class FileSink:
+    """
+    Appends the report as one JSON line to a local NDJSON file.
+
+    The file is only readable by the current user, as reports list user
+    names and addresses.
+
+    Args:
+        path (str): The file appended to.
+        name (str): The name of the sink in logs and metrics.
+        timeout (float): Seconds allowed for the write.
+    """
+
+    def __init__(self, path, name='file', timeout=SINK_TIMEOUT):
+        self.path = path
+        self.name = name
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, entry, config):
+        """
+        Create the sink of a 'notification_sinks' entry.
+
+        Args:
+            entry (dict): The entry; 'path' is required, 'name' and
+            'timeout' are optional.
+            config (dict): The configuration of the customer.
+
+        Returns:
+            FileSink: The sink.
+        """
+        return cls(entry['path'], entry.get('name', 'file'),
+                   entry.get('timeout', SINK_TIMEOUT))
+
+    def deliver(self, notification, metrics):
+        """
+        Append the report.
+
+        Args:
+            notification (Notification): The report.
+            metrics (metrics.Metrics): Unused; files record no counters.
+
+        Raises:
+            OSError: If the file cannot be written.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        with _FILE_LOCK:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o600)
+            try:
+                # A single write keeps each line whole
+                os.write(fd, notification.body + b'\n')
+            finally:
+                os.close(fd)
+
+
+# Sink factories by the 'type' of a 'notification_sinks' entry.
+SINK_TYPES = {
+    'smtp': SmtpSink.from_config,
+    'webhook': WebhookSink.from_config,
+    'file': FileSink.from_config,
+}
+
+
+def open_sinks(config):
+    """
+    Create the notification sinks described by the configuration.
+
+    Args:
+        config (dict): The configuration of the customer.
+        'notification_sinks' lists entries with a 'type' of SINK_TYPES and
+        its settings; it defaults to email only.
+
+    Returns:
+        list: The sinks.
+
+    Raises:
+        ValueError: If an entry has an unknown type.
+    """
+    sinks = []
+    for entry in config.get('notification_sinks') or DEFAULT_SINKS:
+        factory = SINK_TYPES.get(entry.get('type'))
+        if factory is None:
+            raise ValueError(
+                f"Unknown notification sink type: {entry.get('type')!r}")
+        sinks.append(factory(entry, config))
+    return sinks
+
+
+def fan_out(sinks, notification, metrics=None):
+    """
+    Deliver a report to every sink concurrently.
+
+    Each sink gets its own deadline of its timeout plus TIMEOUT_GRACE. A
+    sink that fails or misses its deadline is reported without affecting
+    the others; one that overruns is left to finish in the background.
+
+    Args:
+        sinks (list): The sinks; see open_sinks.
+        notification (Notification): The report.
+        metrics (metrics.Metrics): Receives a 'send' phase per sink, the
+        'notifications_sent', 'notifications_queued' and
+        'notifications_failed' counters and a 'delivery' audit event per
+        sink. Sinks that only queue the report count as queued, not sent.
+
+    Returns:
+        list: (sink name, exception) pairs for the sinks that failed.
+    """
+    if metrics is None:
+        metrics = metrics_module.Metrics()
+    if not sinks:
+        return []
+
+    def deliver(sink):
+        with metrics.phase('send', customer=notification.customer,
+                           sink=sink.name):
+            return sink.deliver(notification, metrics) or 'sent'
+
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=len(sinks),
+                              thread_name_prefix='notify')
+    errors = []
+    try:
+        futures = [pool.submit(deliver, sink) for sink in sinks]
+        for sink, future in zip(sinks, futures):
+            deadline = started + sink.timeout + TIMEOUT_GRACE
+            status = None
+            try:
+                status = future.result(
+                    timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                error = TimeoutError(
+                    f"no answer within {sink.timeout} seconds")
+            except Exception as e:  # pylint: disable=broad-except
+                error = e
+            else:
+                error = None
+            if error is None:
+                metrics.add(f"notifications_{status}", sink=sink.name)
+                metrics.event('delivery', customer=notification.customer,
+                              sink=sink.name, status=status)
+            else:
+                errors.append((sink.name, error))
+                metrics.add('notifications_failed', sink=sink.name)
+                metrics.event('delivery', customer=notification.customer,
+                              sink=sink.name, status='failed',
+                              error=str(error))
+    finally:
+        pool.shutdown(wait=False)
+    return errors
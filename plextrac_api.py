@@ -0,0 +1,634 @@
+"""
+This module wraps the Plextrac API calls used by the compliance scan:
+authentication and paged retrieval of tenant users. Every call goes through
+a PlextracClient, which shares a pooled session and retries transient
+failures.
+"""
+
+import collections
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+import domain_index
+import json_stream
+
+# Number of users requested per page from the tenant users endpoint.
+PAGE_SIZE = 100
+# Number of pages requested ahead of the one currently being consumed.
+PREFETCH_PAGES = 4
+
+# Connections kept open per host by the shared session.
+POOL_SIZE = 10
+# Retries of a request after its first attempt.
+MAX_RETRIES = 5
+# Base and maximum delay of the exponential backoff, in seconds.
+BACKOFF = 0.5
+MAX_BACKOFF = 30
+# Longest Retry-After delay honoured, in seconds.
+MAX_RETRY_AFTER = 300
+# Response statuses that are retried.
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# Bytes read at a time from streamed responses.
+STREAM_CHUNK_SIZE = 64 * 1024
+# (connect, read) timeouts in seconds, per endpoint.
+TIMEOUTS = {
+    'authenticate': (5, 10),
+    'users': (5, 30),
+}
+# Query parameters of the filters pushed down to the users endpoint.
+DOMAIN_FILTER_PARAM = 'email_domain'
+MFA_FILTER_PARAM = 'mfa_enabled'
+# Statuses of instances that reject the filter parameters.
+FILTER_REJECTED_STATUSES = frozenset([400, 422])
+
+# Users wanted from a tenant: those on 'domains' (and their subdomains),
+# with MFA in the 'mfa_enabled' state unless it is None.
+UserFilter = collections.namedtuple('UserFilter', ['domains', 'mfa_enabled'])
+
+
+def page_total(data):
+    """
+    Read the number of users a tenant holds from a users page.
+
+    Args:
+        data (dict): The decoded page, or the keys of it read so far.
+
+    Returns:
+        int: The 'meta.total' of the page, or None when it is missing.
+    """
+    try:
+        total = data['meta']['total']
+    except (KeyError, TypeError):
+        return None
+    if isinstance(total, bool) or not isinstance(total, int):
+        return None
+    return total
+
+
+def iter_user_pages(fetch_page, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES):
+    """
+    Yield pages of users in order while prefetching the following pages.
+
+    Up to ``prefetch`` page requests are kept in flight on a bounded worker
+    pool, so only that many pages are ever held in memory. The first page
+    is fetched alone: servers may cap the page size below ``page_size``,
+    so the following offsets advance by the number of users it held.
+    Iteration stops at the first empty page, or once the total reported by
+    the server has been reached, or at a page starting with the same user
+    as the one before it, which shows the server ignores the offset. A
+    page of another size is not the end: paging resumes from where it
+    ended, so a server changing its cap mid-scan skips or repeats no
+    users.
+
+    Args:
+        fetch_page (callable): Called with an offset, returns the list of
+        users of the page and the total reported by the server, or None.
+        page_size (int): The number of users requested per page.
+        prefetch (int): The maximum number of pages requested concurrently.
+
+    Yields:
+        list: The users of each page, in offset order.
+    """
+    prefetch = max(1, prefetch)
+    users, total = fetch_page(0)
+    if not users:
+        return
+    yield users
+    first = users[0]
+    stride = len(users)
+    next_offset = len(users)
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        pending = deque()
+
+        def fill():
+            nonlocal next_offset
+            while len(pending) < prefetch \
+                    and (total is None or next_offset < total):
+                pending.append((next_offset,
+                                pool.submit(fetch_page, next_offset)))
+                next_offset += stride
+
+        try:
+            fill()
+            while pending:
+                offset, future = pending.popleft()
+                users, reported = future.result()
+                if reported is not None:
+                    total = reported
+                if not users or users[0] == first:
+                    break
+                yield users
+                first = users[0]
+                if len(users) != stride:
+                    # The pages in flight no longer start where this one
+                    # ends, so request again from there
+                    for _, misaligned in pending:
+                        misaligned.cancel()
+                    pending.clear()
+                    stride = len(users)
+                    next_offset = offset + len(users)
+                fill()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def filter_params(user_filter):
+    """
+    Build the query parameters pushing a filter down to the API.
+
+    Wildcard domains are pushed down as their parent domain, which the API
+    matches with its subdomains; the exact rules are applied on the client.
+
+    Args:
+        user_filter (UserFilter): The users wanted.
+
+    Returns:
+        dict: The query parameters.
+    """
+    params = {}
+    if user_filter.domains:
+        params[DOMAIN_FILTER_PARAM] = sorted({
+            domain.lower()[2:] if domain.startswith('*.') else domain.lower()
+            for domain in user_filter.domains})
+    if user_filter.mfa_enabled is not None:
+        params[MFA_FILTER_PARAM] = str(bool(user_filter.mfa_enabled)).lower()
+    return params
+
+
+def filter_check(user_filter):
+    """
+    Build a check telling whether a returned user passes a pushed filter.
+
+    A user outside the filter shows the API ignored it.
+
+    Args:
+        user_filter (UserFilter): The users wanted.
+
+    Returns:
+        callable: Takes a user entry and returns True when it passes.
+    """
+    index = domain_index.DomainIndex(
+        filter_params(user_filter).get(DOMAIN_FILTER_PARAM, []))
+    mfa_enabled = user_filter.mfa_enabled
+
+    def check(user):
+        if not isinstance(user, dict):
+            return False
+        if user_filter.domains and not index.match(user.get('email') or ''):
+            return False
+        return mfa_enabled is None or \
+            bool((user.get('mfa') or {}).get('enabled')) == mfa_enabled
+
+    return check
+
+
+def retry_after_seconds(response):
+    """
+    Read the delay requested by a Retry-After header.
+
+    Args:
+        response (requests.Response): The response to inspect.
+
+    Returns:
+        float: The delay in seconds, or None when the header is missing or
+        invalid.
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class PlextracClient:
+    """
+    A client for one Plextrac instance.
+
+    Requests share a pooled requests.Session, so connections are kept
+    alive across pages and tenants. Connection errors, timeouts and the
+    statuses in RETRY_STATUSES are retried with exponential backoff and
+    full jitter, or after the delay given by a Retry-After header.
+
+    The client counts the requests sent, retries, pages and response bytes
+    since it was created, and the records and bytes that filters pushed
+    down to the API kept from being sent; see counters. Whether the
+    instance honours pushed filters is learnt on the first filtered fetch
+    and kept in 'pushdown'.
+
+    Args:
+        base_url (str): The Plextrac instance URL.
+        pool_size (int): The connections kept open to the instance.
+        max_retries (int): The retries of a request after its first attempt.
+        backoff (float): The base backoff delay in seconds.
+        timeouts (dict): (connect, read) timeouts overriding TIMEOUTS.
+    """
+
+    def __init__(self, base_url, pool_size=POOL_SIZE, max_retries=MAX_RETRIES,
+                 backoff=BACKOFF, timeouts=None):
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeouts = dict(TIMEOUTS, **(timeouts or {}))
+        self.retries = 0
+        self.requests_sent = 0
+        self.pages = 0
+        self.bytes_received = 0
+        self.pushdown_records_saved = 0
+        self.pushdown_bytes_saved = 0
+        self.pushdown = None
+        self._counter_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+        self.session.close()
+
+    def count(self, name, value=1):
+        """
+        Add to one of the counters of the client.
+
+        Args:
+            name (str): 'retries', 'requests_sent', 'pages',
+            'bytes_received', 'pushdown_records_saved' or
+            'pushdown_bytes_saved'.
+            value (int): The amount added.
+        """
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def tally(self, tally, records=0, size=0):
+        """
+        Add to the records and bytes received by one fetch.
+
+        Args:
+            tally (dict): The 'records' and 'bytes' of the fetch, or None.
+            records (int): The records received.
+            size (int): The bytes received.
+        """
+        if tally is not None:
+            with self._counter_lock:
+                tally['records'] += records
+                tally['bytes'] += size
+
+    def counters(self):
+        """
+        Read the counters of the client.
+
+        Returns:
+            dict: The requests sent, retries, pages, response bytes, and
+            records and bytes saved by filter pushdown.
+        """
+        with self._counter_lock:
+            return {'requests_sent': self.requests_sent,
+                    'retries': self.retries, 'pages': self.pages,
+                    'bytes_received': self.bytes_received,
+                    'pushdown_records_saved': self.pushdown_records_saved,
+                    'pushdown_bytes_saved': self.pushdown_bytes_saved}
+
+    def backoff_delay(self, attempt):
+        """
+        Pick the delay before a retry.
+
+        Args:
+            attempt (int): The number of attempts already failed, minus one.
+
+        Returns:
+            float: A random delay up to the exponential backoff cap.
+        """
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    def request(self, method, path, endpoint, **kwargs):
+        """
+        Send a request, retrying transient failures.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path below the instance URL.
+            endpoint (str): The TIMEOUTS key of the endpoint.
+            **kwargs: Passed on to requests.Session.request.
+
+        Returns:
+            requests.Response: The successful response.
+
+        Raises:
+            requests.exceptions.RequestException: If the request still fails
+            after the last retry, or fails with a status that is not retried.
+        """
+        url = f"{self.base_url}{path}"
+        timeout = self.timeouts.get(endpoint, (5, 30))
+        attempt = 0
+        while True:
+            self.count('requests_sent')
+            try:
+                response = self.session.request(method, url, timeout=timeout,
+                                                **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES \
+                        or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    if not kwargs.get('stream'):
+                        self.count('bytes_received', len(response.content))
+                    return response
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+                delay = min(delay, MAX_RETRY_AFTER)
+                response.close()
+            attempt += 1
+            self.count('retries')
+            time.sleep(delay)
+
+    def authenticate(self, username, password):
+        """
+        Authenticate with the Plextrac API.
+
+        Args:
+            username (str): The Plextrac username.
+            password (str): The Plextrac password.
+
+        Returns:
+            dict: The authentication payload holding 'token' and
+            'tenant_id'.
+
+        Raises:
+            requests.exceptions.RequestException: If authentication fails.
+        """
+        response = self.request(
+            'POST', '/api/v1/authenticate', 'authenticate',
+            json={
+                "username": username,
+                "password": password
+            }
+        )
+        return response.json()
+
+    def iter_tenant_users(self, tenant_id, token, page_size=PAGE_SIZE,
+                          prefetch=PREFETCH_PAGES, stream_json=False,
+                          user_filter=None, on_page=None):
+        """
+        Stream the users of a tenant.
+
+        By default pages are prefetched concurrently and decoded whole. With
+        'stream_json', pages are requested one at a time and their users are
+        yielded while the response body is still being read, so memory use
+        does not grow with the page size.
+
+        A 'user_filter' is pushed down to the API as query parameters, so
+        only the wanted users are sent. Instances that reject the
+        parameters, or return users outside the filter, are remembered as
+        not supporting pushdown and sent every user from then on; callers
+        must therefore still filter the users themselves.
+
+        Args:
+            tenant_id (str): The tenant whose users are listed.
+            token (str): The bearer token.
+            page_size (int): The number of users requested per page.
+            prefetch (int): The maximum number of pages requested
+            concurrently.
+            stream_json (bool): Parse each response incrementally.
+            user_filter (UserFilter): The users wanted, if not all.
+            on_page (callable): Called with the offset, user count and
+            size in bytes of each page received, possibly from another
+            thread.
+
+        Yields:
+            dict: Each user entry returned by the API.
+
+        Raises:
+            requests.exceptions.RequestException: If a page request fails.
+        """
+        path = f"/api/v2/tenants/{tenant_id}/users"
+        headers = {"Authorization": f"Bearer {token}"}
+        if user_filter is None or self.pushdown is False:
+            yield from self.iter_users(path, headers, page_size, prefetch,
+                                       stream_json, on_page=on_page)
+            return
+
+        check = filter_check(user_filter)
+        tally = {'records': 0, 'bytes': 0}
+        honoured = True
+        yielded = False
+        try:
+            for user in self.iter_users(path, headers, page_size, prefetch,
+                                        stream_json,
+                                        filter_params(user_filter), tally,
+                                        on_page):
+                if honoured and not check(user):
+                    honoured = self.pushdown = False
+                yielded = True
+                yield user
+        except requests.exceptions.HTTPError as e:
+            if yielded or e.response is None \
+                    or e.response.status_code not in FILTER_REJECTED_STATUSES:
+                raise
+            self.pushdown = False
+            yield from self.iter_users(path, headers, page_size, prefetch,
+                                       stream_json, on_page=on_page)
+            return
+        if honoured:
+            self.pushdown = True
+            self.count_pushdown_savings(path, headers, tally)
+
+    def iter_users(self, path, headers, page_size, prefetch, stream_json,
+                   params=None, tally=None, on_page=None):
+        """
+        Stream the users of a users endpoint, page by page.
+
+        Args:
+            path (str): The users endpoint of the tenant.
+            headers (dict): The authorization headers.
+            page_size (int): The number of users requested per page.
+            prefetch (int): The maximum number of pages requested
+            concurrently.
+            stream_json (bool): Parse each response incrementally.
+            params (dict): Extra query parameters, such as filters.
+            tally (dict): Receives the 'records' and 'bytes' received.
+            on_page (callable): Called with the offset, user count and
+            size in bytes of each page.
+
+        Yields:
+            dict: Each user entry of the endpoint.
+        """
+        params = params or {}
+        if stream_json:
+            offset = 0
+            previous = None
+            while True:
+                count = 0
+                page_tally = {'records': 0, 'bytes': 0}
+                meta = {}
+                for user in self.iter_page_stream(path, headers, offset,
+                                                  page_size, params,
+                                                  page_tally, meta):
+                    if count == 0:
+                        # A server ignoring the offset repeats the page
+                        if user == previous:
+                            break
+                        previous = user
+                    count += 1
+                    yield user
+                self.tally(tally, count, page_tally['bytes'])
+                if on_page is not None:
+                    on_page(offset, count, page_tally['bytes'])
+                # Servers may cap the page size, so only an empty page or
+                # the reported total ends the scan
+                offset += count
+                total = page_total(meta)
+                if count == 0 or (total is not None and offset >= total):
+                    return
+
+        def fetch_page(offset):
+            page = self.request(
+                'GET', path, 'users',
+                params=dict(params, limit=page_size, offset=offset),
+                headers=headers
+            )
+            self.count('pages')
+            data = page.json()
+            users = []
+            if isinstance(data, dict) and isinstance(data.get('data'), list):
+                users = data['data']
+            self.tally(tally, len(users), len(page.content))
+            if on_page is not None:
+                on_page(offset, len(users), len(page.content))
+            return users, page_total(data)
+
+        for page in iter_user_pages(fetch_page, page_size, prefetch):
+            yield from page
+
+    def iter_page_stream(self, path, headers, offset, page_size, params=None,
+                         tally=None, meta=None):
+        """
+        Yield the users of one page while its body is being received.
+
+        Args:
+            path (str): The users endpoint of the tenant.
+            headers (dict): The authorization headers.
+            offset (int): The index of the first user of the page.
+            page_size (int): The number of users requested.
+            params (dict): Extra query parameters, such as filters.
+            tally (dict): Receives the bytes received.
+            meta (dict): Receives the other keys of the page, such as
+            'meta', once the page has been read.
+
+        Yields:
+            dict: Each user entry of the page.
+        """
+        response = self.request(
+            'GET', path, 'users',
+            params=dict(params or {}, limit=page_size, offset=offset),
+            headers=headers,
+            stream=True
+        )
+        self.count('pages')
+        with response:
+            for user in json_stream.iter_array_items(
+                    self.count_chunks(
+                        response.iter_content(STREAM_CHUNK_SIZE), tally),
+                    others=meta):
+                if isinstance(user, dict):
+                    yield user
+
+    def count_chunks(self, chunks, tally=None):
+        """
+        Count the bytes of a streamed response body as it is read.
+
+        Args:
+            chunks (iterable): The chunks of the body.
+            tally (dict): Also receives the bytes, for one fetch.
+
+        Yields:
+            bytes: Each chunk.
+        """
+        for chunk in chunks:
+            self.count('bytes_received', len(chunk))
+            self.tally(tally, size=len(chunk))
+            yield chunk
+
+    def count_pushdown_savings(self, path, headers, tally):
+        """
+        Count the records and bytes a pushed filter kept from being sent.
+
+        The unfiltered size of the tenant is read from the 'meta.total' of
+        a one-user page; instances that do not report it are not counted.
+        Bytes are estimated from the average size of the users received.
+
+        Args:
+            path (str): The users endpoint of the tenant.
+            headers (dict): The authorization headers.
+            tally (dict): The 'records' and 'bytes' of the filtered fetch.
+        """
+        response = self.request('GET', path, 'users',
+                                params={'limit': 1, 'offset': 0},
+                                headers=headers)
+        try:
+            total = page_total(response.json())
+        except ValueError:
+            return
+        if total is None:
+            return
+        saved = max(0, total - tally['records'])
+        per_record = tally['bytes'] / tally['records'] if tally['records'] \
+            else len(response.content)
+        self.count('pushdown_records_saved', saved)
+        self.count('pushdown_bytes_saved', int(saved * per_record))
+
+
+def client_from_config(base_url, config):
+    """
+    Create a client with the HTTP settings of the configuration.
+
+    Args:
+        base_url (str): The Plextrac instance URL.
+        config (dict): The loaded configuration. 'http_pool_size',
+        'http_max_retries', 'http_backoff' and 'http_timeouts' are optional.
+
+    Returns:
+        PlextracClient: The client.
+    """
+    pool_size = max(config.get('http_pool_size', POOL_SIZE),
+                    config.get('prefetch_pages', PREFETCH_PAGES))
+    timeouts = {endpoint: tuple(timeout) if isinstance(timeout, list)
+                else timeout
+                for endpoint, timeout in config.get('http_timeouts',
+                                                    {}).items()}
+    return PlextracClient(
+        base_url,
+        pool_size=pool_size,
+        max_retries=config.get('http_max_retries', MAX_RETRIES),
+        backoff=config.get('http_backoff', BACKOFF),
+        timeouts=timeouts
+    )
@@ -0,0 +1,253 @@
+"""
+This module profiles scan runs with cProfile and tracemalloc, so slow or
+memory-hungry runs can be diagnosed in production.
+
+Each phase recorded through metrics.Metrics is profiled separately and
+tagged with its labels, such as the target scanned. A run writes a pstats
+file per phase and tenant, a combined pstats file, a report of the top
+allocation sites and a JSON summary of time, traced memory and peak RSS
+per phase. Only a sampled fraction of runs is profiled, to keep the
+overhead of long-running daemons small.
+"""
+
+import contextlib
+import cProfile
+import collections
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Number of allocation sites listed in the allocation report.
+TOP_ALLOCATIONS = 25
+# Frames kept by tracemalloc per allocation; more frames cost more.
+TRACEMALLOC_FRAMES = 1
+# Phases profiled; enclosing phases such as 'run' are not, so that the
+# profile of each leaf phase holds its own calls.
+PROFILED_PHASES = frozenset(
+    ['auth', 'fetch_filter', 'snapshot', 'render', 'send', 'deliver'])
+
+# Where and how often runs are profiled.
+ProfileSettings = collections.namedtuple('ProfileSettings',
+                                         ['directory', 'rate'])
+
+
+def peak_rss_bytes():
+    """
+    Read the peak resident set size of the process.
+
+    Returns:
+        int: The peak RSS in bytes, or None where it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def slug(text):
+    """
+    Turn a label into a file name component.
+
+    Args:
+        text (str): The label.
+
+    Returns:
+        str: The label with unsafe characters replaced.
+    """
+    return re.sub(r'[^A-Za-z0-9.-]+', '_', text).strip('_')
+
+
+class RunProfiler:
+    """
+    Profiles one run, phase by phase.
+
+    cProfile follows the thread it is enabled on, so each occurrence of a
+    phase gets its own profile, which also covers targets scanned on
+    worker threads. tracemalloc traces every thread for the whole run.
+
+    Args:
+        directory (str): The directory receiving the profiles of runs.
+        top (int): The allocation sites listed in the allocation report.
+        frames (int): The frames kept by tracemalloc per allocation.
+    """
+
+    def __init__(self, directory, top=TOP_ALLOCATIONS,
+                 frames=TRACEMALLOC_FRAMES):
+        self.directory = directory
+        self.top = top
+        self.frames = frames
+        self.profiles = []
+        self.phases = []
+        self.started_tracing = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start tracing allocations, unless they are already traced.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started_tracing = True
+
+    @contextlib.contextmanager
+    def phase(self, name, labels):
+        """
+        Profile a phase, unless it encloses others or one is running.
+
+        Args:
+            name (str): The phase name.
+            labels (tuple): The (label, value) pairs of the phase.
+        """
+        if name not in PROFILED_PHASES \
+                or getattr(self._local, 'active', False):
+            yield
+            return
+        self._local.active = True
+        traced = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Interpreters with a single global profiler (3.12+) refuse a
+            # second one while another thread is profiled
+            profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            self._local.active = False
+            self.record(name, labels, profile, seconds,
+                        tracemalloc.get_traced_memory()[0] - traced)
+
+    def record(self, name, labels, profile, seconds, traced):
+        """
+        Keep the profile and figures of a finished phase.
+
+        Args:
+            name (str): The phase name.
+            labels (tuple): The (label, value) pairs of the phase.
+            profile (cProfile.Profile): The profile, or None when the
+            interpreter refused to start one.
+            seconds (float): The wall time of the phase.
+            traced (int): The change in traced memory, in bytes.
+        """
+        with self._lock:
+            if profile is not None:
+                self.profiles.append(((name, labels), profile))
+            self.phases.append({
+                'phase': name,
+                'labels': dict(labels),
+                'seconds': seconds,
+                'traced_bytes': traced,
+                'peak_rss_bytes': peak_rss_bytes(),
+            })
+
+    def stop(self):
+        """
+        Stop tracing and write the profiles of the run.
+
+        Returns:
+            str: The directory holding the profiles of the run.
+        """
+        snapshot = None
+        traced_peak = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            traced_peak = tracemalloc.get_traced_memory()[1]
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+        run_dir = os.path.join(
+            self.directory,
+            time.strftime('run-%Y%m%dT%H%M%S') + f"-{os.getpid()}")
+        os.makedirs(run_dir, exist_ok=True)
+        self.write_pstats(run_dir)
+        if snapshot is not None:
+            self.write_allocations(run_dir, snapshot)
+        summary = {
+            'phases': self.phases,
+            'traced_peak_bytes': traced_peak,
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+        with open(os.path.join(run_dir, 'summary.json'), 'w',
+                  encoding='utf-8') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        return run_dir
+
+    def write_pstats(self, run_dir):
+        """
+        Write a pstats file per phase and tags, and a combined one.
+
+        Args:
+            run_dir (str): The directory of the run.
+        """
+        grouped = collections.OrderedDict()
+        for key, profile in self.profiles:
+            grouped.setdefault(key, []).append(profile)
+        for (name, labels), profiles in grouped.items():
+            stats = pstats.Stats(*profiles)
+            tags = '.'.join(slug(str(value)) for _, value in labels)
+            file_name = f"{name}.{tags}.pstats" if tags else f"{name}.pstats"
+            stats.dump_stats(os.path.join(run_dir, file_name))
+        if self.profiles:
+            combined = pstats.Stats(*(profile for _, profile in self.profiles))
+            combined.dump_stats(os.path.join(run_dir, 'combined.pstats'))
+
+    def write_allocations(self, run_dir, snapshot):
+        """
+        Write the allocation sites holding the most memory.
+
+        Args:
+            run_dir (str): The directory of the run.
+            snapshot (tracemalloc.Snapshot): The allocations at the end of
+            the run.
+        """
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ])
+        statistics = snapshot.statistics('lineno')
+        with open(os.path.join(run_dir, 'allocations.txt'), 'w',
+                  encoding='utf-8') as report_file:
+            total = sum(stat.size for stat in statistics)
+            report_file.write(f"Top {self.top} allocation sites, "
+                              f"{total / 1024:.1f} KiB traced in total\n")
+            for stat in statistics[:self.top]:
+                frame = stat.traceback[0]
+                report_file.write(
+                    f"{stat.size / 1024:>10.1f} KiB {stat.count:>8} blocks  "
+                    f"{frame.filename}:{frame.lineno}\n")
+
+
+def sampled_profiler(settings, sample=random.random):
+    """
+    Decide whether to profile a run.
+
+    Args:
+        settings (ProfileSettings): The profiling settings, or None.
+        sample (callable): Returns a number in [0, 1); for tests.
+
+    Returns:
+        RunProfiler: A profiler for the run, or None when it is not sampled.
+    """
+    if settings is None or sample() >= settings.rate:
+        return None
+    return RunProfiler(settings.directory)
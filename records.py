@@ -0,0 +1,200 @@
+"""
+This module holds users in compact form: slotted records for the users a
+scan keeps, and a columnar table for filtering batches of API entries with
+column operations instead of per-user dictionary lookups.
+"""
+
+import sys
+
+import domain_index
+
+# API entries converted and filtered together.
+BATCH_SIZE = 10_000
+
+
+class UserRecord:
+    """
+    The fields of a Plextrac user that the scan uses.
+
+    Domains are interned, so users of the same domain share one string.
+    """
+
+    __slots__ = ('user_id', 'email', 'name', 'domain', 'mfa_enabled')
+
+    def __init__(self, email, name='', user_id=None, mfa_enabled=False,
+                 domain=None):
+        self.user_id = user_id
+        self.email = email
+        self.name = name
+        self.domain = sys.intern(domain if domain is not None
+                                 else domain_index.email_domain(email))
+        self.mfa_enabled = mfa_enabled
+
+    @classmethod
+    def from_api(cls, item):
+        """
+        Build a record from a user entry returned by the API.
+
+        Args:
+            item (dict): The user entry.
+
+        Returns:
+            UserRecord: The record, or None when the entry has no email.
+        """
+        if not isinstance(item, dict) or not isinstance(item.get('email'),
+                                                        str):
+            return None
+        return cls(item['email'], item.get('fullName') or '', item.get('id'),
+                   bool((item.get('mfa') or {}).get('enabled')))
+
+    def __eq__(self, other):
+        if not isinstance(other, UserRecord):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot)
+                   for slot in self.__slots__)
+
+    def __hash__(self):
+        return hash(self.email)
+
+    def __repr__(self):
+        return (f"UserRecord(email={self.email!r}, name={self.name!r}, "
+                f"user_id={self.user_id!r}, mfa_enabled={self.mfa_enabled})")
+
+
+class UserTable:
+    """
+    A batch of users stored column by column.
+
+    Strings live in parallel lists, domains are interned, and MFA state is a
+    bit array with one bit per row.
+    """
+
+    def __init__(self):
+        self.user_ids = []
+        self.emails = []
+        self.names = []
+        self.domains = []
+        self.mfa = bytearray()
+
+    def __len__(self):
+        return len(self.emails)
+
+    def append_api(self, item):
+        """
+        Append a user entry returned by the API; entries without an email
+        are skipped.
+
+        Args:
+            item (dict): The user entry.
+        """
+        if not isinstance(item, dict):
+            return
+        email = item.get('email')
+        if not isinstance(email, str):
+            return
+        row = len(self.emails)
+        if row % 8 == 0:
+            self.mfa.append(0)
+        if (item.get('mfa') or {}).get('enabled'):
+            self.mfa[row >> 3] |= 1 << (row & 7)
+        self.user_ids.append(item.get('id'))
+        self.emails.append(email)
+        self.names.append(item.get('fullName') or '')
+        self.domains.append(sys.intern(domain_index.email_domain(email)))
+
+    def mfa_enabled(self, row):
+        """
+        Read the MFA bit of a row.
+        """
+        return bool(self.mfa[row >> 3] >> (row & 7) & 1)
+
+    def noncompliant_count(self):
+        """
+        Count the rows with MFA disabled.
+
+        Returns:
+            int: The number of cleared MFA bits.
+        """
+        enabled = bin(int.from_bytes(self.mfa, 'little')).count('1')
+        return len(self) - enabled
+
+    def match_domains(self, index, cache=None):
+        """
+        Find the rows whose domain is covered by a domain index.
+
+        Each distinct domain is looked up once, however many rows share it.
+
+        Args:
+            index (domain_index.DomainIndex): The customer domains.
+            cache (dict): Lookup results by domain, shared across batches.
+
+        Returns:
+            list: The matching row numbers.
+        """
+        cache = {} if cache is None else cache
+        for domain in set(self.domains).difference(cache):
+            cache[domain] = bool(domain) and index.match_domain(domain)
+        return [row for row, domain in enumerate(self.domains)
+                if cache[domain]]
+
+    def noncompliant_rows(self, rows=None):
+        """
+        Filter rows down to those with MFA disabled.
+
+        Args:
+            rows (iterable): The candidate rows; all rows by default.
+
+        Returns:
+            list: The rows whose MFA bit is cleared.
+        """
+        rows = range(len(self)) if rows is None else rows
+        mfa = self.mfa
+        return [row for row in rows if not mfa[row >> 3] >> (row & 7) & 1]
+
+    def record(self, row):
+        """
+        Build the record of a row.
+
+        Returns:
+            UserRecord: The user at that row.
+        """
+        return UserRecord(self.emails[row], self.names[row],
+                          self.user_ids[row], self.mfa_enabled(row),
+                          self.domains[row])
+
+    def records(self, rows=None):
+        """
+        Build the records of several rows.
+
+        Args:
+            rows (iterable): The rows; all rows by default.
+
+        Returns:
+            list: UserRecord objects, in row order.
+        """
+        rows = range(len(self)) if rows is None else rows
+        return [self.record(row) for row in rows]
+
+
+def iter_tables(items, batch_size=BATCH_SIZE):
+    """
+    Group a stream of API entries into columnar batches.
+
+    Args:
+        items (iterable): The user entries returned by the API.
+        batch_size (int): The number of entries per batch.
+
+    Yields:
+        UserTable: Each batch, holding at most batch_size users.
+    """
+    table = UserTable()
+    count = 0
+    for item in items:
+        table.append_api(item)
+        count += 1
+        if count >= batch_size:
+            yield table
+            table = UserTable()
+            count = 0
+    if len(table):
+        yield table
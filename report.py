@@ -0,0 +1,290 @@
+"""
+This module renders the compliance report as plain text, an HTML table and
+a gzipped CSV attachment, splitting it across several messages when it
+would exceed the configured size.
+"""
+
+import csv
+import gzip
+import html
+import io
+
+# Formats rendered when 'report_formats' is not configured.
+DEFAULT_FORMATS = ('plain',)
+# Largest estimated size of one message, in bytes.
+MAX_MESSAGE_BYTES = 5_000_000
+# Allowance for the base64 transfer encoding of the message parts.
+ENCODING_OVERHEAD = 4 / 3
+
+# Sections of a delta report, in order, with the Delta field they list.
+DELTA_SECTIONS = (
+    ('Newly non-compliant users', 'newly_noncompliant'),
+    ('Newly remediated users', 'newly_remediated'),
+    ('New users', 'new'),
+    ('Removed users', 'removed'),
+)
+
+CSV_HEADER = ('section', 'name', 'email', 'mfa_enabled')
+
+
+def full_sections(users, is_noncompliant):
+    """
+    Build the single section of a full report.
+
+    Args:
+        users (iterable): The customer users found by the scan.
+        is_noncompliant (callable): Tells whether a user has MFA disabled.
+
+    Returns:
+        list: One (heading, users) pair without a heading.
+    """
+    return [(None, [user for user in users if is_noncompliant(user)])]
+
+
+def delta_sections(delta):
+    """
+    Build the non-empty sections of a delta report.
+
+    Args:
+        delta (snapshot_store.Delta): The changes since the previous scan.
+
+    Returns:
+        list: (heading, users) pairs in DELTA_SECTIONS order.
+    """
+    return [(title, getattr(delta, field)) for title, field in DELTA_SECTIONS
+            if getattr(delta, field)]
+
+
+def report_sections(config, users, delta, is_noncompliant):
+    """
+    Choose the introduction and sections of a customer's report.
+
+    Args:
+        config (dict): The customer configuration. 'report_mode' set to
+        'delta' reports the changes since the previous scan.
+        users (iterable): The customer users found by the scan.
+        delta (snapshot_store.Delta): The changes since the previous scan,
+        or None.
+        is_noncompliant (callable): Tells whether a user has MFA disabled.
+
+    Returns:
+        tuple: The introduction and the (heading, users) sections.
+    """
+    if config.get('report_mode') == 'delta' and delta is not None:
+        intro = (
+            f"Changes in compliance with the {config['customer']} requirement "
+            f"for MFA enabled on the Plextrac Platform since the last scan:"
+        )
+        return intro, delta_sections(delta)
+    intro = (
+        f"The following users are not compliant with the "
+        f"{config['customer']} requirement for MFA enabled on the "
+        f"Plextrac Platform:"
+    )
+    return intro, full_sections(users, is_noncompliant)
+
+
+def _plain_row(user):
+    return f"Name: {user.name}\nEmail: {user.email}\n\n"
+
+
+def _html_row(user):
+    return (f"<tr><td>{html.escape(user.name)}</td>"
+            f"<td>{html.escape(user.email)}</td></tr>\n")
+
+
+def _csv_row(heading, user):
+    return (heading or 'noncompliant', user.name, user.email,
+            user.mfa_enabled)
+
+
+def render_plain(intro, sections):
+    """
+    Render the report as plain text.
+
+    Args:
+        intro (str): The opening paragraph.
+        sections (list): (heading, users) pairs.
+
+    Returns:
+        str: The plain-text report.
+    """
+    out = io.StringIO()
+    out.write(f"{intro}\n\n")
+    for heading, users in sections:
+        if heading:
+            out.write(f"{heading}:\n\n")
+        for user in users:
+            out.write(_plain_row(user))
+    return out.getvalue()
+
+
+def render_html(intro, sections):
+    """
+    Render the report as an HTML document with one table per section.
+
+    Args:
+        intro (str): The opening paragraph.
+        sections (list): (heading, users) pairs.
+
+    Returns:
+        str: The HTML report.
+    """
+    out = io.StringIO()
+    out.write(f"<html><body>\n<p>{html.escape(intro)}</p>\n")
+    for heading, users in sections:
+        if heading:
+            out.write(f"<h3>{html.escape(heading)}</h3>\n")
+        out.write("<table border=\"1\" cellpadding=\"4\">\n"
+                  "<tr><th>Name</th><th>Email</th></tr>\n")
+        for user in users:
+            out.write(_html_row(user))
+        out.write("</table>\n")
+    out.write("</body></html>\n")
+    return out.getvalue()
+
+
+def render_csv_gz(sections):
+    """
+    Render the report as a gzipped CSV file.
+
+    Args:
+        sections (list): (heading, users) pairs.
+
+    Returns:
+        bytes: The compressed CSV content.
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz_file:
+        with io.TextIOWrapper(gz_file, encoding='utf-8', newline='') as text:
+            writer = csv.writer(text)
+            writer.writerow(CSV_HEADER)
+            for heading, users in sections:
+                writer.writerows(_csv_row(heading, user) for user in users)
+    return buffer.getvalue()
+
+
+def estimate_row_bytes(heading, user, formats):
+    """
+    Estimate how many bytes a user adds to a message.
+
+    Args:
+        heading (str): The section the user belongs to.
+        user (records.UserRecord): The user.
+        formats (iterable): The formats rendered.
+
+    Returns:
+        int: The estimated encoded size of the user's rows.
+    """
+    size = 0
+    if 'plain' in formats:
+        size += len(_plain_row(user).encode('utf-8'))
+    if 'html' in formats:
+        size += len(_html_row(user).encode('utf-8'))
+    if 'csv' in formats:
+        size += len(','.join(map(str, _csv_row(heading, user)))) + 2
+    return int(size * ENCODING_OVERHEAD) + 1
+
+
+def split_sections(sections, formats, max_bytes=MAX_MESSAGE_BYTES):
+    """
+    Split sections into chunks whose rendering stays under a size limit.
+
+    A chunk always holds at least one user, so a single oversized row is
+    sent on its own rather than dropped.
+
+    Args:
+        sections (list): (heading, users) pairs.
+        formats (iterable): The formats rendered.
+        max_bytes (int): The size limit of one message.
+
+    Returns:
+        list: Lists of (heading, users) pairs, one list per message.
+    """
+    chunks = []
+    current = []
+    size = 0
+    for heading, users in sections:
+        if not users:
+            current.append((heading, []))
+            continue
+        for user in users:
+            row = estimate_row_bytes(heading, user, formats)
+            if size + row > max_bytes and size:
+                chunks.append(current)
+                current = []
+                size = 0
+            if not current or current[-1][0] != heading:
+                current.append((heading, []))
+            current[-1][1].append(user)
+            size += row
+    chunks.append(current)
+    return chunks
+
+
+def build_message(intro, sections, formats):
+    """
+    Build one message holding the report in the requested formats.
+
+    Args:
+        intro (str): The opening paragraph.
+        sections (list): (heading, users) pairs.
+        formats (iterable): Any of 'plain', 'html' and 'csv'.
+
+    Returns:
+        email.mime.multipart.MIMEMultipart: The message, without headers.
+    """
+    # The email package is only loaded when messages are built, so
+    # rendering a report to a file does not pay for it.
+    # pylint: disable=import-outside-toplevel
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    message = MIMEMultipart()
+    bodies = []
+    if 'plain' in formats or 'html' not in formats:
+        bodies.append(MIMEText(render_plain(intro, sections), 'plain'))
+    if 'html' in formats:
+        bodies.append(MIMEText(render_html(intro, sections), 'html'))
+    if len(bodies) > 1:
+        alternative = MIMEMultipart('alternative')
+        for body in bodies:
+            alternative.attach(body)
+        message.attach(alternative)
+    else:
+        message.attach(bodies[0])
+    if 'csv' in formats:
+        attachment = MIMEApplication(render_csv_gz(sections), 'gzip')
+        attachment.add_header('Content-Disposition', 'attachment',
+                              filename='mfa_report.csv.gz')
+        message.attach(attachment)
+    return message
+
+
+def build_messages(intro, sections, subject, formats=DEFAULT_FORMATS,
+                   max_bytes=MAX_MESSAGE_BYTES):
+    """
+    Build the messages of a report, split by size.
+
+    Args:
+        intro (str): The opening paragraph.
+        sections (list): (heading, users) pairs.
+        subject (str): The subject; a part counter is appended when the
+        report is split.
+        formats (iterable): Any of 'plain', 'html' and 'csv'.
+        max_bytes (int): The size limit of one message.
+
+    Returns:
+        list: The messages, with their Subject set.
+    """
+    chunks = split_sections(sections, formats, max_bytes)
+    messages = []
+    for number, chunk in enumerate(chunks, start=1):
+        message = build_message(intro, chunk, formats)
+        if len(chunks) > 1:
+            message['Subject'] = f"{subject} (part {number} of {len(chunks)})"
+        else:
+            message['Subject'] = subject
+        messages.append(message)
+    return messages
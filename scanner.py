@@ -0,0 +1,207 @@
+"""
+This module exposes the compliance scan as a library, so other tooling can
+scan in-process and reuse connections and tokens across calls instead of
+running main.py for every check.
+
+Example:
+    with MfaComplianceScanner.from_file('config.json') as scanner:
+        for user in scanner.iter_noncompliant():
+            print(user.email)
+"""
+
+import json
+
+import requests
+
+import engine
+import plextrac_api
+import report
+import token_cache
+
+
+class MfaComplianceScanner:
+    """
+    Scans the configured Plextrac instances and tenants on demand.
+
+    The scanner keeps one client per instance and a token cache for its
+    whole life, so repeated calls skip the connection setup and the
+    authentication request while tokens are valid. Tokens are cached in
+    the configured file, or in memory when the file cache is disabled.
+
+    Args:
+        config (dict): The configuration, with the keys of config.json.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.clients = {}
+        self.cache = token_cache.open_token_cache(config) \
+            or token_cache.MemoryTokenCache(
+                config.get('token_ttl', token_cache.DEFAULT_TOKEN_TTL))
+        self.errors = []
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Create a scanner from a JSON configuration file.
+
+        Args:
+            path (str): The path of the configuration.
+
+        Returns:
+            MfaComplianceScanner: The scanner.
+
+        Raises:
+            json.JSONDecodeError: If the file is not valid JSON.
+        """
+        with open(path, encoding='utf-8') as config_file:
+            return cls(json.load(config_file))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the clients of every instance scanned.
+        """
+        for client in self.clients.values():
+            client.close()
+        self.clients.clear()
+
+    def client(self, url):
+        """
+        Get the client of an instance, creating it on first use.
+
+        Args:
+            url (str): The Plextrac instance URL.
+
+        Returns:
+            plextrac_api.PlextracClient: The client.
+        """
+        if url not in self.clients:
+            self.clients[url] = plextrac_api.client_from_config(url,
+                                                                self.config)
+        return self.clients[url]
+
+    def scan(self, metrics=None):
+        """
+        Scan every target concurrently and merge their users.
+
+        The targets that failed are listed in 'errors'.
+
+        Args:
+            metrics (metrics.Metrics): Receives the phases and counters of
+            the scan.
+
+        Returns:
+            list: The customer users, one records.UserRecord per email.
+
+        Raises:
+            requests.exceptions.RequestException: If every target fails.
+        """
+        users, self.errors = engine.scan_all(self.config, self.clients,
+                                             metrics, cache=self.cache)
+        if self.errors \
+                and len(self.errors) == len(engine.scan_targets(self.config)):
+            raise self.errors[0][1]
+        return users
+
+    def _iter_all(self, noncompliant_only=False):
+        # Every user of every target, as its pages arrive
+        config = self.config
+        if noncompliant_only:
+            config = dict(config, noncompliant_only=True)
+        targets = engine.scan_targets(config)
+        self.errors = []
+        for target in targets:
+            try:
+                yield from engine.iter_target_users(
+                    target, self.client(target['plextrac_url']), self.cache)
+            except requests.exceptions.RequestException as e:
+                self.errors.append((engine.target_label(target), e))
+        if self.errors and len(self.errors) == len(targets):
+            raise self.errors[0][1]
+
+    def iter_users(self):
+        """
+        Stream the customer users, target after target.
+
+        Unlike scan, users are matched a page ('page_size' entries) at a
+        time and yielded batch by batch, so no user records are held
+        beyond a page; only the set of emails already yielded grows with
+        the tenants. A failing target is listed in 'errors' and the next
+        one is scanned.
+
+        Each email is yielded once, as first seen. A user yielded cannot
+        be replaced later, so unlike scan, which keeps the entry with MFA
+        disabled when targets disagree, a user compliant on an earlier
+        target is yielded as compliant. Use iter_noncompliant, which
+        applies the same rule as scan, to find every non-compliant user.
+
+        Yields:
+            records.UserRecord: Each customer user.
+
+        Raises:
+            requests.exceptions.RequestException: If every target fails.
+        """
+        seen = set()
+        for user in self._iter_all():
+            key = user.email.strip().lower()
+            if key not in seen:
+                seen.add(key)
+                yield user
+
+    def iter_noncompliant(self):
+        """
+        Stream the customer users with MFA disabled.
+
+        A user is non-compliant if any target says so, as in scan, and is
+        yielded once. Only the set of emails already yielded is kept.
+
+        Yields:
+            records.UserRecord: Each non-compliant user.
+
+        Raises:
+            requests.exceptions.RequestException: If every target fails.
+        """
+        seen = set()
+        for user in self._iter_all(noncompliant_only=True):
+            if engine.is_noncompliant(user):
+                key = user.email.strip().lower()
+                if key not in seen:
+                    seen.add(key)
+                    yield user
+
+    def report(self, report_format='plain', users=None, delta=None):
+        """
+        Render the report of every customer.
+
+        Args:
+            report_format (str): 'plain' or 'html'.
+            users (list): The customer users; scanned when None.
+            delta (snapshot_store.Delta): The changes since the previous
+            scan, for customers reporting in 'delta' mode.
+
+        Returns:
+            str: The reports, one after the other.
+
+        Raises:
+            requests.exceptions.RequestException: If every target fails.
+        """
+        render = report.render_html if report_format == 'html' \
+            else report.render_plain
+        if users is None:
+            users = self.scan()
+        customers = engine.customer_configs(self.config)
+        texts = []
+        for customer, customer_users, customer_delta in zip(
+                customers, engine.route_users(users, customers),
+                engine.route_delta(delta, customers)):
+            intro, sections = report.report_sections(
+                customer, customer_users, customer_delta,
+                engine.is_noncompliant)
+            texts.append(render(intro, sections))
+        return ''.join(texts)
@@ -1,10 +1,134 @@
 """Setup script to create a virtual environment, install dependencies,
 and set up a scheduled task on Linux/Mac (using cron) or Windows (using Task
-Scheduler) to run the main script periodically."""
+Scheduler) to run the main script periodically.
 
+Running it again is cheap and safe: the virtual environment records a hash
+of requirements.txt and the Python version it was built for, and nothing is
+reinstalled while both are unchanged. Dependencies are installed from a
+local wheel cache, so reinstalls work offline, and the scheduled task is
+updated in place rather than added again."""
+
+import hashlib
+import json
 import os
 import platform
 import subprocess
+import sys
+
+# Platforms setup knows how to schedule the script on.
+SUPPORTED_PLATFORMS = ('Linux', 'Darwin', 'Windows')
+# File in the virtual environment recording what it was built from.
+STAMP_FILE = '.setup-stamp.json'
+# Directory of the local wheel cache, next to this script.
+WHEEL_CACHE_DIR = 'wheelhouse'
+# Comment marking the crontab entry managed by this script.
+CRON_MARKER = '# plextrac-mfa-compliance'
+# Name of the Windows scheduled task.
+TASK_NAME = 'RunMainScript'
+
+
+def python_version():
+    """
+    Describe the interpreter the virtual environment is built with.
+
+    Returns:
+        str: The implementation and version, e.g. 'CPython 3.11.7'.
+    """
+    return f"{platform.python_implementation()} {platform.python_version()}"
+
+
+def requirements_hash(requirements_path):
+    """
+    Hash the contents of the requirements file.
+
+    Args:
+        requirements_path (str): The path to requirements.txt.
+
+    Returns:
+        str: The SHA-256 hex digest of the file.
+    """
+    with open(requirements_path, 'rb') as requirements_file:
+        return hashlib.sha256(requirements_file.read()).hexdigest()
+
+
+def read_stamp(venv_path):
+    """
+    Read what the virtual environment was last built from.
+
+    Args:
+        venv_path (str): The virtual environment.
+
+    Returns:
+        dict: The 'requirements' hash and 'python' version, or an empty
+        dict when the environment was never set up.
+    """
+    try:
+        with open(os.path.join(venv_path, STAMP_FILE),
+                  encoding='utf-8') as stamp_file:
+            stamp = json.load(stamp_file)
+    except (OSError, ValueError):
+        return {}
+    return stamp if isinstance(stamp, dict) else {}
+
+
+def write_stamp(venv_path, stamp):
+    """
+    Record what the virtual environment was built from.
+
+    Args:
+        venv_path (str): The virtual environment.
+        stamp (dict): The 'requirements' hash and 'python' version.
+    """
+    with open(os.path.join(venv_path, STAMP_FILE), 'w',
+              encoding='utf-8') as stamp_file:
+        json.dump(stamp, stamp_file)
+
+
+def venv_python(venv_path, current_os):
+    """
+    Find the interpreter of a virtual environment.
+
+    Args:
+        venv_path (str): The virtual environment.
+        current_os (str): The platform, as returned by platform.system().
+
+    Returns:
+        str: The path to its python executable.
+    """
+    if current_os == 'Windows':
+        return os.path.join(venv_path, 'Scripts', 'python.exe')
+    return os.path.join(venv_path, 'bin', 'python')
+
+
+def install_requirements(python, requirements_path, wheel_dir):
+    """
+    Install the requirements from the local wheel cache.
+
+    The cache is tried first without contacting the package index. When
+    it lacks a requirement, the missing wheels are downloaded into it and
+    the install is retried, so later reinstalls work offline.
+
+    Args:
+        python (str): The interpreter of the virtual environment.
+        requirements_path (str): The path to requirements.txt.
+        wheel_dir (str): The wheel cache directory.
+
+    Raises:
+        subprocess.CalledProcessError: If a requirement cannot be installed.
+    """
+    offline_install = [python, '-m', 'pip', 'install', '--no-index',
+                       '--find-links', wheel_dir, '-r', requirements_path]
+    if os.path.isdir(wheel_dir) and os.listdir(wheel_dir):
+        try:
+            subprocess.check_call(offline_install)
+            return
+        except subprocess.CalledProcessError:
+            print("Wheel cache incomplete; downloading missing wheels")
+    os.makedirs(wheel_dir, exist_ok=True)
+    subprocess.check_call([python, '-m', 'pip', 'wheel', '--wheel-dir',
+                           wheel_dir, '--find-links', wheel_dir,
+                           '-r', requirements_path])
+    subprocess.check_call(offline_install)
 
 
 def setup_environment():
@@ -13,32 +137,46 @@ def setup_environment():
     scheduled task.
 
     Detects the platform (Linux/Mac or Windows) and performs the necessary
-    steps: - Create and activate a virtual environment. - Install
-    dependencies from requirements.txt. - Set up a scheduled task to run the
-    main script periodically.
+    steps, skipping those that are already done: - Create the virtual
+    environment, or recreate it when the Python version changed. - Install
+    dependencies from requirements.txt when it changed. - Create or update
+    the scheduled task that runs the main script periodically.
 
     Raises:
+        ValueError: If the platform is not supported.
         subprocess.CalledProcessError: If any command fails.
     """
+    current_os = platform.system()
+    if current_os not in SUPPORTED_PLATFORMS:
+        raise ValueError(f"Unsupported platform: {current_os!r}")
+
     base_dir = os.path.dirname(os.path.abspath(__file__))
     venv_path = os.path.join(base_dir, 'venv')
     requirements_path = os.path.join(base_dir, 'requirements.txt')
     main_script_path = os.path.join(base_dir, 'main.py')
-    current_os = platform.system()
+    wheel_dir = os.path.join(base_dir, WHEEL_CACHE_DIR)
+    python = venv_python(venv_path, current_os)
 
-    # Create virtual environment
-    subprocess.check_call(['python', '-m', 'venv', venv_path])
+    stamp = {'requirements': requirements_hash(requirements_path),
+             'python': python_version()}
+    previous = read_stamp(venv_path)
+    if previous == stamp and os.path.exists(python):
+        print("Environment up to date; skipping venv and dependency setup")
+    else:
+        # Create the virtual environment, from scratch for a new Python
+        if previous.get('python') != stamp['python'] \
+                or not os.path.exists(python):
+            subprocess.check_call([sys.executable, '-m', 'venv', '--clear',
+                                   venv_path])
+            os.chmod(venv_path, 0o700)
+        install_requirements(python, requirements_path, wheel_dir)
+        write_stamp(venv_path, stamp)
 
     if current_os == 'Windows':
         activate_script = os.path.join(venv_path, 'Scripts', 'activate')
     else:
         activate_script = os.path.join(venv_path, 'bin', 'activate')
 
-    # Install dependencies
-    subprocess.check_call(
-        f'{activate_script} && pip install -r {requirements_path}', shell=True
-    )
-
     # Schedule the script to run periodically
     if current_os == 'Windows':
         schedule_task_windows(main_script_path, activate_script)
@@ -51,32 +189,78 @@ def schedule_task_windows(script_path, activate_script):
     Schedule a task in Windows Task Scheduler to run the main script
     periodically.
 
+    An existing task of the same name is replaced.
+
     Args:
         script_path (str): The path to the main script.
         activate_script (str): The path to the virtual environment activation
         script.
     """
-    task_name = "RunMainScript"
     action = (
-        f'SchTasks /Create /SC WEEKLY /D FRI /TN "{task_name}" /TR "'
+        f'SchTasks /Create /F /SC WEEKLY /D FRI /TN "{TASK_NAME}" /TR "'
         f'{activate_script} && python {script_path}" /ST 08:00'
     )
     subprocess.check_call(action, shell=True)
 
 
+def update_crontab(crontab, cron_job, script_path):
+    """
+    Put the entry of the main script in a crontab, exactly once.
+
+    The entry replaces the first one it manages, found by its marker or,
+    for entries added before markers were used, by the script it runs;
+    other copies are dropped and other entries are kept as they are.
+
+    Args:
+        crontab (str): The current crontab.
+        cron_job (str): The entry, without its marker.
+        script_path (str): The path to the main script.
+
+    Returns:
+        str: The updated crontab.
+    """
+    entry = f'{cron_job} {CRON_MARKER}'
+    lines = []
+    placed = False
+    for line in crontab.splitlines():
+        managed = line.rstrip().endswith(CRON_MARKER) or (
+            not line.lstrip().startswith('#')
+            and f'python {script_path}' in line)
+        if not managed:
+            lines.append(line)
+        elif not placed:
+            lines.append(entry)
+            placed = True
+    if not placed:
+        lines.append(entry)
+    return '\n'.join(lines) + '\n'
+
+
 def schedule_task_unix(script_path, activate_script):
     """
     Schedule a cron job to run the main script periodically on Linux/Mac.
 
+    The job is updated in place, so running setup again never adds a
+    second one; the crontab is left untouched when it is already current.
+
     Args:
         script_path (str): The path to the main script.
         activate_script (str): The path to the virtual environment
         activation script.
+
+    Raises:
+        subprocess.CalledProcessError: If the crontab cannot be written.
     """
-    cron_job = f'0 8 * * 5 source {activate_script} && python {script_path}'
-    subprocess.check_call(
-        f'(crontab -l; echo "{cron_job}") | crontab -', shell=True
-    )
+    cron_job = f'0 8 * * 5 . {activate_script} && python {script_path}'
+    current = subprocess.run(['crontab', '-l'], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL,
+                             universal_newlines=True, check=False)
+    # 'crontab -l' fails when the user has no crontab yet
+    crontab = current.stdout if current.returncode == 0 else ''
+    updated = update_crontab(crontab, cron_job, script_path)
+    if updated != crontab:
+        subprocess.run(['crontab', '-'], input=updated,
+                       universal_newlines=True, check=True)
 
 
 if __name__ == "__main__":
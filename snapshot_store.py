@@ -0,0 +1,205 @@
+"""
+This module persists each scan into a local SQLite database so that runs
+can report only what changed since the previous scan.
+"""
+
+import collections
+import sqlite3
+import time
+
+import records
+
+# Default location of the snapshot database.
+DEFAULT_DB_PATH = 'mfa_snapshots.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    user_id TEXT,
+    full_name TEXT,
+    mfa_enabled INTEGER NOT NULL,
+    present INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_user_id ON users (user_id);
+CREATE INDEX IF NOT EXISTS users_state ON users (present, mfa_enabled);
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scanned_at REAL NOT NULL,
+    user_count INTEGER NOT NULL,
+    noncompliant_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scans_scanned_at ON scans (scanned_at);
+"""
+
+# Changes between the stored state and a new scan. Each field is a list of
+# records.UserRecord objects.
+Delta = collections.namedtuple(
+    'Delta', ['newly_noncompliant', 'newly_remediated', 'new', 'removed']
+)
+
+
+def _row_to_user(row):
+    email, user_id, full_name, mfa_enabled = row
+    return records.UserRecord(email, full_name or '', user_id,
+                              bool(mfa_enabled))
+
+
+class SnapshotStore:
+    """
+    The latest known MFA state of every user, plus one row per scan.
+
+    Users are keyed by lower-cased email. A user missing from a scan is kept
+    with 'present' cleared, so its first-seen time survives if it returns.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record_scan(self, users, scanned_at=None, persist=True,
+                    complete=True):
+        """
+        Store a scan and return how it differs from the previous state.
+
+        Args:
+            users (iterable): The records.UserRecord objects found by the
+            scan.
+            scanned_at (float): The scan time as a Unix timestamp; defaults
+            to now.
+            persist (bool): When False, only compute the delta and leave the
+            stored state untouched.
+            complete (bool): When False, some targets failed, so users
+            missing from the scan are not reported as removed and nothing
+            is stored, whatever 'persist' says.
+
+        Returns:
+            Delta: The users that changed state since the previous scan.
+        """
+        scanned_at = time.time() if scanned_at is None else scanned_at
+        db = self.connection
+        with db:
+            db.execute("DROP TABLE IF EXISTS temp.current")
+            db.execute(
+                "CREATE TEMP TABLE current (email TEXT PRIMARY KEY, "
+                "user_id TEXT, full_name TEXT, mfa_enabled INTEGER)"
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO temp.current VALUES (?, ?, ?, ?)",
+                ((user.email.strip().lower(), user.user_id, user.name,
+                  int(user.mfa_enabled))
+                 for user in users)
+            )
+            delta = self._diff()
+            if not complete:
+                delta = delta._replace(removed=[])
+            if persist and complete:
+                db.execute(
+                    "UPDATE users SET present = 0 WHERE present = 1 AND "
+                    "email NOT IN (SELECT email FROM temp.current)"
+                )
+                db.execute(
+                    "INSERT INTO users (email, user_id, full_name, "
+                    "mfa_enabled, present, first_seen, last_seen) "
+                    "SELECT email, user_id, full_name, mfa_enabled, 1, ?, ? "
+                    "FROM temp.current WHERE true "
+                    "ON CONFLICT (email) DO UPDATE SET "
+                    "user_id = excluded.user_id, "
+                    "full_name = excluded.full_name, "
+                    "mfa_enabled = excluded.mfa_enabled, present = 1, "
+                    "last_seen = excluded.last_seen",
+                    (scanned_at, scanned_at)
+                )
+                db.execute(
+                    "INSERT INTO scans (scanned_at, user_count, "
+                    "noncompliant_count) SELECT ?, COUNT(*), "
+                    "COUNT(*) - COALESCE(SUM(mfa_enabled), 0) "
+                    "FROM temp.current",
+                    (scanned_at,)
+                )
+            db.execute("DROP TABLE temp.current")
+        return delta
+
+    def _diff(self):
+        def select(query):
+            return [_row_to_user(row)
+                    for row in self.connection.execute(query)]
+
+        current = "c.email, c.user_id, c.full_name, c.mfa_enabled"
+        joined = ("FROM temp.current c LEFT JOIN users u "
+                  "ON u.email = c.email")
+        return Delta(
+            newly_noncompliant=select(
+                f"SELECT {current} {joined} WHERE c.mfa_enabled = 0 AND "
+                "(u.email IS NULL OR u.present = 0 OR u.mfa_enabled = 1) "
+                "ORDER BY c.email"),
+            newly_remediated=select(
+                f"SELECT {current} {joined} WHERE c.mfa_enabled = 1 AND "
+                "u.present = 1 AND u.mfa_enabled = 0 ORDER BY c.email"),
+            new=select(
+                f"SELECT {current} {joined} WHERE u.email IS NULL OR "
+                "u.present = 0 ORDER BY c.email"),
+            removed=select(
+                "SELECT email, user_id, full_name, mfa_enabled FROM users "
+                "WHERE present = 1 AND email NOT IN "
+                "(SELECT email FROM temp.current) ORDER BY email"),
+        )
+
+    def trend(self, since=None):
+        """
+        List the recorded scans, oldest first.
+
+        Args:
+            since (float): Only return scans at or after this timestamp.
+
+        Returns:
+            list: (scanned_at, user_count, noncompliant_count) tuples.
+        """
+        return self.connection.execute(
+            "SELECT scanned_at, user_count, noncompliant_count FROM scans "
+            "WHERE scanned_at >= ? ORDER BY scanned_at",
+            (since or 0,)
+        ).fetchall()
+
+    def noncompliant(self):
+        """
+        List the users currently known to have MFA disabled.
+
+        Returns:
+            list: records.UserRecord objects ordered by email.
+        """
+        return [_row_to_user(row) for row in self.connection.execute(
+            "SELECT email, user_id, full_name, mfa_enabled FROM users "
+            "WHERE present = 1 AND mfa_enabled = 0 ORDER BY email"
+        )]
+
+
+def open_snapshot_store(config):
+    """
+    Open the snapshot store described by the configuration.
+
+    Args:
+        config (dict): The loaded configuration. 'snapshot_db' sets the
+        database file, or disables snapshots when null.
+
+    Returns:
+        SnapshotStore: The store, or None when snapshots are disabled.
+    """
+    path = config.get('snapshot_db', DEFAULT_DB_PATH)
+    if not path:
+        return None
+    return SnapshotStore(path)
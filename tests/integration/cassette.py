@@ -0,0 +1,482 @@
+"""
+Records HTTP and SMTP traffic to a cassette file and replays it, so tests
+run offline against traffic captured once from real servers.
+
+HTTP is captured at requests.Session.send, which every Plextrac request and
+webhook goes through, and SMTP at the commands and replies of smtplib.SMTP.
+In replay mode nothing reaches the network.
+
+Secrets are scrubbed before anything is written: JSON fields and query
+parameters whose names look like credentials (passwords, tokens, secrets,
+cookies), SMTP AUTH exchanges, and every header but Content-Type. Message
+bodies sent over SMTP are not stored; they are collected in sent_messages
+for assertions instead.
+
+Requests are matched on their method, path, query and scrubbed body, in
+order for identical requests, so concurrent and prefetched requests replay
+in any order and the instance URL of the test does not matter. SMTP
+connections replay their recorded replies in order. The patches are
+process-wide, so run cassette suites in parallel across processes, such as
+with pytest -n, rather than threads.
+
+To capture real traffic, run any main.py command under a recording
+cassette:
+
+    python -m tests.integration.cassette tenant.json.gz -- scan --dry-run
+"""
+
+import argparse
+import base64
+import collections
+import datetime
+import gzip
+import io
+import json
+import os
+import smtplib
+import sys
+import threading
+from unittest.mock import patch
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Environment variable forcing cassettes to be recorded again.
+RECORD_ENV = 'PLEXTRAC_MFA_RECORD'
+# Substrings of JSON keys and query parameters whose values are scrubbed.
+SECRET_KEYS = ('password', 'token', 'secret', 'authorization', 'api_key',
+               'apikey', 'cookie', 'session')
+REDACTED = '<redacted>'
+# Placeholder of a message body sent over SMTP.
+MESSAGE = '<message>'
+CASSETTE_VERSION = 1
+
+
+class CassetteMismatch(AssertionError):
+    """
+    Raised when replayed code sends traffic that was not recorded.
+    """
+
+
+def is_secret(name):
+    """
+    Tell whether a field or parameter name looks like a credential.
+
+    Args:
+        name (str): The name.
+
+    Returns:
+        bool: True when its value must not be stored.
+    """
+    name = str(name).lower()
+    return any(key in name for key in SECRET_KEYS)
+
+
+def scrub(value):
+    """
+    Replace the credentials found in a JSON value.
+
+    Args:
+        value (object): The decoded JSON value.
+
+    Returns:
+        object: A copy with secret fields replaced by REDACTED.
+    """
+    if isinstance(value, dict):
+        return {key: REDACTED if is_secret(key) else scrub(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+
+def request_path(url):
+    """
+    Reduce a URL to its path and scrubbed query.
+
+    Args:
+        url (str): The request URL.
+
+    Returns:
+        str: The path, followed by the query with secret parameters
+        replaced.
+    """
+    parts = urlsplit(url)
+    query = [(name, REDACTED if is_secret(name) else value)
+             for name, value in parse_qsl(parts.query,
+                                          keep_blank_values=True)]
+    return parts.path + ('?' + urlencode(query) if query else '')
+
+
+def decode_body(body):
+    """
+    Decode a request or response body for storage.
+
+    Args:
+        body (bytes): The body, or None.
+
+    Returns:
+        tuple: 'json' and the scrubbed value, 'text' and the text, or
+        'base64' and the encoded bytes; (None, None) for an empty body.
+    """
+    if body is None or body == b'' or body == '':
+        return None, None
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    try:
+        return 'json', scrub(json.loads(body))
+    except ValueError:
+        pass
+    try:
+        return 'text', body.decode('utf-8')
+    except UnicodeDecodeError:
+        return 'base64', base64.b64encode(body).decode('ascii')
+
+
+def encode_body(kind, value):
+    """
+    Turn a stored body back into bytes.
+
+    Args:
+        kind (str): 'json', 'text', 'base64' or None.
+        value (object): The stored body.
+
+    Returns:
+        bytes: The body.
+    """
+    if kind == 'json':
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+    if kind == 'text':
+        return value.encode('utf-8')
+    if kind == 'base64':
+        return base64.b64decode(value)
+    return b''
+
+
+def request_key(request):
+    """
+    Build the key a request is matched on.
+
+    Args:
+        request (requests.PreparedRequest): The request.
+
+    Returns:
+        str: The method, path, query and scrubbed body.
+    """
+    kind, value = decode_body(request.body)
+    body = json.dumps(value, sort_keys=True) if kind == 'json' else value
+    return f"{request.method} {request_path(request.url)} {body or ''}"
+
+
+def scrub_smtp_command(line, after_challenge):
+    """
+    Scrub the credentials of an SMTP command line.
+
+    Args:
+        line (str): The command sent by the client.
+        after_challenge (bool): The last reply was a 334 AUTH challenge,
+        so the line is an encoded credential.
+
+    Returns:
+        str: The line with AUTH arguments replaced.
+    """
+    if after_challenge:
+        return REDACTED
+    words = line.split(' ', 2)
+    if words[0].upper() == 'AUTH' and len(words) > 2:
+        return f"{words[0]} {words[1]} {REDACTED}"
+    return line
+
+
+class _ReplaySocket:
+    """
+    Stands in for the socket of a replayed SMTP connection.
+    """
+
+    def sendall(self, data):
+        """
+        Discard the data; send() is replayed above the socket.
+        """
+
+    def close(self):
+        """
+        Nothing to release.
+        """
+
+
+class Cassette:
+    """
+    Records or replays the HTTP and SMTP traffic of a block of code.
+
+    Args:
+        path (str): The cassette file; gzipped when it ends with '.gz'.
+        mode (str): 'record' to capture live traffic, 'replay' to serve
+        it from the file, or 'once' to record only when the file does not
+        exist. Defaults to 'record' when PLEXTRAC_MFA_RECORD is set, else
+        'once'.
+    """
+
+    def __init__(self, path, mode=None):
+        if mode is None:
+            mode = 'record' if os.environ.get(RECORD_ENV) else 'once'
+        if mode == 'once':
+            mode = 'replay' if os.path.exists(path) else 'record'
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode: {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.http = []
+        self.smtp = []
+        self.sent_messages = []
+        self._responses = collections.defaultdict(collections.deque)
+        self._connections = collections.deque()
+        self._lock = threading.Lock()
+        self._patches = []
+
+    @property
+    def recording(self):
+        """
+        Whether live traffic is being captured.
+        """
+        return self.mode == 'record'
+
+    def __enter__(self):
+        if not self.recording:
+            self.load()
+        self._patches = [
+            patch.object(requests.Session, 'send', self._http_send()),
+            patch.object(smtplib.SMTP, '_get_socket', self._smtp_socket()),
+            patch.object(smtplib.SMTP, 'send', self._smtp_send()),
+            patch.object(smtplib.SMTP, 'getreply', self._smtp_getreply()),
+        ]
+        if not self.recording:
+            self._patches.append(
+                patch.object(smtplib.SMTP, 'starttls', _replay_starttls))
+        for active in self._patches:
+            active.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for active in reversed(self._patches):
+            active.stop()
+        self._patches = []
+        if self.recording and exc_type is None:
+            self.save()
+
+    def load(self):
+        """
+        Read the recorded traffic from the cassette file.
+
+        Raises:
+            OSError: If the file cannot be read.
+            ValueError: If it is not a cassette of a supported version.
+        """
+        opener = gzip.open if self.path.endswith('.gz') else open
+        with opener(self.path, 'rt', encoding='utf-8') as cassette_file:
+            data = json.load(cassette_file)
+        if data.get('version') != CASSETTE_VERSION:
+            raise ValueError(f"{self.path}: unsupported cassette version "
+                             f"{data.get('version')!r}")
+        self.http = data.get('http', [])
+        self.smtp = data.get('smtp', [])
+        for entry in self.http:
+            self._responses[entry['key']].append(entry)
+        self._connections.extend(self.smtp)
+
+    def save(self):
+        """
+        Write the recorded traffic to the cassette file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        opener = gzip.open if self.path.endswith('.gz') else open
+        with opener(self.path, 'wt', encoding='utf-8') as cassette_file:
+            json.dump({'version': CASSETTE_VERSION, 'http': self.http,
+                       'smtp': self.smtp}, cassette_file, indent=1)
+            cassette_file.write('\n')
+
+    def _http_send(self):
+        cassette = self
+        real_send = requests.Session.send
+
+        def send(session, request, **kwargs):
+            key = request_key(request)
+            if not cassette.recording:
+                return cassette._replay_http(key, request)
+            try:
+                response = real_send(session, request, **kwargs)
+            except requests.exceptions.RequestException as e:
+                with cassette._lock:
+                    cassette.http.append({'key': key,
+                                          'error': type(e).__name__,
+                                          'message': str(e)})
+                raise
+            kind, value = decode_body(response.content)
+            entry = {'key': key, 'status': response.status_code,
+                     'reason': response.reason,
+                     'headers': {name: response.headers[name]
+                                 for name in ('Content-Type',)
+                                 if name in response.headers}}
+            if kind is not None:
+                entry[kind] = value
+            with cassette._lock:
+                cassette.http.append(entry)
+            return response
+
+        return send
+
+    def _replay_http(self, key, request):
+        with self._lock:
+            recorded = self._responses.get(key)
+            if not recorded:
+                raise CassetteMismatch(
+                    f"{self.path}: no recorded response for {key}")
+            entry = recorded.popleft()
+        if 'error' in entry:
+            error = getattr(requests.exceptions, entry['error'],
+                            requests.exceptions.ConnectionError)
+            raise error(entry.get('message', ''), request=request)
+        kind = next((kind for kind in ('json', 'text', 'base64')
+                     if kind in entry), None)
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry.get('reason', '')
+        response.headers = CaseInsensitiveDict(entry.get('headers', {}))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(encode_body(kind, entry.get(kind)))
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(0)
+        return response
+
+    def _smtp_socket(self):
+        cassette = self
+        real_get_socket = smtplib.SMTP._get_socket
+
+        def get_socket(smtp, host, port, timeout):
+            # pylint: disable=protected-access
+            if cassette.recording:
+                sock = real_get_socket(smtp, host, port, timeout)
+                smtp._cassette_transcript = []
+                with cassette._lock:
+                    cassette.smtp.append(smtp._cassette_transcript)
+                return sock
+            with cassette._lock:
+                if not cassette._connections:
+                    raise CassetteMismatch(
+                        f"{cassette.path}: no recorded SMTP connection")
+                smtp._cassette_transcript = collections.deque(
+                    cassette._connections.popleft())
+            return _ReplaySocket()
+
+        return get_socket
+
+    def _smtp_send(self):
+        cassette = self
+        real_send = smtplib.SMTP.send
+
+        def send(smtp, data):
+            # pylint: disable=protected-access
+            raw = data.encode('ascii') if isinstance(data, str) else data
+            in_data = getattr(smtp, '_cassette_in_data', False)
+            if in_data:
+                with cassette._lock:
+                    cassette.sent_messages.append(raw)
+                line = MESSAGE
+            else:
+                line = scrub_smtp_command(
+                    raw.decode('utf-8', 'replace').rstrip('\r\n'),
+                    getattr(smtp, '_cassette_last_code', None) == 334)
+            if cassette.recording:
+                real_send(smtp, data)
+                smtp._cassette_transcript.append({'send': line})
+                return
+            if smtp.sock is None:
+                raise smtplib.SMTPServerDisconnected(
+                    'please run connect() first')
+            transcript = smtp._cassette_transcript
+            if not transcript or 'send' not in transcript[0]:
+                raise CassetteMismatch(
+                    f"{cassette.path}: unexpected SMTP command {line!r}")
+            expected = transcript.popleft()['send']
+            if expected.split(' ', 1)[0].upper() \
+                    != line.split(' ', 1)[0].upper():
+                raise CassetteMismatch(
+                    f"{cassette.path}: sent SMTP {line!r}, recorded "
+                    f"{expected!r}")
+
+        return send
+
+    def _smtp_getreply(self):
+        cassette = self
+        real_getreply = smtplib.SMTP.getreply
+
+        def getreply(smtp):
+            # pylint: disable=protected-access
+            if cassette.recording:
+                code, message = real_getreply(smtp)
+                smtp._cassette_transcript.append(
+                    {'reply': [code, message.decode('utf-8', 'replace')]})
+            else:
+                transcript = smtp._cassette_transcript
+                if not transcript or 'reply' not in transcript[0]:
+                    smtp.close()
+                    raise smtplib.SMTPServerDisconnected(
+                        'Connection unexpectedly closed')
+                code, text = transcript.popleft()['reply']
+                message = text.encode('utf-8')
+            smtp._cassette_last_code = code
+            smtp._cassette_in_data = code == 354
+            return code, message
+
+        return getreply
+
+
+def _replay_starttls(smtp, *args, **kwargs):
+    """
+    Replay STARTTLS without wrapping the socket, resetting the session as
+    smtplib.SMTP.starttls does.
+    """
+    # pylint: disable=unused-argument
+    smtp.ehlo_or_helo_if_needed()
+    if not smtp.has_extn('starttls'):
+        raise smtplib.SMTPNotSupportedError(
+            'STARTTLS extension not supported by server.')
+    code, reply = smtp.docmd('STARTTLS')
+    if code != 220:
+        raise smtplib.SMTPResponseException(code, reply)
+    smtp.helo_resp = smtp.ehlo_resp = None
+    smtp.esmtp_features = {}
+    smtp.does_esmtp = False
+    return code, reply
+
+
+def main(argv=None):
+    """
+    Run a main.py command under a recording cassette.
+
+    Args:
+        argv (list): The cassette path, then '--' and the main.py
+        arguments.
+
+    Returns:
+        int: The exit status of the command.
+    """
+    import main as main_module
+
+    parser = argparse.ArgumentParser(
+        prog='python -m tests.integration.cassette',
+        description='Record the HTTP and SMTP traffic of a main.py command.')
+    parser.add_argument('path', help='cassette file written')
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help='main.py arguments, after --')
+    args = parser.parse_args(argv)
+    command = args.args[1:] if args.args[:1] == ['--'] else args.args
+    with Cassette(args.path, mode='record'):
+        return main_module.main(command)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Cassettes shared by the integration and regression suites, and how they
+are recorded.
+
+The large tenant cassette holds one full 'send' run against a tenant of
+LARGE_TENANT_USERS users: authentication, every page of users and the SMTP
+session delivering the report. It is recorded from the local fakes of
+tests/performance when it is missing, or again when PLEXTRAC_MFA_RECORD is
+set, and replayed from disk otherwise.
+"""
+
+import io
+import os
+from contextlib import redirect_stdout
+
+from tests.integration.cassette import RECORD_ENV, Cassette
+
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'cassettes')
+LARGE_TENANT = os.path.join(CASSETTE_DIR, 'large_tenant.json.gz')
+LARGE_TENANT_USERS = 5000
+CUSTOMER_DOMAINS = ['customer1.com', 'customer3.com']
+
+
+def large_tenant_config(plextrac_url='https://plextrac.invalid',
+                        smtp_host='smtp.invalid', smtp_port=25, **overrides):
+    """
+    Build the configuration the large tenant cassette was recorded with.
+
+    The instance and SMTP addresses do not matter on replay. Keys that
+    change the requests sent, such as 'page_size' or 'filter_pushdown',
+    must not be overridden.
+
+    Args:
+        plextrac_url (str): The Plextrac instance.
+        smtp_host (str): The SMTP server.
+        smtp_port (int): The SMTP port.
+        **overrides: Other configuration keys.
+
+    Returns:
+        dict: The configuration.
+    """
+    return dict({
+        'plextrac_url': plextrac_url,
+        'plextrac_username': 'auditor@example.com',
+        'plextrac_password': 'recorded-password',
+        'customer': 'Example',
+        'customer_domains': CUSTOMER_DOMAINS,
+        'poc_email': 'security@example.com',
+        'gmail_username': 'reports@example.com',
+        'gmail_app_password': '',
+        'smtp_host': smtp_host,
+        'smtp_port': smtp_port,
+        'smtp_starttls': False,
+        'page_size': 1000,
+        'token_cache_path': None,
+        'snapshot_db': None,
+        'mail_spool_dir': None,
+    }, **overrides)
+
+
+def record_large_tenant():
+    """
+    Record the large tenant cassette from the local fakes.
+    """
+    import main
+    from tests.performance.fake_plextrac import FakePlextracServer
+    from tests.performance.smtp_sink import SmtpSink
+
+    with FakePlextracServer(LARGE_TENANT_USERS) as server, \
+            SmtpSink() as smtp, \
+            Cassette(LARGE_TENANT, mode='record'), \
+            redirect_stdout(io.StringIO()):
+        main.run_scan(large_tenant_config(server.url, smtp.host, smtp.port))
+
+
+def ensure_large_tenant():
+    """
+    Record the large tenant cassette when it is missing or a new
+    recording is asked for.
+    """
+    if os.environ.get(RECORD_ENV) or not os.path.exists(LARGE_TENANT):
+        record_large_tenant()
+
+
+def large_tenant_cassette():
+    """
+    Open the large tenant cassette for replay.
+
+    Returns:
+        Cassette: The cassette, to be entered around the code under test.
+    """
+    ensure_large_tenant()
+    return Cassette(LARGE_TENANT, mode='replay')
@@ -0,0 +1,112 @@
+"""
+Integration tests for the record/replay cassettes.
+
+These tests record a scan against the local Plextrac and SMTP fakes, then
+replay it with both fakes stopped, and validate that secrets never reach
+the cassette file.
+"""
+
+import email
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import main
+from tests.integration import cassette, fixtures
+from tests.performance.fake_plextrac import TOKEN, FakePlextracServer
+from tests.performance.smtp_sink import SmtpSink
+
+
+def message_text(data):
+    """
+    Extract the plain text of a message sent over SMTP.
+    """
+    message = email.message_from_bytes(data)
+    return [part.get_payload(decode=True) for part in message.walk()
+            if part.get_content_type() == 'text/plain']
+
+
+class TestCassette(unittest.TestCase):
+    """
+    Integration tests for the record/replay cassettes.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the cassettes.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'scan.json.gz')
+
+    def tearDown(self):
+        """
+        Clean up the temporary directory.
+        """
+        self.tmp_dir.cleanup()
+
+    def run_send(self, config):
+        """
+        Run the send command and return what it printed.
+        """
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main.run_scan(config)
+        return output.getvalue()
+
+    def test_recorded_scan_replays_offline(self):
+        """
+        Test that a recorded scan replays with the servers gone and sends
+        the same report.
+        """
+        with FakePlextracServer(300) as server, SmtpSink() as smtp:
+            config = fixtures.large_tenant_config(server.url, smtp.host,
+                                                  smtp.port)
+            with cassette.Cassette(self.path, mode='record') as recorder:
+                recorded = self.run_send(config)
+            self.assertEqual(smtp.messages, 1)
+
+        with cassette.Cassette(self.path) as player:
+            self.assertFalse(player.recording)
+            replayed = self.run_send(config)
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(len(player.sent_messages), 1)
+        self.assertEqual(message_text(player.sent_messages[0]),
+                         message_text(recorder.sent_messages[0]))
+
+    def test_secrets_are_scrubbed(self):
+        """
+        Test that passwords, tokens and AUTH exchanges are not stored.
+        """
+        with FakePlextracServer(10) as server, SmtpSink() as smtp, \
+                cassette.Cassette(self.path, mode='record'):
+            self.run_send(fixtures.large_tenant_config(
+                server.url, smtp.host, smtp.port,
+                plextrac_password='hunter2'))
+        with gzip.open(self.path, 'rt', encoding='utf-8') as recorded:
+            text = recorded.read()
+        self.assertNotIn('hunter2', text)
+        self.assertNotIn(TOKEN, text)
+        self.assertIn(cassette.REDACTED, text)
+        self.assertEqual(
+            cassette.scrub_smtp_command('AUTH PLAIN AGEAYg==', False),
+            f"AUTH PLAIN {cassette.REDACTED}")
+        self.assertEqual(cassette.scrub_smtp_command('c2VjcmV0', True),
+                         cassette.REDACTED)
+        self.assertEqual(cassette.request_path('https://x/u?limit=1&token=t'),
+                         '/u?limit=1&token=%3Credacted%3E')
+
+    def test_unrecorded_request_is_reported(self):
+        """
+        Test that a request missing from the cassette fails the scan
+        instead of reaching the network.
+        """
+        with fixtures.large_tenant_cassette():
+            with self.assertRaises(cassette.CassetteMismatch):
+                self.run_send(fixtures.large_tenant_config(page_size=500))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Integration tests for full scans of a large recorded tenant.
+
+These tests replay the large tenant cassette through the real client,
+engine, report and mail transport, offline and in milliseconds, and check
+the result against the users the tenant was generated from.
+"""
+
+import email
+import io
+import unittest
+from contextlib import redirect_stderr
+
+import engine
+import main
+import metrics
+from tests.integration import fixtures
+from tests.performance.fake_plextrac import make_user
+
+
+def expected_noncompliant():
+    """
+    List the emails of the non-compliant customer users of the tenant.
+    """
+    emails = []
+    for index in range(fixtures.LARGE_TENANT_USERS):
+        user = make_user(index)
+        if user['email'].split('@')[1] in fixtures.CUSTOMER_DOMAINS \
+                and not user['mfa']['enabled']:
+            emails.append(user['email'])
+    return emails
+
+
+class TestLargeTenantScan(unittest.TestCase):
+    """
+    Integration tests for full scans of a large recorded tenant.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Record the cassette if it is missing.
+        """
+        fixtures.ensure_large_tenant()
+
+    def test_send_emails_every_noncompliant_user(self):
+        """
+        Test that the report sent lists exactly the non-compliant users.
+        """
+        with fixtures.large_tenant_cassette() as player, \
+                redirect_stderr(io.StringIO()) as output:
+            main.run_scan(fixtures.large_tenant_config())
+        self.assertIn('Email sent successfully', output.getvalue())
+        [sent] = player.sent_messages
+        message = email.message_from_bytes(sent)
+        self.assertEqual(message['To'], 'security@example.com')
+        text = next(part.get_payload(decode=True).decode('utf-8')
+                    for part in message.walk()
+                    if part.get_content_type() == 'text/plain')
+        listed = [line[len('Email: '):] for line in text.splitlines()
+                  if line.startswith('Email: ')]
+        self.assertEqual(sorted(listed), sorted(expected_noncompliant()))
+
+    def test_streamed_pages_give_the_same_users(self):
+        """
+        Test that streaming and whole-page decoding agree.
+        """
+        results = []
+        for json_stream in (False, True):
+            with fixtures.large_tenant_cassette():
+                users, _ = main.scan_users(fixtures.large_tenant_config(
+                    json_stream=json_stream))
+            results.append([user.email for user in users
+                            if engine.is_noncompliant(user)])
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(sorted(results[0]), sorted(expected_noncompliant()))
+
+    def test_metrics_count_the_whole_tenant(self):
+        """
+        Test that every recorded user and page is accounted for.
+        """
+        run_metrics = metrics.Metrics()
+        with fixtures.large_tenant_cassette():
+            main.scan_users(fixtures.large_tenant_config(),
+                            metrics=run_metrics)
+        self.assertEqual(run_metrics.total('users_fetched'),
+                         fixtures.LARGE_TENANT_USERS)
+        # The reported total ends the scan without an empty last page
+        self.assertEqual(run_metrics.total('pages'),
+                         fixtures.LARGE_TENANT_USERS // 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
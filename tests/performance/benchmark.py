@@ -0,0 +1,283 @@
+"""
+Benchmarks the compliance scan against a local fake Plextrac server and a
+local SMTP sink, and checks the results against stored JSON baselines.
+
+Run from the repository root:
+
+    python -m tests.performance.benchmark --sizes 1000 100000
+    python -m tests.performance.benchmark --sizes 1000 --update-baseline
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import engine
+import mailer
+import main
+import plextrac_api
+import report
+import snapshot_store
+from tests.performance.fake_plextrac import FakePlextracServer
+from tests.performance.smtp_sink import SmtpSink
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'baselines.json')
+# Allowed slowdown of users/sec against the baseline before failing.
+REGRESSION_THRESHOLD = 0.25
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+
+
+@contextlib.contextmanager
+def measure(metrics, name):
+    """
+    Record the wall time and peak traced memory of a block.
+
+    Args:
+        metrics (dict): Receives '<name>' -> {'seconds', 'peak_bytes'}.
+        name (str): The phase name.
+    """
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # Python < 3.9 can only reset the peak by restarting the tracing
+        tracemalloc.stop()
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics[name] = {
+            'seconds': time.perf_counter() - start,
+            'peak_bytes': tracemalloc.get_traced_memory()[1],
+        }
+
+
+def bench_config(server, sink, **overrides):
+    """
+    Build a configuration pointing at the fake server and SMTP sink.
+    """
+    config = {
+        'plextrac_url': server.url,
+        'plextrac_username': 'bench',
+        'plextrac_password': 'bench',
+        'gmail_username': 'bench@example.com',
+        'gmail_app_password': '',
+        'customer': 'Bench',
+        'customer_domains': [f"customer{i}.com"
+                             for i in range(server.domain_count)],
+        'poc_email': ['poc@example.com'],
+        'smtp_host': sink.host,
+        'smtp_port': sink.port,
+        'smtp_starttls': False,
+        'token_cache_path': None,
+        'snapshot_db': None,
+        'mail_spool_dir': None,
+        'report_formats': ['plain', 'html', 'csv'],
+    }
+    config.update(overrides)
+    return config
+
+
+def run_phases(config):
+    """
+    Run each phase of a scan separately and measure it.
+
+    Returns:
+        tuple: The phase metrics and the number of customer users.
+    """
+    phases = {}
+    target = engine.scan_targets(config)[0]
+    client = plextrac_api.client_from_config(target['plextrac_url'], config)
+    with client:
+        with measure(phases, 'auth'):
+            auth = client.authenticate(target['plextrac_username'],
+                                       target['plextrac_password'])
+        with measure(phases, 'fetch_filter'):
+            users = engine.collect_customer_users(target, auth, client)
+    with measure(phases, 'snapshot'):
+        with snapshot_store.SnapshotStore(':memory:') as store:
+            store.record_scan(users)
+    with measure(phases, 'render'):
+        messages = report.build_messages(
+            'Benchmark', report.full_sections(users, engine.is_noncompliant),
+            'Benchmark', formats=config['report_formats'])
+    with measure(phases, 'send'):
+        with mailer.open_transport(config) as transport:
+            for message in messages:
+                message['From'] = config['gmail_username']
+                transport.send(message, config['poc_email'])
+    return phases, len(users)
+
+
+def run_end_to_end(config):
+    """
+    Run authenticate_and_send_email from a temporary working directory.
+
+    Returns:
+        dict: The wall time and peak traced memory of the run.
+    """
+    metrics = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, 'config.json'), 'w',
+                  encoding='utf-8') as config_file:
+            json.dump(config, config_file)
+        os.chdir(tmp_dir)
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                with measure(metrics, 'end_to_end'):
+                    main.authenticate_and_send_email()
+        finally:
+            os.chdir(cwd)
+    return metrics['end_to_end']
+
+
+def run_benchmark(user_count, latency=0.0, page_size=plextrac_api.PAGE_SIZE,
+                  prefetch=plextrac_api.PREFETCH_PAGES, json_stream=False):
+    """
+    Benchmark a scan of a synthetic tenant.
+
+    Args:
+        user_count (int): The number of users in the tenant.
+        latency (float): Seconds of latency injected per API request.
+        page_size (int): The users requested per page.
+        prefetch (int): The pages requested concurrently.
+        json_stream (bool): Parse responses incrementally.
+
+    Returns:
+        dict: Per-phase and end-to-end timings, peak memory and throughput.
+    """
+    tracemalloc.start()
+    try:
+        with FakePlextracServer(user_count, latency=latency) as server, \
+                SmtpSink() as sink:
+            config = bench_config(server, sink, page_size=page_size,
+                                  prefetch_pages=prefetch,
+                                  json_stream=json_stream)
+            phases, customer_users = run_phases(config)
+            end_to_end = run_end_to_end(config)
+            requests_made = server.requests
+            messages = sink.messages
+    finally:
+        tracemalloc.stop()
+    wall = sum(phase['seconds'] for phase in phases.values())
+    return {
+        'users': user_count,
+        'customer_users': customer_users,
+        'latency': latency,
+        'phases': phases,
+        'wall_seconds': wall,
+        'users_per_second': user_count / wall,
+        'peak_bytes': max(phase['peak_bytes'] for phase in phases.values()),
+        'end_to_end': dict(end_to_end,
+                           users_per_second=user_count
+                           / end_to_end['seconds']),
+        'api_requests': requests_made,
+        'messages_sent': messages,
+    }
+
+
+def check_regressions(results, baselines, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare results with baselines of the same size.
+
+    Args:
+        results (dict): Benchmark results keyed by user count.
+        baselines (dict): Stored results keyed by user count.
+        threshold (float): The allowed relative drop in users/sec, and rise
+        in peak memory.
+
+    Returns:
+        list: A message per regression; empty when none.
+    """
+    problems = []
+    for size, result in results.items():
+        baseline = baselines.get(str(size))
+        if not baseline:
+            continue
+        floor = baseline['users_per_second'] * (1 - threshold)
+        if result['users_per_second'] < floor:
+            problems.append(
+                f"{size} users: {result['users_per_second']:,.0f} users/s "
+                f"is below the baseline of "
+                f"{baseline['users_per_second']:,.0f} users/s")
+        ceiling = baseline['peak_bytes'] * (1 + threshold)
+        if result['peak_bytes'] > ceiling:
+            problems.append(
+                f"{size} users: peak memory of {result['peak_bytes']:,} "
+                f"bytes exceeds the baseline of "
+                f"{baseline['peak_bytes']:,} bytes")
+    return problems
+
+
+def load_baselines(path=BASELINE_PATH):
+    """
+    Load stored baselines, or an empty dict when there are none.
+    """
+    try:
+        with open(path, encoding='utf-8') as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+def main_cli(argv=None):
+    """
+    Run the benchmarks from the command line.
+
+    Returns:
+        int: 1 when a regression was found, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(prog='benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=list(DEFAULT_SIZES),
+                        help='tenant sizes to benchmark')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of latency per API request')
+    parser.add_argument('--page-size', type=int,
+                        default=plextrac_api.PAGE_SIZE,
+                        help='users requested per page')
+    parser.add_argument('--json-stream', action='store_true',
+                        help='parse user pages incrementally')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='path of the JSON baselines')
+    parser.add_argument('--threshold', type=float,
+                        default=REGRESSION_THRESHOLD,
+                        help='allowed relative regression')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the results as the new baselines')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        results[size] = run_benchmark(size, latency=args.latency,
+                                      page_size=args.page_size,
+                                      json_stream=args.json_stream)
+        result = results[size]
+        phases = ', '.join(f"{name} {phase['seconds']:.3f}s"
+                           for name, phase in result['phases'].items())
+        print(f"{size} users: {result['users_per_second']:,.0f} users/s, "
+              f"peak {result['peak_bytes'] / 2**20:.1f} MiB ({phases})")
+
+    baselines = load_baselines(args.baseline)
+    if args.update_baseline:
+        baselines.update({str(size): result
+                          for size, result in results.items()})
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+        return 0
+
+    problems = check_regressions(results, baselines, args.threshold)
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,213 @@
+"""
+A local stand-in for the Plextrac API, serving synthetic tenants.
+
+Users are generated from their index on each request, so tenants of a
+million users cost no memory. Latency can be injected per request, and the
+server can apply, ignore or reject the filters pushed down by the client.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TENANT_ID = 'bench-tenant'
+TOKEN = 'bench-token'
+
+
+def make_user(index, domain_count=10):
+    """
+    Build the synthetic user at an index.
+
+    Every other user is on a customer domain ('customerN.com') and every
+    third user has MFA disabled.
+
+    Args:
+        index (int): The position of the user in the tenant.
+        domain_count (int): The number of distinct domains of each kind.
+
+    Returns:
+        dict: A user entry shaped like the Plextrac API's.
+    """
+    kind = 'customer' if index % 2 else 'other'
+    return {
+        'id': f"user-{index}",
+        'email': f"user{index}@{kind}{index % domain_count}.com",
+        'fullName': f"User {index}",
+        'role': 'STD_USER',
+        'status': 'active',
+        'lastLogin': '2024-01-01T00:00:00.000Z',
+        'mfa': {'enabled': bool(index % 3), 'type': 'totp'},
+    }
+
+
+class FakePlextracServer:
+    """
+    A threaded HTTP server implementing the endpoints used by the scan.
+
+    Args:
+        user_count (int): The number of users in the tenant.
+        latency (float): Seconds slept before answering each request.
+        max_page_size (int): The largest page served; larger limits are
+        capped, as a real API would.
+        domain_count (int): The number of distinct domains of each kind.
+        filter_mode (str): What to do with the 'email_domain' and
+        'mfa_enabled' filters: 'ignore' them, 'apply' them or 'reject'
+        them with a 400.
+    """
+
+    def __init__(self, user_count, latency=0.0, max_page_size=1000,
+                 domain_count=10, filter_mode='ignore'):
+        self.user_count = user_count
+        self.filter_mode = filter_mode
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.domain_count = domain_count
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                           self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        The base URL of the server.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Serve requests on a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving and release the socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def users_page(self, offset, limit, domains=(), mfa_enabled=None):
+        """
+        Build the body of a users page.
+
+        Filtering generates every user of the tenant, so it is only meant
+        for small tenants.
+
+        Args:
+            offset (int): The index of the first user.
+            limit (int): The requested page size.
+            domains (list): Only list users on these domains or their
+            subdomains.
+            mfa_enabled (bool): Only list users in this MFA state, unless
+            None.
+
+        Returns:
+            bytes: The JSON body.
+        """
+        limit = min(limit, self.max_page_size)
+        if not domains and mfa_enabled is None:
+            end = min(self.user_count, offset + limit)
+            users = [make_user(i, self.domain_count)
+                     for i in range(offset, end)]
+            total = self.user_count
+        else:
+            suffixes = tuple('.' + domain for domain in domains)
+            matching = []
+            for index in range(self.user_count):
+                user = make_user(index, self.domain_count)
+                domain = user['email'].split('@')[1]
+                if domains and domain not in domains \
+                        and not domain.endswith(suffixes):
+                    continue
+                if mfa_enabled is not None \
+                        and user['mfa']['enabled'] != mfa_enabled:
+                    continue
+                matching.append(user)
+            users = matching[offset:offset + limit]
+            total = len(matching)
+        return json.dumps({'data': users,
+                           'meta': {'total': total}}).encode()
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Routes requests to the fake endpoints.
+            """
+
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def _reply(self, status, body):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                fake._count(len(body))  # pylint: disable=protected-access
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """
+                Serve the authenticate endpoint.
+                """
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                if urlparse(self.path).path != '/api/v1/authenticate':
+                    self._reply(404, b'{}')
+                    return
+                self._reply(200, json.dumps(
+                    {'token': TOKEN, 'tenant_id': TENANT_ID}).encode())
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Serve the tenant users endpoint.
+                """
+                url = urlparse(self.path)
+                if url.path != f"/api/v2/tenants/{TENANT_ID}/users":
+                    self._reply(404, b'{}')
+                    return
+                if self.headers.get('Authorization') != f"Bearer {TOKEN}":
+                    self._reply(401, b'{}')
+                    return
+                query = parse_qs(url.query)
+                offset = int(query.get('offset', ['0'])[0])
+                limit = int(query.get('limit', ['100'])[0])
+                domains = query.get('email_domain', [])
+                mfa = query.get('mfa_enabled', [None])[0]
+                filtered = bool(domains) or mfa is not None
+                if filtered and fake.filter_mode == 'reject':
+                    self._reply(400, b'{"message": "unknown parameter"}')
+                    return
+                if not filtered or fake.filter_mode == 'ignore':
+                    domains, mfa = [], None
+                self._reply(200, fake.users_page(
+                    offset, limit, domains,
+                    None if mfa is None else mfa == 'true'))
+
+        return Handler
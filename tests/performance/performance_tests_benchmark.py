@@ -0,0 +1,76 @@
+"""
+Performance tests for the benchmark harness.
+
+Runs a small benchmark against the fake Plextrac server and SMTP sink,
+and validates the baseline regression check.
+"""
+
+import tracemalloc
+import unittest
+from unittest.mock import MagicMock, patch
+
+from tests.performance import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests for the benchmark harness in tests/performance/benchmark.py.
+    """
+
+    def test_small_tenant(self):
+        """
+        Benchmark a 1k user tenant end to end.
+        """
+        result = benchmark.run_benchmark(1_000, page_size=100, prefetch=4)
+        self.assertEqual(result['customer_users'], 500)
+        self.assertEqual(set(result['phases']),
+                         {'auth', 'fetch_filter', 'snapshot', 'render',
+                          'send'})
+        self.assertGreaterEqual(result['api_requests'], 1 + 10)
+        self.assertEqual(result['messages_sent'], 2)
+        self.assertGreater(result['users_per_second'], 0)
+
+    def test_every_default_size_has_a_baseline(self):
+        """
+        Test that the stored baselines cover every size benchmarked by
+        default, so none of them goes unchecked.
+        """
+        baselines = benchmark.load_baselines()
+        for size in benchmark.DEFAULT_SIZES:
+            self.assertIn(str(size), baselines)
+
+    def test_measure_without_reset_peak(self):
+        """
+        Test that peaks are measured on Pythons without reset_peak.
+        """
+        metrics = {}
+        tracemalloc.start()
+        try:
+            with patch.object(benchmark, 'tracemalloc',
+                              MagicMock(wraps=tracemalloc,
+                                        spec=['start', 'stop',
+                                              'get_traced_memory'])):
+                with benchmark.measure(metrics, 'phase'):
+                    block = bytearray(1_000_000)
+        finally:
+            tracemalloc.stop()
+        del block
+        self.assertGreaterEqual(metrics['phase']['peak_bytes'], 1_000_000)
+
+    def test_check_regressions(self):
+        """
+        Test that slowdowns and memory growth beyond the threshold fail.
+        """
+        baselines = {'1000': {'users_per_second': 1000.0,
+                              'peak_bytes': 1000}}
+        ok = {1000: {'users_per_second': 800.0, 'peak_bytes': 1200}}
+        slow = {1000: {'users_per_second': 700.0, 'peak_bytes': 1300}}
+        self.assertEqual(benchmark.check_regressions(ok, baselines, 0.25),
+                         [])
+        self.assertEqual(
+            len(benchmark.check_regressions(slow, baselines, 0.25)), 2)
+        self.assertEqual(benchmark.check_regressions(slow, {}, 0.25), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
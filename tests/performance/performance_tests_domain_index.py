@@ -0,0 +1,72 @@
+"""
+Performance tests for domain_index.py module.
+
+Measures matching throughput for 100k users against 1k customer domains
+and compares it with the substring scan it replaced.
+"""
+
+import time
+import unittest
+
+import domain_index
+
+USER_COUNT = 100_000
+DOMAIN_COUNT = 1_000
+# Minimum acceptable throughput of the index, in users per second.
+MIN_USERS_PER_SECOND = 100_000
+
+
+def make_emails(count, domain_count):
+    """
+    Build synthetic emails, half of them on customer domains.
+    """
+    emails = []
+    for i in range(count):
+        if i % 2:
+            emails.append(f"user{i}@mail.customer{i % domain_count}.com")
+        else:
+            emails.append(f"user{i}@other{i % domain_count}.net")
+    return emails
+
+
+class TestDomainIndexPerformance(unittest.TestCase):
+    """
+    Throughput benchmarks for domain_index.py module.
+    """
+
+    def setUp(self):
+        """
+        Set up the synthetic domains and users.
+        """
+        self.domains = [f"customer{i}.com" for i in range(DOMAIN_COUNT)]
+        self.emails = make_emails(USER_COUNT, DOMAIN_COUNT)
+
+    def test_index_throughput(self):
+        """
+        Benchmark the index against 100k users and 1k domains.
+        """
+        index = domain_index.DomainIndex(self.domains)
+        start = time.perf_counter()
+        matched = sum(1 for email in self.emails if index.match(email))
+        elapsed = time.perf_counter() - start
+        rate = USER_COUNT / elapsed
+        print(f"\nDomainIndex: {USER_COUNT} users x {DOMAIN_COUNT} domains "
+              f"in {elapsed:.3f}s ({rate:,.0f} users/s)")
+        self.assertEqual(matched, USER_COUNT // 2)
+        self.assertGreater(rate, MIN_USERS_PER_SECOND)
+
+    def test_substring_scan_baseline(self):
+        """
+        Benchmark the previous substring scan on a sample, for comparison.
+        """
+        sample = self.emails[:2_000]
+        start = time.perf_counter()
+        for email in sample:
+            any(term in email for term in self.domains)
+        elapsed = time.perf_counter() - start
+        print(f"\nSubstring scan: {len(sample) / elapsed:,.0f} users/s "
+              f"with {DOMAIN_COUNT} domains")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+A minimal local SMTP server that accepts and counts every message.
+
+It speaks just enough SMTP for smtplib (no STARTTLS or AUTH), so the mail
+transport can be benchmarked without a real mail server.
+"""
+
+import socketserver
+import threading
+
+
+class SmtpSink:
+    """
+    A threaded SMTP server that discards messages after counting them.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.recipients = 0
+        self.bytes_received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer(
+            ('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self):
+        """
+        The address the sink listens on.
+        """
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        """
+        The port the sink listens on.
+        """
+        return self._server.server_address[1]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Serve connections on a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving and release the socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _record(self, recipients, size):
+        with self._lock:
+            self.messages += 1
+            self.recipients += recipients
+            self.bytes_received += size
+
+    def _handler_class(self):
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            """
+            Handles one SMTP session.
+            """
+
+            def reply(self, line):
+                """
+                Send one response line.
+                """
+                self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+            def read_data(self):
+                """
+                Read a DATA payload up to the terminating dot.
+                """
+                size = 0
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(line)
+                return size
+
+            def handle(self):
+                with sink._lock:  # pylint: disable=protected-access
+                    sink.connections += 1
+                self.reply('220 smtp-sink ready')
+                recipients = 0
+                for line in self.rfile:
+                    command = line.decode('ascii', 'replace').strip().upper()
+                    if command.startswith(('EHLO', 'HELO')):
+                        self.reply('250 smtp-sink')
+                    elif command.startswith('MAIL FROM'):
+                        recipients = 0
+                        self.reply('250 OK')
+                    elif command.startswith('RCPT TO'):
+                        recipients += 1
+                        self.reply('250 OK')
+                    elif command == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        size = self.read_data()
+                        sink._record(  # pylint: disable=protected-access
+                            recipients, size)
+                        self.reply('250 OK')
+                    elif command == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('250 OK')
+
+        return Handler
@@ -0,0 +1,71 @@
+"""
+Regression tests for the output of scans of a large recorded tenant.
+
+These tests replay the large tenant cassette and compare the scan listing
+and the rendered reports with golden files. A golden file is written when
+it is missing, or again when PLEXTRAC_MFA_RECORD is set; review the diff
+before committing it.
+"""
+
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+
+import main
+from tests.integration import fixtures
+from tests.integration.cassette import RECORD_ENV
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'golden')
+
+
+class TestReportRegression(unittest.TestCase):
+    """
+    Regression tests for the output of scans of a large recorded tenant.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Record the cassette if it is missing.
+        """
+        fixtures.ensure_large_tenant()
+
+    def assert_golden(self, name, text):
+        """
+        Compare text with a golden file, writing the file when it is
+        missing or a new recording is asked for.
+        """
+        path = os.path.join(GOLDEN_DIR, name)
+        if os.environ.get(RECORD_ENV) or not os.path.exists(path):
+            os.makedirs(GOLDEN_DIR, exist_ok=True)
+            with open(path, 'w', encoding='utf-8', newline='') as golden:
+                golden.write(text)
+        with open(path, encoding='utf-8', newline='') as golden:
+            self.assertEqual(text, golden.read(), name)
+
+    def test_scan_listing(self):
+        """
+        Test that the scan command lists the same users.
+        """
+        with fixtures.large_tenant_cassette(), \
+                redirect_stdout(io.StringIO()) as output:
+            main.print_scan(fixtures.large_tenant_config())
+        self.assert_golden('large_tenant_scan.txt', output.getvalue())
+
+    def test_reports(self):
+        """
+        Test that the plain and HTML reports render the same.
+        """
+        for report_format, name in (('plain', 'large_tenant_report.txt'),
+                                    ('html', 'large_tenant_report.html')):
+            with fixtures.large_tenant_cassette(), \
+                    redirect_stdout(io.StringIO()) as output:
+                main.write_report(fixtures.large_tenant_config(),
+                                  report_format)
+            self.assert_golden(name, output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
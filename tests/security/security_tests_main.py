@@ -5,8 +5,11 @@ Security tests for main.py module.
 import unittest
 import os
 import json
+import smtplib
 from unittest.mock import patch, MagicMock
 
+import requests
+
 import main
 
 
@@ -26,7 +29,13 @@ class TestMainSecurity(unittest.TestCase):
             'plextrac_url': 'http://test.plextrac.com',
             'gmail_username': 'test@gmail.com',
             'gmail_app_password': 'test_app_password',
-            'customer_domains': ['example.com']
+            'customer': 'Example',
+            'customer_domains': ['example.com'],
+            'poc_email': 'poc@example.com',
+            'prefetch_pages': 1,
+            'token_cache_path': None,
+            'snapshot_db': None,
+            'mail_spool_dir': None
         }
         with open('config.json', 'w', encoding='utf-8') as f:
             json.dump(self.mock_config, f)
@@ -38,11 +47,10 @@ class TestMainSecurity(unittest.TestCase):
         # Remove the mock configuration file
         os.remove('config.json')
 
-    @patch('main.requests.post')
-    @patch('main.requests.get')
-    @patch('main.smtplib.SMTP')
+    @patch('plextrac_api.requests.Session')
+    @patch('mailer.smtplib.SMTP')
     def test_input_validation(
-            self, mock_smtp_class, mock_r_post
+            self, mock_smtp_class, mock_session_class
     ):
         """
         Test input validation and error handling.
@@ -54,41 +62,65 @@ class TestMainSecurity(unittest.TestCase):
         with self.assertRaises(json.JSONDecodeError):
             main.authenticate_and_send_email()
 
-        # Test robust error handling for network errors
-        mock_r_post.side_effect = main.requests.exceptions.RequestException(
-            "Network error")
-        with self.assertRaises(main.requests.exceptions.RequestException):
+        # Test robust error handling for network errors, with a valid
+        # configuration again
+        with open('config.json', 'w', encoding='utf-8') as f:
+            json.dump(self.mock_config, f)
+        mock_session_class.return_value.request.side_effect = \
+            requests.exceptions.RequestException("Network error")
+        with self.assertRaises(requests.exceptions.RequestException):
             main.authenticate_and_send_email()
-
-        # Test robust error handling for SMTP errors
+        mock_smtp_class.assert_not_called()
+
+        # Test robust error handling for SMTP errors: a report that could
+        # not be sent fails the run
+        mock_response_post = MagicMock(status_code=200)
+        mock_response_post.json.return_value = {'token': 'mock_token',
+                                                'tenant_id': 'mock_tenant'}
+        mock_response_get = MagicMock(status_code=200)
+        mock_response_get.json.return_value = {
+            'data': [{'email': 'test@example.com', 'fullName': 'Test User',
+                      'mfa': {'enabled': False}}],
+            'meta': {'total': 1}
+        }
+        mock_session_class.return_value.request.side_effect = \
+            lambda method, url, **kwargs: (mock_response_post
+                                           if method == 'POST'
+                                           else mock_response_get)
         mock_smtp_instance = mock_smtp_class.return_value
-        mock_smtp_instance.starttls.side_effect = main.smtplib.SMTPException(
+        mock_smtp_instance.starttls.side_effect = smtplib.SMTPException(
             "SMTP error"
         )
-        with self.assertRaises(main.smtplib.SMTPException):
+        with self.assertRaises(smtplib.SMTPException):
             main.authenticate_and_send_email()
 
-    @patch('main.requests.post')
-    @patch('main.requests.get')
-    @patch('main.smtplib.SMTP')
+    @patch('plextrac_api.requests.Session')
+    @patch('mailer.smtplib.SMTP')
     def test_secure_communication(
-            self, mock_smtp_class, mock_requests_get, mock_requests_post
+            self, mock_smtp_class, mock_session_class
     ):
         """
         Test secure communication practices.
         """
-        # Mock responses for requests.post and requests.get
+        # Mock responses for the authenticate POST and users GET
         mock_token = 'mock_token'
-        mock_response_post = MagicMock()
-        mock_response_post.json.return_value = {'token': mock_token}
-        mock_requests_post.return_value = mock_response_post
+        mock_response_post = MagicMock(status_code=200)
+        mock_response_post.json.return_value = {'token': mock_token,
+                                                'tenant_id': 'mock_tenant'}
 
         mock_user_data = {
-            'data': [{'email': 'test@example.com', 'mfa': {'enabled': False}}]
+            'data': [{'email': 'test@example.com', 'fullName': 'Test User',
+                      'mfa': {'enabled': False}}],
+            'meta': {'total': 1}
         }
-        mock_response_get = MagicMock()
+        mock_response_get = MagicMock(status_code=200)
         mock_response_get.json.return_value = mock_user_data
-        mock_requests_get.return_value = mock_response_get
+
+        mock_session = mock_session_class.return_value
+        mock_session.request.side_effect = \
+            lambda method, url, **kwargs: (mock_response_post
+                                           if method == 'POST'
+                                           else mock_response_get)
 
         # Mock SMTP server
         mock_smtp_instance = mock_smtp_class.return_value
@@ -97,8 +129,10 @@ class TestMainSecurity(unittest.TestCase):
         main.authenticate_and_send_email()
 
         # Assertions for secure communication
-        mock_requests_post.assert_called_once()
-        mock_requests_get.assert_called_once()
+        methods = [c[0][0] for c in mock_session.request.call_args_list]
+        self.assertEqual(methods, ['POST', 'GET'])
+        self.assertTrue(all(c[0][1].startswith('http://test.plextrac.com')
+                            for c in mock_session.request.call_args_list))
         mock_smtp_instance.starttls.assert_called_once()
         mock_smtp_instance.login.assert_called_once()
 
@@ -0,0 +1,40 @@
+"""
+Security tests for token_cache.py module.
+"""
+
+import os
+import tempfile
+import unittest
+
+import token_cache
+
+
+class TestTokenCacheSecurity(unittest.TestCase):
+    """
+    Unit tests for security aspects of token_cache.py module.
+    """
+
+    def test_permission_handling(self):
+        """
+        Test that the cache file and directory are private to the user.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cache', 'tokens.json')
+            cache = token_cache.TokenCache(path)
+            cache.put('key', {'token': 'secret', 'tenant_id': 't'})
+
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            self.assertEqual(
+                os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+
+    def test_credentials_are_not_stored(self):
+        """
+        Test that cache keys do not reveal the username or URL.
+        """
+        key = token_cache.cache_key('http://test.plextrac.com', 'username')
+        self.assertNotIn('username', key)
+        self.assertNotIn('plextrac', key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+"""
+Unit tests for audit_log.py functionality.
+
+These tests validate the buffered writer, size-based rotation into
+compressed segments, recovery after a crash and index-driven queries, and
+that scans record their events.
+"""
+
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+import audit_log
+import engine
+import main
+import metrics
+import plextrac_api
+from tests.performance import fake_plextrac
+
+
+class TestAuditLog(unittest.TestCase):
+    """
+    Unit tests for audit_log.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the log.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'audit', 'scan.ndjson')
+
+    def tearDown(self):
+        """
+        Clean up the temporary directory.
+        """
+        self.tmp_dir.cleanup()
+
+    def test_events_are_buffered_and_indexed(self):
+        """
+        Test that queued events are written as one indexed batch.
+        """
+        log = audit_log.AuditLog(self.path, flush_interval=60)
+        log.start()
+        log.emit('page', tenant='t1', users=10)
+        log.emit('noncompliant_user', tenant='t1', email='A@Example.com')
+        self.assertFalse(os.path.exists(self.path))
+        log.close()
+        with open(self.path, encoding='utf-8') as lines:
+            events = [json.loads(line) for line in lines]
+        self.assertEqual([event['event'] for event in events],
+                         ['page', 'noncompliant_user'])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        [entry] = audit_log.read_index(self.path + audit_log.INDEX_SUFFIX)
+        self.assertEqual(entry['events'], 2)
+        self.assertEqual(entry['tenants'], ['t1'])
+        self.assertEqual(entry['emails'], ['a@example.com'])
+
+    def test_query_reads_matching_batches_only(self):
+        """
+        Test that queries filter by tenant, email and time through the
+        index.
+        """
+        with audit_log.AuditLog(self.path) as log:
+            for tenant in ('t1', 't2', 't3'):
+                log.emit('noncompliant_user', tenant=tenant,
+                         email=f"user@{tenant}.com")
+                log.flush()
+        with patch('audit_log.parse_events',
+                   wraps=audit_log.parse_events) as mock_parse:
+            events = list(audit_log.query(self.path, tenant='t2'))
+        self.assertEqual([event['tenant'] for event in events], ['t2'])
+        self.assertEqual(mock_parse.call_count, 1)
+
+        [event] = audit_log.query(self.path, email='USER@t3.com')
+        self.assertEqual(event['tenant'], 't3')
+        self.assertEqual(list(audit_log.query(
+            self.path, since=event['ts'] + 1)), [])
+        self.assertEqual(len(list(audit_log.query(
+            self.path, until=event['ts']))), 3)
+
+    def test_rotation_compresses_and_prunes_segments(self):
+        """
+        Test that a full log becomes a gzip segment and old ones go.
+        """
+        with audit_log.AuditLog(self.path, max_bytes=150,
+                                backups=2) as log:
+            for batch in range(6):
+                log.emit('page', tenant=f"t{batch}", offset=batch * 10,
+                         padding='x' * 100)
+                log.flush()
+        directory = os.path.dirname(self.path)
+        segments = sorted(name for name in os.listdir(directory)
+                          if name.endswith('.gz'))
+        self.assertEqual(segments, ['scan.ndjson.5.gz', 'scan.ndjson.6.gz'])
+        with gzip.open(os.path.join(directory, segments[0])) as segment:
+            self.assertEqual(json.loads(segment.readline())['tenant'], 't4')
+        self.assertEqual([event['tenant']
+                          for event in audit_log.query(self.path)],
+                         ['t4', 't5'])
+        self.assertEqual(list(audit_log.query(self.path, tenant='t5'))[0]
+                         ['offset'], 50)
+
+    def test_unindexed_events_are_recovered(self):
+        """
+        Test that events written before a crash are indexed on start and
+        a partial line is cut off.
+        """
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w', encoding='utf-8') as log_file:
+            log_file.write('{"ts": 1, "event": "page", "tenant": "t1"}\n'
+                           '{"ts": 2, "event": "pa')
+        with audit_log.AuditLog(self.path) as log:
+            log.emit('page', tenant='t2')
+        self.assertEqual([event['tenant']
+                          for event in audit_log.query(self.path)],
+                         ['t1', 't2'])
+        self.assertEqual(len(audit_log.read_index(
+            self.path + audit_log.INDEX_SUFFIX)), 2)
+
+    def test_pages_are_audited(self):
+        """
+        Test that each page fetched from the API is recorded.
+        """
+        with audit_log.AuditLog(self.path) as log, \
+                fake_plextrac.FakePlextracServer(30) as server, \
+                plextrac_api.PlextracClient(server.url) as client:
+            run_metrics = metrics.Metrics(audit=log)
+            target = {'plextrac_url': server.url, 'page_size': 10,
+                      'customer_domains': ['customer0.com']}
+            matches = engine.collect_customer_users(
+                target, {'token': fake_plextrac.TOKEN,
+                         'tenant_id': fake_plextrac.TENANT_ID},
+                client, run_metrics)
+        events = list(audit_log.query(self.path,
+                                      tenant=fake_plextrac.TENANT_ID))
+        pages = [event for event in events if event['event'] == 'page']
+        self.assertEqual(sum(event['users'] for event in pages), 30)
+        self.assertEqual(
+            len([event for event in events
+                 if event['event'] == 'noncompliant_user']),
+            len([user for user in matches if engine.is_noncompliant(user)]))
+        self.assertTrue(all(event['run'] == run_metrics.run_id
+                            for event in events))
+
+    def test_scan_command_is_audited(self):
+        """
+        Test that a scan records its start, findings and end, and that
+        the audit command finds them by email.
+        """
+        dump = os.path.join(self.tmp_dir.name, 'users.ndjson')
+        with open(dump, 'w', encoding='utf-8') as dump_file:
+            for index, enabled in enumerate((False, True, False)):
+                dump_file.write(json.dumps(
+                    {'email': f"user{index}@example.com",
+                     'fullName': f"User {index}",
+                     'mfa': {'enabled': enabled}}) + '\n')
+        config = os.path.join(self.tmp_dir.name, 'config.json')
+        with open(config, 'w', encoding='utf-8') as config_file:
+            json.dump({'customer_domains': ['example.com'],
+                       'snapshot_db': None, 'token_cache_path': None,
+                       'mail_spool_dir': None, 'audit_log': self.path},
+                      config_file)
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(main.main(['scan', '--config', config,
+                                        '--input', dump]), 0)
+        self.assertEqual([event['event']
+                          for event in audit_log.query(self.path)],
+                         ['scan_start', 'noncompliant_user',
+                          'noncompliant_user', 'scan_end'])
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(main.main(['audit', '--config', config,
+                                        '--email', 'USER2@example.com',
+                                        '--since', '2000-01-01']), 0)
+        [event] = [json.loads(line)
+                   for line in output.getvalue().splitlines()]
+        self.assertEqual(event['name'], 'User 2')
+
+    def test_daemon_runs_share_one_log(self):
+        """
+        Test that the runs of a daemon share one open log per file, so
+        spool passes never start a second writer on it.
+        """
+        logs = {}
+        lock = threading.Lock()
+        config = {'audit_log': self.path, 'mail_spool_dir': None}
+        log = main.shared_audit_log(config, logs, lock)
+        try:
+            relative = dict(config, audit_log=os.path.relpath(self.path))
+            self.assertIs(main.shared_audit_log(relative, logs, lock), log)
+            self.assertIsNone(main.shared_audit_log({}, logs, lock))
+            with patch('audit_log.AuditLog.recover') as mock_recover:
+                main.run_dispatch(config, audit=log)
+                main.run_dispatch(config, audit=log)
+            mock_recover.assert_not_called()
+            self.assertTrue(log.thread.is_alive())
+        finally:
+            main.close_audit_log(log)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+Unit tests for daemon.py functionality.
+
+These tests validate cron expression handling, schedule expansion from the
+configuration, configuration hot-reload and the non-overlapping runner.
+"""
+
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+import daemon
+
+
+class TestCronSchedule(unittest.TestCase):
+    """
+    Unit tests for daemon.CronSchedule.
+    """
+
+    def test_weekly_schedule(self):
+        """
+        Test the default Friday 08:00 schedule.
+        """
+        schedule = daemon.CronSchedule('0 8 * * 5')
+        # 2024-01-01 is a Monday.
+        moment = datetime.datetime(2024, 1, 1, 12, 0)
+        self.assertEqual(schedule.next_after(moment),
+                         datetime.datetime(2024, 1, 5, 8, 0))
+        self.assertEqual(schedule.next_after(
+            datetime.datetime(2024, 1, 5, 8, 0)),
+            datetime.datetime(2024, 1, 12, 8, 0))
+
+    def test_steps_ranges_and_lists(self):
+        """
+        Test step, range and list fields.
+        """
+        schedule = daemon.CronSchedule('*/15 9-10 * * 1,3')
+        self.assertEqual(schedule.minutes, {0, 15, 30, 45})
+        self.assertEqual(schedule.hours, {9, 10})
+        self.assertEqual(schedule.next_after(
+            datetime.datetime(2024, 1, 1, 10, 50)),
+            datetime.datetime(2024, 1, 3, 9, 0))
+
+    def test_day_of_month_or_day_of_week(self):
+        """
+        Test that restricted day-of-month and day-of-week fields are OR-ed.
+        """
+        schedule = daemon.CronSchedule('0 0 15 * 0')
+        self.assertTrue(schedule.matches_day(datetime.date(2024, 1, 15)))
+        self.assertTrue(schedule.matches_day(datetime.date(2024, 1, 7)))
+        self.assertFalse(schedule.matches_day(datetime.date(2024, 1, 8)))
+
+    def test_stepped_day_field_is_unrestricted(self):
+        """
+        Test that a day field starting with '*' is AND-ed with the other,
+        as in cron.
+        """
+        # Every other day of the month, on Mondays only
+        schedule = daemon.CronSchedule('0 0 */2 * 1')
+        self.assertTrue(schedule.matches_day(datetime.date(2024, 1, 1)))
+        self.assertFalse(schedule.matches_day(datetime.date(2024, 1, 8)))
+        self.assertFalse(schedule.matches_day(datetime.date(2024, 1, 3)))
+        # The 1st only, whatever the day of the week
+        schedule = daemon.CronSchedule('0 0 1 * */1')
+        self.assertTrue(schedule.matches_day(datetime.date(2024, 1, 1)))
+        self.assertFalse(schedule.matches_day(datetime.date(2024, 1, 2)))
+
+    def test_invalid_expressions(self):
+        """
+        Test that malformed expressions are rejected.
+        """
+        for expression in ('0 8 * *', '60 8 * * *', '0 8 * * 1-', '*/0 * * '
+                           '* *'):
+            with self.assertRaises(ValueError):
+                daemon.CronSchedule(expression)
+
+    def test_snapshot_db_is_not_shared_across_domains(self):
+        """
+        Test that schedules scanning different domains cannot share one
+        snapshot database.
+        """
+        config = {'customer_domains': ['example.com'], 'schedules': [
+            {'cron': '0 8 * * 5'},
+            {'cron': '0 9 * * 1', 'customer_domains': ['acme.com']}]}
+        with self.assertRaises(ValueError):
+            daemon.schedules_from_config(config)
+        config['schedules'][1]['snapshot_db'] = 'acme.sqlite3'
+        self.assertEqual(len(daemon.schedules_from_config(config)), 2)
+        config['schedules'][1].update(snapshot_db=None,
+                                      customer_domains=['EXAMPLE.com'])
+        self.assertEqual(len(daemon.schedules_from_config(config)), 2)
+
+
+class TestDaemon(unittest.TestCase):
+    """
+    Unit tests for daemon.Daemon.
+    """
+
+    def setUp(self):
+        """
+        Set up a configuration file and a controllable clock.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.tmp_dir.name, 'config.json')
+        self.clock = [datetime.datetime(2024, 1, 1, 7, 59)]
+        self.runs = []
+        self.write_config({'customer': 'Base', 'schedules': [
+            {'cron': '0 8 * * *', 'customer': 'Acme'},
+            {'cron': '0 8 * * *'}]})
+        self.daemon = daemon.Daemon(self.config_path, self.run_scan,
+                                    now=lambda: self.clock[0])
+
+    def tearDown(self):
+        """
+        Clean up the temporary directory.
+        """
+        self.tmp_dir.cleanup()
+
+    def write_config(self, config):
+        """
+        Write the configuration file with a fresh modification time.
+        """
+        with open(self.config_path, 'w', encoding='utf-8') as config_file:
+            json.dump(config, config_file)
+        stat = os.stat(self.config_path)
+        os.utime(self.config_path, (stat.st_atime, stat.st_mtime + 10
+                                    * (len(self.runs) + 1)))
+
+    def run_scan(self, config, clients):
+        """
+        Record a scan and let an hour pass, as a slow scan would.
+        """
+        self.runs.append(config['customer'])
+        self.clock[0] += datetime.timedelta(hours=1)
+        self.assertIs(clients, self.daemon.clients)
+
+    def test_due_schedules_run_in_turn(self):
+        """
+        Test that due schedules run one after another with their overrides.
+        """
+        self.daemon.reload_if_changed()
+        self.daemon.run_due()
+        self.assertEqual(self.runs, [])
+        self.clock[0] = datetime.datetime(2024, 1, 1, 8, 0)
+        self.daemon.run_due()
+        self.assertEqual(self.runs, ['Acme', 'Base'])
+        self.assertEqual(self.daemon.next_runs,
+                         [datetime.datetime(2024, 1, 2, 8, 0)] * 2)
+
+    def test_config_is_hot_reloaded(self):
+        """
+        Test that changes are picked up and invalid files are ignored.
+        """
+        self.assertTrue(self.daemon.reload_if_changed())
+        self.assertFalse(self.daemon.reload_if_changed())
+        self.write_config({'customer': 'New'})
+        self.assertTrue(self.daemon.reload_if_changed())
+        self.assertEqual(len(self.daemon.schedules), 1)
+        with open(self.config_path, 'w', encoding='utf-8') as config_file:
+            config_file.write('invalid_json')
+        os.utime(self.config_path, (0, 1))
+        self.assertFalse(self.daemon.reload_if_changed())
+        self.assertEqual(self.daemon.schedules[0][1]['customer'], 'New')
+
+    def test_stop_prevents_further_runs(self):
+        """
+        Test that a stop request skips the remaining due schedules.
+        """
+        self.daemon.reload_if_changed()
+        self.clock[0] = datetime.datetime(2024, 1, 1, 8, 0)
+        self.daemon.stop()
+        self.daemon.run_due()
+        self.assertEqual(self.runs, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
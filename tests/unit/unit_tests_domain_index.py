@@ -0,0 +1,75 @@
+"""
+Unit tests for domain_index.py functionality.
+
+These tests validate whole-label matching of exact domains, subdomains and
+wildcard entries.
+"""
+
+import unittest
+
+import domain_index
+
+
+class TestDomainIndex(unittest.TestCase):
+    """
+    Unit tests for domain_index.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Set up an index with plain and wildcard entries.
+        """
+        self.index = domain_index.DomainIndex(
+            ['Example.com', '@example.org', '*.wild.net'])
+
+    def test_exact_and_subdomain_match(self):
+        """
+        Test that plain entries match the domain and its subdomains.
+        """
+        self.assertTrue(self.index.match('user@example.com'))
+        self.assertTrue(self.index.match('user@EXAMPLE.COM'))
+        self.assertTrue(self.index.match('user@mail.example.com'))
+        self.assertTrue(self.index.match('user@example.org'))
+
+    def test_partial_labels_do_not_match(self):
+        """
+        Test that a domain ending with an entry's text is not matched.
+        """
+        self.assertFalse(self.index.match('user@notexample.com'))
+        self.assertFalse(self.index.match('user@example.com.evil.io'))
+        self.assertFalse(self.index.match('example.com'))
+
+    def test_wildcard_matches_subdomains_only(self):
+        """
+        Test that wildcard entries skip the bare domain.
+        """
+        self.assertTrue(self.index.match('user@a.b.wild.net'))
+        self.assertFalse(self.index.match('user@wild.net'))
+
+    def test_owners_of_overlapping_entries(self):
+        """
+        Test that a domain is routed to every owner covering it.
+        """
+        index = domain_index.DomainIndex(['example.com'], 'parent')
+        index.add(['mail.example.com'], 'child')
+        index.add(['*.example.com'], 'wildcard')
+        self.assertEqual(index.owners_of('example.com'), {'parent'})
+        self.assertEqual(index.owners_of('mail.example.com'),
+                         {'parent', 'child', 'wildcard'})
+        self.assertEqual(index.owners_of('notexample.com'), set())
+        self.assertEqual(index.owners_of(''), set())
+
+    def test_empty_labels_are_not_markers(self):
+        """
+        Test that empty or '*' labels are not mistaken for trie markers.
+        """
+        self.assertEqual(domain_index.email_domain('u@a..example.com'), '')
+        self.assertFalse(self.index.match('user@a..example.com'))
+        index = domain_index.DomainIndex(['example.com'], 'parent')
+        self.assertEqual(index.owners_of('a..example.com'), {'parent'})
+        self.assertEqual(index.owners_of('*.example.com'), {'parent'})
+        self.assertEqual(index.owners_of('.com'), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
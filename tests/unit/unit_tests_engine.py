@@ -0,0 +1,177 @@
+"""
+Unit tests for engine.py functionality.
+
+These tests validate target expansion, per-target error isolation, the
+de-duplication of users found on several instances or tenants and their
+routing to customers.
+"""
+
+import unittest
+from unittest.mock import patch
+
+import engine
+import plextrac_api
+import records
+import snapshot_store
+
+
+class TestEngine(unittest.TestCase):
+    """
+    Unit tests for engine.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Set up a configuration with two tenants on one instance.
+        """
+        self.config = {
+            'plextrac_url': 'http://test.plextrac.com',
+            'plextrac_username': 'test_username',
+            'plextrac_password': 'test_password',
+            'customer_domains': ['example.com'],
+            'instances': [{'tenant_id': 'a'}, {'tenant_id': 'b'}]
+        }
+
+    def test_scan_targets_inherit_top_level_settings(self):
+        """
+        Test that instance entries override the top-level settings.
+        """
+        targets = engine.scan_targets(self.config)
+        self.assertEqual([t['tenant_id'] for t in targets], ['a', 'b'])
+        self.assertTrue(all(t['plextrac_url'] == 'http://test.plextrac.com'
+                            for t in targets))
+
+    def test_customers_share_one_fetch(self):
+        """
+        Test that targets look for the domains of every customer.
+        """
+        self.config['customers'] = [
+            {'customer': 'A', 'customer_domains': ['a.com', 'shared.com']},
+            {'customer': 'B', 'customer_domains': ['b.com', 'shared.com'],
+             'poc_email': 'b@b.com'}]
+        customers = engine.customer_configs(self.config)
+        self.assertEqual([c['customer'] for c in customers], ['A', 'B'])
+        self.assertNotIn('customers', customers[1])
+        self.assertEqual(customers[1]['plextrac_url'],
+                         'http://test.plextrac.com')
+        targets = engine.scan_targets(self.config)
+        self.assertEqual(targets[0]['customer_domains'],
+                         ['a.com', 'shared.com', 'b.com'])
+
+    def test_route_users(self):
+        """
+        Test that users reach every customer whose domains cover them.
+        """
+        customers = [{'customer_domains': ['a.com', 'shared.com']},
+                     {'customer_domains': ['b.com', 'shared.com']}]
+        a, b, shared = (records.UserRecord('x@a.com'),
+                        records.UserRecord('y@mail.b.com'),
+                        records.UserRecord('z@shared.com'))
+        self.assertEqual(engine.route_users([a, b, shared], customers),
+                         [[a, shared], [b, shared]])
+        self.assertEqual(engine.route_users([a, b], customers[:1]),
+                         [[a, b]])
+
+    def test_route_users_with_empty_labels(self):
+        """
+        Test that a malformed email does not abort routing to customers.
+        """
+        customers = [{'customer_domains': ['example.com']},
+                     {'customer_domains': ['other.com']}]
+        good = records.UserRecord('x@example.com')
+        malformed = records.UserRecord('u@a..example.com')
+        self.assertEqual(engine.route_users([malformed, good], customers),
+                         [[good], []])
+        malformed = records.UserRecord('u@a..example.com',
+                                       domain='a..example.com')
+        self.assertEqual(engine.route_users([malformed, good], customers),
+                         [[malformed, good], []])
+
+    def test_route_delta(self):
+        """
+        Test that each customer only sees the changes of its users.
+        """
+        a, b = records.UserRecord('a@a.com'), records.UserRecord('b@b.com')
+        delta = snapshot_store.Delta([a, b], [], [b], [a])
+        customers = [{'customer_domains': ['a.com']},
+                     {'customer_domains': ['b.com']}]
+        self.assertEqual(engine.route_delta(delta, customers),
+                         [snapshot_store.Delta([a], [], [], [a]),
+                          snapshot_store.Delta([b], [], [b], [])])
+        self.assertEqual(engine.route_delta(None, customers), [None, None])
+
+    def test_tenant_filter(self):
+        """
+        Test that pushdown is opt-in and only filters MFA when asked to.
+        """
+        target = engine.scan_targets(self.config)[0]
+        self.assertIsNone(engine.tenant_filter(target))
+        target['filter_pushdown'] = True
+        self.assertEqual(engine.tenant_filter(target),
+                         plextrac_api.UserFilter(('example.com',), None))
+        target['noncompliant_only'] = True
+        self.assertIs(engine.tenant_filter(target).mfa_enabled, False)
+
+    def test_scan_targets_without_instances(self):
+        """
+        Test that the top-level settings form the only target by default.
+        """
+        del self.config['instances']
+        self.assertEqual(len(engine.scan_targets(self.config)), 1)
+
+    @patch('engine.scan_target')
+    def test_scan_all_merges_and_isolates_errors(self, mock_scan_target):
+        """
+        Test that results are de-duplicated and failures are isolated.
+        """
+        user = records.UserRecord('Test@Example.com')
+        failure = RuntimeError('boom')
+
+        def scan(target, client, cache, metrics=None):
+            if target['tenant_id'] == 'b':
+                raise failure
+            return [user, records.UserRecord('test@example.com')]
+
+        mock_scan_target.side_effect = scan
+        users, errors = engine.scan_all(self.config)
+        self.assertEqual(users, [user])
+        self.assertEqual(errors, [('http://test.plextrac.com (tenant b)',
+                                   failure)])
+
+    def test_is_noncompliant(self):
+        """
+        Test MFA state detection, including missing MFA details.
+        """
+        def noncompliant(item):
+            return engine.is_noncompliant(records.UserRecord.from_api(item))
+
+        self.assertTrue(noncompliant({'email': 'a@x.com',
+                                      'mfa': {'enabled': False}}))
+        self.assertTrue(noncompliant({'email': 'a@x.com'}))
+        self.assertFalse(noncompliant({'email': 'a@x.com',
+                                       'mfa': {'enabled': True}}))
+
+    def test_merge_prefers_noncompliant_entries(self):
+        """
+        Test that a user disabled on any target is reported.
+        """
+        enabled = records.UserRecord('a@x.com', mfa_enabled=True)
+        disabled = records.UserRecord('A@x.com', mfa_enabled=False)
+        self.assertEqual(engine.merge_users([[enabled], [disabled]]),
+                         [disabled])
+
+    def test_search_emails_in_data(self):
+        """
+        Test that API entries are filtered by domain into records.
+        """
+        users = [{'email': 'a@example.com', 'fullName': 'A', 'id': '1',
+                  'mfa': {'enabled': True}},
+                 {'email': 'b@notexample.com'}, {'fullName': 'No email'},
+                 'garbage']
+        self.assertEqual(engine.search_emails_in_data(users, ['example.com']),
+                         [records.UserRecord('a@example.com', 'A', '1',
+                                             True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
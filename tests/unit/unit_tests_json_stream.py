@@ -0,0 +1,76 @@
+"""
+Unit tests for json_stream.py functionality.
+
+These tests validate that array elements are parsed correctly whatever the
+chunk boundaries, and that malformed documents are rejected.
+"""
+
+import json
+import unittest
+
+import json_stream
+
+
+def chunked(text, size):
+    """
+    Split a document into byte chunks of a given size.
+    """
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonStream(unittest.TestCase):
+    """
+    Unit tests for json_stream.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Set up a document with keys around the data array.
+        """
+        self.users = [{'email': f"user{i}@example.com", 'fullName': 'Zoë',
+                       'mfa': {'enabled': bool(i % 2)}, 'logins': i * 1001}
+                      for i in range(20)]
+        self.document = json.dumps({'meta': {'total': 20, 'tags': ['a']},
+                                    'data': self.users, 'count': 12345},
+                                   ensure_ascii=False, indent=1)
+
+    def test_any_chunk_size(self):
+        """
+        Test that chunk boundaries, including inside characters, are handled.
+        """
+        for size in (1, 2, 3, 7, 64, 100_000):
+            items = list(json_stream.iter_array_items(
+                chunked(self.document, size)))
+            self.assertEqual(items, self.users, size)
+
+    def test_items_are_yielded_before_the_end(self):
+        """
+        Test that the first element is available before the input ends.
+        """
+        chunks = iter(chunked(self.document, 16))
+        items = json_stream.iter_array_items(chunks)
+        self.assertEqual(next(items), self.users[0])
+        self.assertGreater(len(list(chunks)), 0)
+
+    def test_missing_or_empty_array(self):
+        """
+        Test documents without elements.
+        """
+        for document in ('{}', '{"data": []}', '{"meta": 1}',
+                         '{"data": null}'):
+            self.assertEqual(list(json_stream.iter_array_items(
+                chunked(document, 2))), [])
+
+    def test_invalid_documents(self):
+        """
+        Test that truncated and malformed documents raise.
+        """
+        for document in ('', '[1, 2]', '{"data": [1, 2',
+                         '{"data": [1 2]}', '{"data": [{"a": }]}'):
+            with self.assertRaises(json.JSONDecodeError):
+                list(json_stream.iter_array_items(chunked(document, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+Unit tests for mail_spool.py functionality.
+
+These tests validate queueing, claiming, retries with backoff, dead
+letters and crash recovery, using a mock in place of the SMTP transport.
+"""
+
+import io
+import os
+import smtplib
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stderr
+from email.mime.text import MIMEText
+from unittest.mock import MagicMock
+
+import mail_spool
+import metrics
+
+
+def make_message(subject='Report', sender='sender@example.com'):
+    """
+    Build a small message with a From header.
+    """
+    message = MIMEText('body', 'plain')
+    message['From'] = sender
+    message['Subject'] = subject
+    return message
+
+
+class TestMailSpool(unittest.TestCase):
+    """
+    Unit tests for mail_spool.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Create an empty spool and a dispatcher with a mock transport.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spool = mail_spool.MailSpool(os.path.join(self.tmp_dir.name,
+                                                       'spool'))
+        self.transport = MagicMock(connections_opened=1, round_trips=5)
+        self.transport.send_raw.return_value = {}
+        self.metrics = metrics.Metrics()
+        self.dispatcher = mail_spool.SpoolDispatcher(
+            self.spool, lambda sender: self.transport, workers=2,
+            max_attempts=2,
+            backoff=0, metrics=self.metrics)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_messages_are_delivered_in_order(self):
+        """
+        Test that queued messages are sent and removed from the spool.
+        """
+        for subject in ('first', 'second'):
+            self.spool.enqueue(make_message(subject), ['poc@example.com'])
+        self.assertEqual(len(self.spool.pending()), 2)
+        self.assertEqual(oct(os.stat(os.path.join(
+            self.spool.path, 'new', self.spool.pending()[0])).st_mode
+                             & 0o777), '0o600')
+        self.dispatcher.workers = 1
+        self.assertEqual(self.dispatcher.dispatch_once(), 2)
+        payloads = [c[0][0] for c in
+                    self.transport.send_raw.call_args_list]
+        self.assertIn('Subject: first', payloads[0])
+        self.assertIn('Subject: second', payloads[1])
+        self.assertEqual(self.spool.pending(), [])
+        self.assertEqual(self.spool.pending('cur'), [])
+        self.assertEqual(self.metrics.total('mail_sent'), 2)
+
+    def test_transient_failures_are_retried_then_dead_lettered(self):
+        """
+        Test that a failing message is requeued, then buried.
+        """
+        self.transport.send_raw.side_effect = \
+            smtplib.SMTPServerDisconnected('down')
+        name = self.spool.enqueue(make_message(), ['poc@example.com'])
+        errors = io.StringIO()
+        with redirect_stderr(errors):
+            self.assertEqual(self.dispatcher.dispatch_once(), 0)
+            self.assertEqual(self.spool.pending(), [name])
+            self.assertEqual(self.dispatcher.dispatch_once(), 0)
+        self.assertEqual(self.spool.pending(), [])
+        self.assertEqual(self.spool.pending('dead'), [name])
+        self.assertEqual(self.metrics.total('mail_retried'), 1)
+        self.assertEqual(self.metrics.total('mail_dead_lettered'), 1)
+        self.assertEqual(self.dispatcher.totals['mail_dead_lettered'], 1)
+        self.assertIn(f"Delivery of message {name} failed, retrying",
+                      errors.getvalue())
+        self.assertIn(f"Giving up on message {name}", errors.getvalue())
+
+    def test_permanent_failures_are_not_retried(self):
+        """
+        Test that a 5xx reply moves the message to dead letters at once.
+        """
+        self.transport.send_raw.side_effect = smtplib.SMTPDataError(
+            554, b'rejected')
+        name = self.spool.enqueue(make_message(), ['poc@example.com'])
+        with redirect_stderr(io.StringIO()):
+            self.dispatcher.dispatch_once()
+        self.assertEqual(self.spool.pending('dead'), [name])
+        self.assertFalse(mail_spool.is_permanent(
+            smtplib.SMTPAuthenticationError(535, b'bad credentials')))
+        self.assertFalse(mail_spool.is_permanent(
+            smtplib.SMTPDataError(451, b'try later')))
+
+    def test_messages_wait_for_their_next_attempt(self):
+        """
+        Test that a message is not claimed before its backoff elapses.
+        """
+        name = self.spool.enqueue(make_message(), ['poc@example.com'])
+        item = self.spool.claim(name)
+        self.spool.retry(name, item, 'busy', 60)
+        self.assertIsNone(self.spool.claim(name))
+        self.assertIsNotNone(self.spool.claim(name, now=time.time() + 61))
+        self.assertIsNone(self.spool.claim(name))
+
+    def test_orphaned_claims_are_recovered(self):
+        """
+        Test that messages claimed by a crashed worker are requeued.
+        """
+        name = self.spool.enqueue(make_message(), ['poc@example.com'])
+        self.spool.claim(name)
+        self.assertEqual(self.spool.recover(), 0)
+        old = time.time() - mail_spool.CLAIM_TIMEOUT - 1
+        os.utime(os.path.join(self.spool.path, 'cur', name), (old, old))
+        self.assertEqual(self.spool.recover(), 1)
+        self.assertEqual(self.spool.pending(), [name])
+
+    def test_each_sender_gets_its_own_transport(self):
+        """
+        Test that messages are sent with the transport of their sender.
+        """
+        transports = {}
+
+        def open_transport(sender):
+            transports[sender] = MagicMock(connections_opened=1,
+                                           round_trips=5)
+            transports[sender].send_raw.return_value = {}
+            return transports[sender]
+
+        self.dispatcher.open_transport = open_transport
+        for sender in ('a@example.com', 'b@example.com', 'a@example.com'):
+            self.spool.enqueue(make_message(sender=sender),
+                               ['poc@example.com'])
+        self.dispatcher.workers = 1
+        self.assertEqual(self.dispatcher.dispatch_once(), 3)
+        self.assertEqual(
+            {sender: transport.send_raw.call_count
+             for sender, transport in transports.items()},
+            {'a@example.com': 2, 'b@example.com': 1})
+
+    def test_background_dispatcher_stops(self):
+        """
+        Test that the background thread delivers and stops cleanly.
+        """
+        self.spool.enqueue(make_message(), ['poc@example.com'])
+        self.dispatcher.start(interval=0.01)
+        deadline = time.time() + 5
+        while self.spool.pending() and time.time() < deadline:
+            time.sleep(0.01)
+        self.dispatcher.stop(timeout=5)
+        self.assertIsNone(self.dispatcher.thread)
+        self.assertEqual(self.spool.pending(), [])
+
+    def test_spool_can_be_disabled(self):
+        """
+        Test that a null spool directory disables spooling.
+        """
+        self.assertIsNone(mail_spool.open_spool({'mail_spool_dir': None}))
+        self.assertIsNone(mail_spool.dispatcher_from_config(
+            {'mail_spool_dir': None}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Unit tests for mailer.py functionality.
+
+These tests validate connection reuse, reconnection after a dropped
+session, the per-connection message cap and recipient batching, using a
+mock in place of smtplib.SMTP, and count round trips against a local SMTP
+sink.
+"""
+
+import smtplib
+import unittest
+from email.mime.text import MIMEText
+from unittest.mock import patch
+
+import mailer
+from tests.performance.smtp_sink import SmtpSink
+
+
+def make_message():
+    """
+    Build a small message with a From header.
+    """
+    message = MIMEText('body', 'plain')
+    message['From'] = 'sender@example.com'
+    return message
+
+
+class TestMailer(unittest.TestCase):
+    """
+    Unit tests for mailer.py functionality.
+    """
+
+    @patch('mailer.smtplib.SMTP')
+    def test_connection_is_reused(self, mock_smtp_class):
+        """
+        Test that several messages share one authenticated session.
+        """
+        with mailer.SmtpTransport(username='user', password='pass') as smtp:
+            for _ in range(3):
+                smtp.send(make_message(), 'poc@example.com')
+        mock_smtp_class.assert_called_once()
+        instance = mock_smtp_class.return_value
+        instance.starttls.assert_called_once()
+        instance.login.assert_called_once_with('user', 'pass')
+        self.assertEqual(instance.sendmail.call_count, 3)
+        instance.quit.assert_called_once()
+
+    def test_round_trips_are_measured(self):
+        """
+        Test that every reply read from the server counts as a round trip.
+        """
+        with SmtpSink() as sink:
+            with mailer.SmtpTransport(sink.host, sink.port,
+                                      starttls=False) as smtp:
+                for _ in range(3):
+                    smtp.send(make_message(), ['a@example.com',
+                                               'b@example.com'])
+        # Greeting, EHLO; MAIL, 2 RCPT, DATA and its end per message; QUIT
+        self.assertEqual(smtp.round_trips, 2 + 3 * 5 + 1)
+
+    @patch('mailer.smtplib.SMTP')
+    def test_message_cap_recycles_connection(self, mock_smtp_class):
+        """
+        Test that a connection is reopened after the message cap.
+        """
+        with mailer.SmtpTransport(max_messages=2) as smtp:
+            for _ in range(5):
+                smtp.send(make_message(), 'poc@example.com')
+            self.assertEqual(smtp.connections_opened, 3)
+        mock_smtp_class.return_value.login.assert_not_called()
+
+    @patch('mailer.smtplib.SMTP')
+    def test_reconnects_when_dropped(self, mock_smtp_class):
+        """
+        Test that a dropped session is reopened and the send retried.
+        """
+        instance = mock_smtp_class.return_value
+        instance.sendmail.side_effect = [
+            smtplib.SMTPServerDisconnected('gone'), {}]
+        with mailer.SmtpTransport() as smtp:
+            smtp.send(make_message(), 'poc@example.com')
+            self.assertEqual(smtp.connections_opened, 2)
+        self.assertEqual(instance.sendmail.call_count, 2)
+
+    @patch('mailer.smtplib.SMTP')
+    def test_recipients_are_batched(self, mock_smtp_class):
+        """
+        Test that recipients are split across envelopes.
+        """
+        recipients = [f"poc{i}@example.com" for i in range(5)]
+        with mailer.SmtpTransport(max_recipients=2) as smtp:
+            smtp.send(make_message(), recipients)
+        batches = [c[0][1] for c in
+                   mock_smtp_class.return_value.sendmail.call_args_list]
+        self.assertEqual(batches, [recipients[:2], recipients[2:4],
+                                   recipients[4:]])
+
+    def test_normalize_recipients(self):
+        """
+        Test parsing of single, comma-separated and list settings.
+        """
+        self.assertEqual(mailer.normalize_recipients('a@x.com, b@x.com'),
+                         ['a@x.com', 'b@x.com'])
+        self.assertEqual(mailer.normalize_recipients(['a@x.com', 'a@x.com']),
+                         ['a@x.com'])
+        self.assertEqual(mailer.normalize_recipients(None), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
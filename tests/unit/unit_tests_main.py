@@ -15,10 +15,21 @@ workflow of authentication, data retrieval, and email sending functionality.
 Note: This module assumes that main.py is the module to be tested and
 requires 'config.json' for configuration data mocking during tests."""
 
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock, mock_open
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import ANY, patch, MagicMock, mock_open
 import json  # Make sure json is imported
+
+import requests
+
 import main  # Assuming main.py is the module to be tested
+import records
 
 
 class TestMain(unittest.TestCase):
@@ -26,13 +37,11 @@ class TestMain(unittest.TestCase):
     Unit tests for main.py functionality.
     """
 
-    @patch('main.requests.post')
-    @patch('main.requests.get')
-    @patch('main.smtplib.SMTP')
+    @patch('plextrac_api.requests.Session')
+    @patch('mailer.smtplib.SMTP')
     @patch('builtins.open', new_callable=mock_open)
     def test_authenticate_and_send_email(self, mock_open_file, mock_smtp_class,
-                                         mock_requests_get,
-                                         mock_requests_post):
+                                         mock_session_class):
         """
         Test case for authenticate_and_send_email function.
         """
@@ -43,20 +52,32 @@ class TestMain(unittest.TestCase):
             'plextrac_url': 'http://test.plextrac.com',
             'gmail_username': 'test@gmail.com',
             'gmail_app_password': 'test_app_password',
-            'customer_domains': ['example.com']
+            'customer': 'Example',
+            'customer_domains': ['example.com'],
+            'poc_email': 'poc@example.com',
+            'token_cache_path': None,
+            'snapshot_db': None,
+            'mail_spool_dir': None
         }
 
-        # Mock return values for requests.post
+        # Mock return values for the authenticate POST
         mock_token = 'mock_token'
-        mock_response_post = MagicMock()
-        mock_response_post.json.return_value = {'token': mock_token}
-        mock_requests_post.return_value = mock_response_post
+        mock_response_post = MagicMock(status_code=200)
+        mock_response_post.json.return_value = {'token': mock_token,
+                                                'tenant_id': 'mock_tenant'}
 
-        # Mock return values for requests.get
-        mock_user_data = {'data': [{'email': 'test@example.com'}]}
-        mock_response_get = MagicMock()
+        # Mock return values for the users GET
+        mock_user_data = {'data': [{'email': 'test@example.com',
+                                    'fullName': 'Test User',
+                                    'mfa': {'enabled': False}}]}
+        mock_response_get = MagicMock(status_code=200)
         mock_response_get.json.return_value = mock_user_data
-        mock_requests_get.return_value = mock_response_get
+
+        mock_session = mock_session_class.return_value
+        mock_session.request.side_effect = \
+            lambda method, url, **kwargs: (mock_response_post
+                                           if method == 'POST'
+                                           else mock_response_get)
 
         # Mock open method to simulate reading config.json
         mock_open_file.return_value.read.return_value = json.dumps(mock_config)
@@ -68,17 +89,17 @@ class TestMain(unittest.TestCase):
         main.authenticate_and_send_email()
 
         # Assertions
-        mock_requests_post.assert_called_once_with(
-            url=f"{mock_config['plextrac_url']}/api/v1/authenticate",
+        mock_session.request.assert_any_call(
+            'POST', f"{mock_config['plextrac_url']}/api/v1/authenticate",
             json={'username': mock_config['plextrac_username'],
                   'password': mock_config['plextrac_password']},
-            timeout=10)
-        mock_requests_get.assert_called_once_with(
-            url=f"{mock_config['plextrac_url']}/api/v2/tenants/"
-                f"{mock_token}/users",
-            params={'limit': 100},
+            timeout=(5, 10))
+        mock_session.request.assert_any_call(
+            'GET', f"{mock_config['plextrac_url']}/api/v2/tenants/"
+                   "mock_tenant/users",
+            params={'limit': 100, 'offset': 0},
             headers={'Authorization': f"Bearer {mock_token}"},
-            timeout=10)
+            timeout=(5, 30))
         mock_smtp_instance.starttls.assert_called_once()
         mock_smtp_instance.login.assert_called_once_with(
             mock_config['gmail_username'],
@@ -86,5 +107,314 @@ class TestMain(unittest.TestCase):
         mock_smtp_instance.sendmail.assert_called_once()
 
 
+    @patch('mailer.smtplib.SMTP')
+    @patch('main.scan_users')
+    def test_send_dry_run(self, mock_scan_users, mock_smtp_class):
+        """
+        Test that a dry run builds the report without connecting to SMTP.
+        """
+        mock_scan_users.return_value = (
+            [records.UserRecord('test@example.com', 'Test User')], None)
+        config = {'customer': 'Example', 'gmail_username': 'test@gmail.com',
+                  'poc_email': 'poc@example.com'}
+        output = io.StringIO()
+        with redirect_stderr(output):
+            main.run_scan(config, dry_run=True)
+        mock_scan_users.assert_called_once_with(config, None, True, ANY,
+                                                None)
+        mock_smtp_class.assert_not_called()
+        self.assertIn('Dry run: 1 message(s)', output.getvalue())
+
+    @patch('notify.requests.post')
+    @patch('mailer.smtplib.SMTP')
+    @patch('main.scan_users')
+    def test_send_fails_when_every_sink_fails(self, mock_scan_users,
+                                              mock_smtp_class, mock_post):
+        """
+        Test that a report no sink delivered fails the run, while one that
+        reached some sink does not.
+        """
+        mock_scan_users.return_value = (
+            [records.UserRecord('a@example.com', 'A')], None)
+        config = {'customer': 'Example', 'gmail_username': 'test@gmail.com',
+                  'poc_email': 'poc@example.com', 'mail_spool_dir': None,
+                  'notification_sinks': [
+                      {'type': 'smtp'},
+                      {'type': 'webhook', 'url': 'http://127.0.0.1:9/'}]}
+        mock_smtp_class.side_effect = OSError('connection refused')
+        mock_post.side_effect = requests.exceptions.ConnectionError(
+            'unreachable')
+        output = io.StringIO()
+        with redirect_stderr(output), \
+                patch('main.load_config', return_value=config), \
+                patch('metrics.export') as mock_export:
+            with self.assertRaises(OSError):
+                main.main(['send'])
+        self.assertFalse(mock_export.call_args[0][0].success)
+        self.assertIn('Error sending report to smtp: connection refused',
+                      output.getvalue())
+        self.assertIn('Error sending report to webhook: unreachable',
+                      output.getvalue())
+
+        mock_post.side_effect = None
+        with redirect_stderr(io.StringIO()), \
+                patch('main.load_config', return_value=config), \
+                patch('metrics.export'):
+            self.assertEqual(main.main(['send']), 0)
+
+    @patch('main.load_config')
+    @patch('main.scan_users')
+    def test_scan_command(self, mock_scan_users, mock_load_config):
+        """
+        Test that the scan command lists non-compliant users only.
+        """
+        mock_load_config.return_value = {}
+        mock_scan_users.return_value = (
+            [records.UserRecord('a@example.com', 'A'),
+             records.UserRecord('b@example.com', 'B', mfa_enabled=True)],
+            None)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(main.main(['scan', '--dry-run']), 0)
+        self.assertEqual(output.getvalue(), "a@example.com\tA\n")
+        mock_scan_users.assert_called_once_with({}, dry_run=True,
+                                                metrics=None)
+
+    @patch('main.load_config')
+    @patch('main.scan_users')
+    def test_profile_from_environment(self, mock_scan_users,
+                                      mock_load_config):
+        """
+        Test that the environment variable profiles a dry run.
+        """
+        mock_load_config.return_value = {
+            'customer': 'Example', 'gmail_username': 'test@gmail.com',
+            'poc_email': 'poc@example.com'}
+        mock_scan_users.return_value = (
+            [records.UserRecord('a@example.com', 'A')], None)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch.dict(os.environ, {main.PROFILE_ENV: tmp_dir}), \
+                    redirect_stdout(io.StringIO()), \
+                    redirect_stderr(io.StringIO()):
+                self.assertEqual(main.main(['send', '--dry-run']), 0)
+            run_dirs = os.listdir(tmp_dir)
+            self.assertEqual(len(run_dirs), 1)
+            self.assertIn('render.Example.pstats',
+                          os.listdir(os.path.join(tmp_dir, run_dirs[0])))
+
+    @patch('main.scan_users')
+    def test_customers_get_their_own_reports(self, mock_scan_users):
+        """
+        Test that one scan is routed into a report per customer.
+        """
+        mock_scan_users.return_value = (
+            [records.UserRecord('a@a.com', 'A'),
+             records.UserRecord('b@b.com', 'B')], None)
+        config = {'gmail_username': 'test@gmail.com', 'customers': [
+            {'customer': 'A', 'customer_domains': ['a.com'],
+             'poc_email': 'poc@a.com'},
+            {'customer': 'B', 'customer_domains': ['b.com'],
+             'poc_email': 'poc@b.com'}]}
+        sent = {}
+
+        def send(customer, intro, sections, dry_run, metrics):
+            sent[customer['poc_email']] = [u.email for _, users in sections
+                                           for u in users]
+
+        with patch('main.send_report', side_effect=send):
+            main.run_scan(config, dry_run=True)
+        self.assertEqual(sent, {'poc@a.com': ['a@a.com'],
+                                'poc@b.com': ['b@b.com']})
+
+    @patch('mailer.smtplib.SMTP')
+    @patch('main.scan_users')
+    def test_send_through_spool(self, mock_scan_users, mock_smtp_class):
+        """
+        Test that reports are spooled, then delivered before returning,
+        and stay queued while the server is down.
+        """
+        mock_scan_users.return_value = (
+            [records.UserRecord('a@example.com', 'A')], None)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = {'customer': 'Example',
+                      'gmail_username': 'test@gmail.com',
+                      'poc_email': 'poc@example.com',
+                      'mail_spool_dir': tmp_dir, 'mail_retry_backoff': 0}
+            mock_smtp_class.side_effect = OSError('connection refused')
+            errors = io.StringIO()
+            with redirect_stdout(io.StringIO()), redirect_stderr(errors), \
+                    patch('main.load_config', return_value=config):
+                self.assertEqual(main.main(['send']), 1)
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, 'new'))),
+                             1)
+            self.assertIn('connection refused', errors.getvalue())
+            self.assertIn('Mail not delivered: 1 message(s) still queued',
+                          errors.getvalue())
+
+            mock_smtp_class.side_effect = None
+            output = io.StringIO()
+            with redirect_stderr(output):
+                self.assertEqual(main.deliver_spool(config), 1)
+            self.assertEqual(os.listdir(os.path.join(tmp_dir, 'new')), [])
+            mock_smtp_class.return_value.sendmail.assert_called_once()
+            self.assertIn('Delivered 1 spooled message(s)', output.getvalue())
+
+    @patch('mailer.smtplib.SMTP')
+    @patch('main.scan_users')
+    def test_scheduled_scan_leaves_delivery_to_dispatcher(
+            self, mock_scan_users, mock_smtp_class):
+        """
+        Test that a scan run without 'deliver', as the daemon's are, only
+        queues its report and never waits on SMTP.
+        """
+        mock_scan_users.return_value = (
+            [records.UserRecord('a@example.com', 'A')], None)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = {'customer': 'Example',
+                      'gmail_username': 'test@gmail.com',
+                      'poc_email': 'poc@example.com',
+                      'mail_spool_dir': tmp_dir}
+            with redirect_stderr(io.StringIO()):
+                main.run_scan(config)
+            mock_smtp_class.assert_not_called()
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, 'new'))),
+                             1)
+            with redirect_stderr(io.StringIO()):
+                self.assertEqual(main.run_dispatch(config), 1)
+            mock_smtp_class.return_value.sendmail.assert_called_once()
+
+    @patch('engine.scan_all')
+    def test_report_output_holds_no_diagnostics(self, mock_scan_all):
+        """
+        Test that errors of a partial scan go to standard error, so the
+        report written to standard output stays clean.
+        """
+        mock_scan_all.return_value = (
+            [records.UserRecord('a@example.com', 'A')],
+            [('tenant b', OSError('connection refused'))])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = {'customer': 'Example',
+                      'customer_domains': ['example.com'],
+                      'snapshot_db': os.path.join(tmp_dir, 'snap.db'),
+                      'instances': [{'tenant_id': 'a'}, {'tenant_id': 'b'}]}
+            output, errors = io.StringIO(), io.StringIO()
+            with redirect_stdout(output), redirect_stderr(errors):
+                main.write_report(config, 'plain')
+        self.assertNotIn('Error', output.getvalue())
+        self.assertNotIn('incomplete', output.getvalue())
+        self.assertIn('a@example.com', output.getvalue())
+        self.assertIn('Error scanning tenant b: connection refused',
+                      errors.getvalue())
+        self.assertIn('Scan incomplete; snapshot not saved',
+                      errors.getvalue())
+
+    @patch('engine.scan_all')
+    def test_partial_scan_is_not_saved(self, mock_scan_all):
+        """
+        Test that users of a failed tenant are neither reported as removed
+        nor, once it recovers, as new.
+        """
+        tenant_a = [records.UserRecord('a@example.com', 'A')]
+        tenant_b = [records.UserRecord('b@example.com', 'B')]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = {'customer_domains': ['example.com'],
+                      'snapshot_db': os.path.join(tmp_dir, 'snap.db'),
+                      'instances': [{'tenant_id': 'a'}, {'tenant_id': 'b'}]}
+            mock_scan_all.return_value = (tenant_a + tenant_b, [])
+            with redirect_stdout(io.StringIO()):
+                main.scan_users(config)
+
+            mock_scan_all.return_value = (tenant_a,
+                                          [('b', OSError('timed out'))])
+            output = io.StringIO()
+            with redirect_stderr(output):
+                _, delta = main.scan_users(config)
+            self.assertEqual(delta.removed, [])
+            self.assertIn('snapshot not saved', output.getvalue())
+
+            mock_scan_all.return_value = (tenant_a + tenant_b, [])
+            with redirect_stdout(io.StringIO()):
+                _, delta = main.scan_users(config)
+            self.assertEqual(delta, ([], [], [], []))
+
+    def test_daemon_keeps_tokens_without_cache_file(self):
+        """
+        Test that daemon runs share an in-memory token cache when the
+        cache file is disabled, and use the file otherwise.
+        """
+        import token_cache
+
+        caches = {}
+        config = {'token_cache_path': None}
+        cache = main.daemon_token_cache(config, caches)
+        self.assertIsInstance(cache, token_cache.MemoryTokenCache)
+        self.assertIs(main.daemon_token_cache(dict(config), caches), cache)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'tokens.json')
+            cache = main.daemon_token_cache({'token_cache_path': path},
+                                            caches)
+            self.assertIsInstance(cache, token_cache.TokenCache)
+            self.assertEqual(cache.path, path)
+        with patch('engine.scan_all', return_value=([], [])) as mock_scan:
+            main.scan_users(dict(config, snapshot_db=None), cache=cache)
+        self.assertIs(mock_scan.call_args[0][3], cache)
+
+    def test_scan_summary_counts_every_customer_user(self):
+        """
+        Test that the scan summary counts compliant customer users too,
+        unless pushed-down filters left them out.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dump = os.path.join(tmp_dir, 'users.ndjson')
+            with open(dump, 'w', encoding='utf-8') as dump_file:
+                for index, enabled in enumerate((False, True, True)):
+                    dump_file.write(json.dumps(
+                        {'email': f"user{index}@example.com",
+                         'fullName': f"User {index}",
+                         'mfa': {'enabled': enabled}}) + '\n')
+            config = {'customer_domains': ['example.com'],
+                      'snapshot_db': None, 'input_path': dump}
+            for pushdown, summary in (
+                    (False, '1 of 3 customer users have MFA disabled\n'),
+                    (True, '1 customer user(s) have MFA disabled; users '
+                           'with MFA enabled were not fetched\n')):
+                errors = io.StringIO()
+                with redirect_stdout(io.StringIO()), redirect_stderr(errors):
+                    main.print_scan(dict(config, filter_pushdown=pushdown))
+                self.assertEqual(errors.getvalue(), summary)
+
+    def test_profile_rate_is_validated(self):
+        """
+        Test that rates outside [0, 1] are rejected.
+        """
+        self.assertEqual(main.profile_rate('0.1'), 0.1)
+        for value in ('2', '-0.5', 'often'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                main.profile_rate(value)
+
+    def test_import_is_lazy(self):
+        """
+        Test that importing main loads neither the HTTP nor the mail stack.
+        """
+        code = ("import sys, main; print(sorted(m for m in ('requests', "
+                "'smtplib', 'email.mime.text', 'sqlite3') "
+                "if m in sys.modules))")
+        result = subprocess.run(
+            [sys.executable, '-c', code], check=True,
+            cwd=os.path.dirname(os.path.abspath(main.__file__)),
+            stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_parse_import_times(self):
+        """
+        Test parsing of 'python -X importtime' output.
+        """
+        output = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       274 |        274 |     _json\n"
+                  "import time:       368 |       2734 | json\n")
+        self.assertEqual(main.parse_import_times(output),
+                         [('_json', 274, 274, 2), ('json', 368, 2734, 0)])
+
+
 if __name__ == '__main__':
     unittest.main()
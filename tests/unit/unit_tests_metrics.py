@@ -0,0 +1,112 @@
+"""
+Unit tests for metrics.py functionality.
+
+These tests validate the recording of phases and counters, the Prometheus
+textfile and JSON exporters, and the metrics recorded by a scan.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import engine
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Unit tests for metrics.py functionality.
+    """
+
+    def test_phases_and_counters_are_summed_per_label(self):
+        """
+        Test that repeated phases and counters accumulate by label.
+        """
+        run = metrics.Metrics()
+        run.add_time('auth', 1.5, target='a')
+        run.add_time('auth', 0.5, target='a')
+        run.add_time('auth', 2.0, target='b')
+        run.add('pages', 3, instance='x')
+        self.assertEqual(list(run.count_items('abc', 'pages', instance='x')),
+                         ['a', 'b', 'c'])
+        run.finish(True)
+        summary = run.summary()
+        self.assertTrue(summary['success'])
+        self.assertEqual(summary['phases'],
+                         [{'phase': 'auth', 'target': 'a', 'seconds': 2.0},
+                          {'phase': 'auth', 'target': 'b', 'seconds': 2.0}])
+        self.assertEqual(summary['counters'],
+                         [{'name': 'pages', 'instance': 'x', 'value': 6}])
+        self.assertEqual(run.total('pages'), 6)
+
+    def test_render_prometheus(self):
+        """
+        Test the text exposition format, including label escaping.
+        """
+        run = metrics.Metrics()
+        run.add_time('fetch_filter', 0.25, target='https://x (tenant "a")')
+        run.add('errors', 0)
+        run.finish(False)
+        lines = metrics.render_prometheus(run).splitlines()
+        self.assertIn('plextrac_mfa_last_run_success 0', lines)
+        self.assertIn('plextrac_mfa_phase_seconds{phase="fetch_filter",'
+                      'target="https://x (tenant \\"a\\")"} 0.25', lines)
+        self.assertIn('# TYPE plextrac_mfa_errors gauge', lines)
+        self.assertIn('plextrac_mfa_errors 0', lines)
+
+    def test_export_writes_enabled_files(self):
+        """
+        Test that the textfile and JSON summary are written when set.
+        """
+        run = metrics.Metrics()
+        run.finish(True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = {
+                'metrics_textfile': os.path.join(tmp_dir, 'collector',
+                                                 'mfa.prom'),
+                'metrics_json': os.path.join(tmp_dir, 'mfa.json'),
+            }
+            metrics.export(run, config)
+            with open(config['metrics_textfile'], encoding='utf-8') as f:
+                self.assertIn('plextrac_mfa_last_run_success 1', f.read())
+            with open(config['metrics_json'], encoding='utf-8') as f:
+                self.assertTrue(json.load(f)['success'])
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['collector', 'mfa.json'])
+
+    def test_scan_records_target_metrics(self):
+        """
+        Test that a scan records its phases and HTTP work per target.
+        """
+        client = MagicMock()
+        client.authenticate.return_value = {'token': 't', 'tenant_id': 'a'}
+        client.iter_tenant_users.return_value = iter([
+            {'email': 'a@example.com'}, {'email': 'b@other.com'}])
+        client.counters.side_effect = [
+            {'requests_sent': 0, 'retries': 0, 'pages': 0,
+             'bytes_received': 0, 'pushdown_records_saved': 0,
+             'pushdown_bytes_saved': 0},
+            {'requests_sent': 2, 'retries': 1, 'pages': 1,
+             'bytes_received': 100, 'pushdown_records_saved': 0,
+             'pushdown_bytes_saved': 0}]
+        config = {'plextrac_url': 'http://x', 'plextrac_username': 'u',
+                  'plextrac_password': 'p',
+                  'customer_domains': ['example.com'],
+                  'token_cache_path': None}
+        run = metrics.Metrics()
+        users, _ = engine.scan_all(config, {'http://x': client}, run)
+        self.assertEqual(len(users), 1)
+        counters = {(c['name'], c.get('target', c.get('instance'))):
+                    c['value'] for c in run.summary()['counters']}
+        self.assertEqual(counters[('users_fetched', 'http://x')], 2)
+        self.assertEqual(counters[('users_matched', 'http://x')], 1)
+        self.assertEqual(counters[('http_retries', 'http://x')], 1)
+        self.assertEqual(counters[('http_response_bytes', 'http://x')], 100)
+        phases = {p['phase'] for p in run.summary()['phases']}
+        self.assertEqual(phases, {'auth', 'fetch_filter'})
+
+
+if __name__ == '__main__':
+    unittest.main()
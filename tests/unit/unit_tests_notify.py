@@ -0,0 +1,228 @@
+"""
+Unit tests for notify.py functionality.
+
+These tests deliver reports to local stand-ins for each sink type: an SMTP
+server, an HTTP endpoint and a temporary file. They validate concurrent
+fan-out, per-sink timeouts and failure isolation.
+"""
+
+import http.server
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+import metrics
+import notify
+import records
+import report
+from tests.performance.smtp_sink import SmtpSink
+
+
+class WebhookServer:
+    """
+    A local HTTP endpoint recording the bodies posted to it.
+    """
+
+    def __init__(self, status=200, delay=0):
+        self.bodies = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """
+            Records one POST request.
+            """
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """
+                Record the body and answer after the configured delay.
+                """
+                length = int(self.headers['Content-Length'])
+                server.bodies.append(json.loads(self.rfile.read(length)))
+                time.sleep(delay)
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """
+                Keep the test output quiet.
+                """
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                       Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/hook"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class BlockingSink:
+    """
+    A sink that never finishes until released.
+    """
+
+    def __init__(self, timeout):
+        self.name = 'blocking'
+        self.timeout = timeout
+        self.release = threading.Event()
+
+    def deliver(self, notification, metrics):
+        """
+        Wait until released, ignoring the report.
+        """
+        self.release.wait(5)
+
+
+class TestNotify(unittest.TestCase):
+    """
+    Unit tests for notify.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Render a one-user report and create a temporary directory.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        sections = [(None, [records.UserRecord('a@example.com', 'A')])]
+        messages = report.build_messages('Intro', sections, 'Subject')
+        messages[0]['From'] = 'reports@example.com'
+        self.notification = notify.build_notification(
+            'Example', 'Subject', 'Intro', sections, ['poc@example.com'],
+            messages)
+        self.metrics = metrics.Metrics()
+
+    def tearDown(self):
+        """
+        Clean up the temporary directory.
+        """
+        self.tmp_dir.cleanup()
+
+    def test_fan_out_reaches_every_sink(self):
+        """
+        Test that one report reaches the SMTP, webhook and file sinks.
+        """
+        path = os.path.join(self.tmp_dir.name, 'reports', 'findings.ndjson')
+        with SmtpSink() as smtp, WebhookServer() as webhook:
+            config = {'customer': 'Example', 'gmail_username': 'a@b.com',
+                      'smtp_host': smtp.host, 'smtp_port': smtp.port,
+                      'smtp_starttls': False, 'mail_spool_dir': None,
+                      'notification_sinks': [
+                          {'type': 'smtp'},
+                          {'type': 'webhook', 'url': webhook.url},
+                          {'type': 'file', 'path': path}]}
+            sinks = notify.open_sinks(config)
+            with redirect_stdout(io.StringIO()):
+                errors = notify.fan_out(sinks, self.notification,
+                                        self.metrics)
+            self.assertEqual(errors, [])
+            self.assertEqual(smtp.messages, 1)
+            self.assertEqual(webhook.bodies[0]['sections'][0]['users'],
+                             [{'name': 'A', 'email': 'a@example.com',
+                               'mfa_enabled': False}])
+        with open(path, encoding='utf-8') as ndjson:
+            lines = ndjson.read().splitlines()
+        self.assertEqual(json.loads(lines[0])['customer'], 'Example')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertEqual(self.metrics.total('notifications_sent'), 3)
+
+    def test_failing_sink_is_isolated(self):
+        """
+        Test that a failing webhook does not stop the file sink.
+        """
+        path = os.path.join(self.tmp_dir.name, 'findings.ndjson')
+        with WebhookServer(status=500) as webhook:
+            sinks = [notify.WebhookSink(webhook.url, name='hook'),
+                     notify.FileSink(path)]
+            errors = notify.fan_out(sinks, self.notification, self.metrics)
+        self.assertEqual([name for name, _ in errors], ['hook'])
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.metrics.total('notifications_failed'), 1)
+        self.assertEqual(self.metrics.total('notifications_sent'), 1)
+
+    def test_spooled_email_counts_as_queued(self):
+        """
+        Test that a report only queued in the mail spool is not counted
+        as sent.
+        """
+        sink = notify.SmtpSink({'mail_spool_dir': self.tmp_dir.name})
+        [message] = self.notification.messages
+        with redirect_stdout(io.StringIO()), \
+                patch.object(message, 'as_string',
+                             wraps=message.as_string) as mock_as_string:
+            errors = notify.fan_out([sink], self.notification, self.metrics)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.metrics.total('notifications_queued'), 1)
+        self.assertEqual(self.metrics.total('notifications_sent'), 0)
+        # The message is serialised once, and measured as queued
+        mock_as_string.assert_called_once_with()
+        [name] = os.listdir(os.path.join(self.tmp_dir.name, 'new'))
+        with open(os.path.join(self.tmp_dir.name, 'new', name),
+                  encoding='utf-8') as item_file:
+            queued = json.load(item_file)
+        self.assertEqual(self.metrics.total('report_bytes'),
+                         len(queued['message']))
+        self.assertEqual(queued['sender'], 'reports@example.com')
+
+    def test_email_without_recipients_fails(self):
+        """
+        Test that an SMTP sink with no recipients is reported as failed.
+        """
+        notification = self.notification._replace(recipients=[])
+        errors = notify.fan_out([notify.SmtpSink({'mail_spool_dir': None})],
+                                notification, self.metrics)
+        self.assertEqual([name for name, _ in errors], ['smtp'])
+        self.assertIsInstance(errors[0][1], ValueError)
+        self.assertEqual(self.metrics.total('notifications_failed'), 1)
+        self.assertEqual(self.metrics.total('notifications_sent'), 0)
+
+    def test_slow_webhook_times_out(self):
+        """
+        Test that a webhook slower than its timeout fails on its own.
+        """
+        with WebhookServer(delay=1) as webhook:
+            start = time.monotonic()
+            errors = notify.fan_out(
+                [notify.WebhookSink(webhook.url, timeout=0.2)],
+                self.notification, self.metrics)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(errors), 1)
+
+    @patch('notify.TIMEOUT_GRACE', 0)
+    def test_overrunning_sink_is_abandoned(self):
+        """
+        Test that fan-out stops waiting for a sink past its deadline.
+        """
+        sink = BlockingSink(timeout=0.1)
+        path = os.path.join(self.tmp_dir.name, 'findings.ndjson')
+        try:
+            errors = notify.fan_out([sink, notify.FileSink(path)],
+                                    self.notification, self.metrics)
+        finally:
+            sink.release.set()
+        self.assertEqual([name for name, _ in errors], ['blocking'])
+        self.assertIsInstance(errors[0][1], TimeoutError)
+        self.assertTrue(os.path.exists(path))
+
+    def test_unknown_sink_type_is_rejected(self):
+        """
+        Test that a misspelt sink type is reported.
+        """
+        with self.assertRaises(ValueError):
+            notify.open_sinks({'notification_sinks': [{'type': 'slack'}]})
+        self.assertIsInstance(notify.open_sinks({})[0], notify.SmtpSink)
+
+
+if __name__ == '__main__':
+    unittest.main()
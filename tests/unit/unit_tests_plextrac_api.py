@@ -0,0 +1,248 @@
+"""
+Unit tests for plextrac_api.py functionality.
+
+These tests validate the paged retrieval of tenant users, the retry policy
+of the client and filter pushdown, using mock objects or a local fake in
+place of the Plextrac API.
+"""
+
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+import requests
+
+import engine
+import plextrac_api
+from tests.performance import fake_plextrac
+
+
+class TestPlextracApi(unittest.TestCase):
+    """
+    Unit tests for plextrac_api.py functionality.
+    """
+
+    def test_iter_user_pages_stops_at_empty_page_or_total(self):
+        """
+        Test that pages are yielded in order until an empty page is seen or
+        the reported total is reached, not at the first short page.
+        """
+        def fetch_capped(offset):
+            # The server lowers its cap to one user at offset 2
+            size = 1 if offset == 2 else 2
+            return list(range(offset, min(offset + size, 6))), None
+
+        fetched = list(plextrac_api.iter_user_pages(fetch_capped,
+                                                    page_size=2, prefetch=3))
+        self.assertEqual(fetched, [[0, 1], [2], [3, 4], [5]])
+
+        requested = []
+
+        def fetch_page(offset):
+            requested.append(offset)
+            return list(range(offset, min(offset + 2, 5))), 5
+
+        fetched = list(plextrac_api.iter_user_pages(fetch_page, page_size=2,
+                                                    prefetch=3))
+        self.assertEqual(fetched, [[0, 1], [2, 3], [4]])
+        self.assertEqual(sorted(requested), [0, 2, 4])
+
+        # A server ignoring the offset serves its first page again
+        fetched = list(plextrac_api.iter_user_pages(
+            lambda offset: ([1, 2], None), page_size=2, prefetch=3))
+        self.assertEqual(fetched, [[1, 2]])
+
+    def test_iter_user_pages_bounds_requests_in_flight(self):
+        """
+        Test that no more than the prefetch window is requested ahead.
+        """
+        requested = []
+
+        def fetch_page(offset):
+            requested.append(offset)
+            return [offset], None
+
+        pages = plextrac_api.iter_user_pages(fetch_page, page_size=1,
+                                             prefetch=2)
+        next(pages)
+        next(pages)
+        pages.close()
+        self.assertLessEqual(len(requested), 4)
+
+    def test_capped_page_size_reads_every_user(self):
+        """
+        Test that a server capping the page size below the one requested
+        is paged through to the end, whole and streamed.
+        """
+        with fake_plextrac.FakePlextracServer(
+                5000, max_page_size=1000) as server, \
+                plextrac_api.PlextracClient(server.url) as client:
+            for page_size, stream_json in ((2000, False), (5000, True)):
+                users = list(client.iter_tenant_users(
+                    fake_plextrac.TENANT_ID, fake_plextrac.TOKEN,
+                    page_size=page_size, stream_json=stream_json))
+                self.assertEqual([user['id'] for user in users],
+                                 [f"user-{i}" for i in range(5000)])
+
+    @patch('plextrac_api.requests.Session')
+    def test_iter_tenant_users_pages_by_offset(self, mock_session_class):
+        """
+        Test that users are streamed across pages using limit and offset.
+        """
+        def request(method, url, params, headers, timeout):
+            response = MagicMock(status_code=200)
+            users = [{'email': f"u{i}@example.com"}
+                     for i in range(params['offset'],
+                                    min(params['offset'] + 2, 5))]
+            response.json.return_value = {'data': users}
+            return response
+
+        mock_session_class.return_value.request.side_effect = request
+        client = plextrac_api.PlextracClient('http://test.plextrac.com')
+        users = list(client.iter_tenant_users('tenant', 'token', page_size=2,
+                                              prefetch=2))
+        self.assertEqual([user['email'] for user in users],
+                         [f"u{i}@example.com" for i in range(5)])
+
+    @patch('plextrac_api.requests.Session')
+    def test_iter_tenant_users_streams_json(self, mock_session_class):
+        """
+        Test that streamed pages are parsed from the raw body chunks.
+        """
+        received = []
+
+        def request(method, url, params, headers, timeout, stream):
+            self.assertTrue(stream)
+            users = [{'email': f"u{i}@example.com"}
+                     for i in range(params['offset'],
+                                    min(params['offset'] + 2, 3))]
+            body = json.dumps({'meta': {'total': 3},
+                               'data': users}).encode('utf-8')
+            received.append(len(body))
+            response = MagicMock(status_code=200)
+            response.iter_content.return_value = [body[:5], body[5:]]
+            return response
+
+        mock_session_class.return_value.request.side_effect = request
+        client = plextrac_api.PlextracClient('http://test.plextrac.com')
+        users = list(client.iter_tenant_users('tenant', 'token', page_size=2,
+                                              stream_json=True))
+        self.assertEqual([user['email'] for user in users],
+                         [f"u{i}@example.com" for i in range(3)])
+        self.assertEqual(mock_session_class.return_value.request.call_count,
+                         2)
+        self.assertEqual(client.counters(),
+                         {'requests_sent': 2, 'retries': 0, 'pages': 2,
+                          'bytes_received': sum(received),
+                          'pushdown_records_saved': 0,
+                          'pushdown_bytes_saved': 0})
+
+    @patch('plextrac_api.time.sleep')
+    @patch('plextrac_api.requests.Session')
+    def test_transient_errors_are_retried(self, mock_session_class,
+                                          mock_sleep):
+        """
+        Test that 502s and connection errors are retried with backoff.
+        """
+        ok = MagicMock(status_code=200)
+        mock_session_class.return_value.request.side_effect = [
+            MagicMock(status_code=502, headers={}),
+            requests.exceptions.ConnectionError('reset'),
+            ok]
+        client = plextrac_api.PlextracClient('http://test.plextrac.com',
+                                             backoff=1)
+        self.assertIs(client.request('GET', '/', 'users'), ok)
+        self.assertEqual(client.retries, 2)
+        self.assertEqual(client.counters()['requests_sent'], 3)
+        delays = [c[0][0] for c in mock_sleep.call_args_list]
+        self.assertTrue(0 <= delays[0] <= 1 and 0 <= delays[1] <= 2)
+
+    @patch('plextrac_api.time.sleep')
+    @patch('plextrac_api.requests.Session')
+    def test_retry_after_is_honoured(self, mock_session_class, mock_sleep):
+        """
+        Test that a 429 waits for the delay given by Retry-After.
+        """
+        mock_session_class.return_value.request.side_effect = [
+            MagicMock(status_code=429, headers={'Retry-After': '7'}),
+            MagicMock(status_code=200)]
+        client = plextrac_api.PlextracClient('http://test.plextrac.com')
+        client.request('GET', '/', 'users')
+        mock_sleep.assert_called_once_with(7.0)
+
+    @patch('plextrac_api.time.sleep')
+    @patch('plextrac_api.requests.Session')
+    def test_retries_are_bounded(self, mock_session_class, mock_sleep):
+        """
+        Test that the last failing response is raised after max_retries.
+        """
+        failing = MagicMock(status_code=503, headers={})
+        failing.raise_for_status.side_effect = \
+            requests.exceptions.HTTPError(response=failing)
+        mock_session_class.return_value.request.return_value = failing
+        client = plextrac_api.PlextracClient('http://test.plextrac.com',
+                                             max_retries=2)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.request('GET', '/', 'users')
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch('plextrac_api.requests.Session')
+    def test_client_errors_are_not_retried(self, mock_session_class):
+        """
+        Test that a 401 is raised at once.
+        """
+        rejected = MagicMock(status_code=401)
+        rejected.raise_for_status.side_effect = \
+            requests.exceptions.HTTPError(response=rejected)
+        mock_session_class.return_value.request.return_value = rejected
+        client = plextrac_api.PlextracClient('http://test.plextrac.com')
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.request('GET', '/', 'users')
+        self.assertEqual(client.retries, 0)
+    def fetch_filtered(self, filter_mode):
+        """
+        Fetch the non-compliant users of one domain from a local fake.
+        """
+        user_filter = plextrac_api.UserFilter(('customer0.com',), False)
+        with fake_plextrac.FakePlextracServer(
+                60, domain_count=3, filter_mode=filter_mode) as server, \
+                plextrac_api.PlextracClient(server.url) as client:
+            users = list(client.iter_tenant_users(
+                fake_plextrac.TENANT_ID, fake_plextrac.TOKEN, page_size=10,
+                user_filter=user_filter))
+            return users, client
+
+    def test_filters_are_pushed_down(self):
+        """
+        Test that an instance applying the filters only sends matching
+        users, and that the savings are counted.
+        """
+        users, client = self.fetch_filtered('apply')
+        self.assertTrue(users)
+        self.assertTrue(all(user['email'].endswith('@customer0.com')
+                            and not user['mfa']['enabled'] for user in users))
+        self.assertTrue(client.pushdown)
+        counters = client.counters()
+        self.assertEqual(counters['pushdown_records_saved'], 60 - len(users))
+        self.assertGreater(counters['pushdown_bytes_saved'],
+                           counters['bytes_received'])
+
+    def test_ignored_or_rejected_filters_fall_back(self):
+        """
+        Test that instances ignoring or rejecting the filters send every
+        user, and that client-side filtering gives the same result.
+        """
+        expected, _ = self.fetch_filtered('apply')
+        for mode in ('ignore', 'reject'):
+            users, client = self.fetch_filtered(mode)
+            self.assertEqual(len(users), 60)
+            self.assertIs(client.pushdown, False)
+            self.assertEqual(client.counters()['pushdown_records_saved'], 0)
+            self.assertEqual(
+                [user.email for user in engine.search_emails_in_data(
+                    users, ['customer0.com'], noncompliant_only=True)],
+                [user['email'] for user in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
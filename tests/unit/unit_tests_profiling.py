@@ -0,0 +1,73 @@
+"""
+Unit tests for profiling.py functionality.
+
+These tests validate run sampling and the profiles written for each phase
+of a profiled run.
+"""
+
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+import metrics
+import profiling
+
+
+class TestProfiling(unittest.TestCase):
+    """
+    Unit tests for profiling.py functionality.
+    """
+
+    def test_runs_are_sampled(self):
+        """
+        Test that only the sampled fraction of runs is profiled.
+        """
+        settings = profiling.ProfileSettings('profiles', 0.25)
+        self.assertIsNone(profiling.sampled_profiler(None))
+        self.assertIsNone(profiling.sampled_profiler(settings,
+                                                     lambda: 0.5))
+        profiler = profiling.sampled_profiler(settings, lambda: 0.1)
+        self.assertEqual(profiler.directory, 'profiles')
+
+    def test_profiles_are_written_per_phase_and_target(self):
+        """
+        Test the pstats files, allocation report and summary of a run.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profiler = profiling.RunProfiler(tmp_dir, top=5)
+            run = metrics.Metrics(profiler)
+            profiler.start()
+            with run.phase('run'):
+                for tenant in ('a', 'b'):
+                    with run.phase('fetch_filter',
+                                   target=f"https://x (tenant {tenant})"):
+                        data = [str(i) * 10 for i in range(1000)]
+                with run.phase('render'):
+                    ''.join(data)
+            run_dir = profiler.stop()
+
+            files = sorted(os.listdir(run_dir))
+            self.assertEqual(files, [
+                'allocations.txt', 'combined.pstats',
+                'fetch_filter.https_x_tenant_a.pstats',
+                'fetch_filter.https_x_tenant_b.pstats',
+                'render.pstats', 'summary.json'])
+            stats = pstats.Stats(os.path.join(run_dir, 'combined.pstats'))
+            self.assertTrue(stats.total_calls > 0)
+            with open(os.path.join(run_dir, 'summary.json'),
+                      encoding='utf-8') as summary_file:
+                summary = json.load(summary_file)
+            self.assertEqual([phase['phase'] for phase in summary['phases']],
+                             ['fetch_filter', 'fetch_filter', 'render'])
+            self.assertEqual(summary['phases'][1]['labels'],
+                             {'target': 'https://x (tenant b)'})
+            self.assertGreater(summary['traced_peak_bytes'], 0)
+            with open(os.path.join(run_dir, 'allocations.txt'),
+                      encoding='utf-8') as report_file:
+                self.assertEqual(len(report_file.read().splitlines()), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Unit tests for records.py functionality.
+
+These tests validate the conversion of API entries into records and the
+column operations of UserTable.
+"""
+
+import sys
+import unittest
+
+import domain_index
+import records
+
+
+def api_user(i, enabled):
+    """
+    Build a user entry as returned by the API.
+    """
+    return {'id': str(i), 'email': f"user{i}@Example.com",
+            'fullName': f"User {i}", 'mfa': {'enabled': enabled},
+            'role': 'STD_USER'}
+
+
+class TestRecords(unittest.TestCase):
+    """
+    Unit tests for records.py functionality.
+    """
+
+    def test_from_api(self):
+        """
+        Test that only the used fields are kept and domains are interned.
+        """
+        record = records.UserRecord.from_api(api_user(1, True))
+        self.assertEqual((record.user_id, record.email, record.name,
+                          record.domain, record.mfa_enabled),
+                         ('1', 'user1@Example.com', 'User 1', 'example.com',
+                          True))
+        self.assertIs(record.domain, sys.intern('example.com'))
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertIsNone(records.UserRecord.from_api({'fullName': 'x'}))
+
+    def test_mfa_bit_array(self):
+        """
+        Test MFA bits across byte boundaries.
+        """
+        table = records.UserTable()
+        for i in range(20):
+            table.append_api(api_user(i, i % 3 == 0))
+        self.assertEqual(len(table.mfa), 3)
+        self.assertEqual(table.noncompliant_count(), 13)
+        self.assertEqual(table.noncompliant_rows(range(5)), [1, 2, 4])
+        self.assertTrue(table.mfa_enabled(18))
+        self.assertFalse(table.mfa_enabled(19))
+
+    def test_match_domains_looks_up_each_domain_once(self):
+        """
+        Test that domain matching is shared across rows and batches.
+        """
+        table = records.UserTable()
+        for item in ({'email': 'a@example.com'}, {'email': 'b@other.com'},
+                     {'email': 'c@example.com'}, {'email': 'no-domain'}):
+            table.append_api(item)
+        cache = {}
+        index = domain_index.DomainIndex(['example.com'])
+        self.assertEqual(table.match_domains(index, cache), [0, 2])
+        self.assertEqual(set(cache), {'example.com', 'other.com', ''})
+        self.assertEqual([r.email for r in table.records([2])],
+                         ['c@example.com'])
+
+        class RowCache(dict):
+            """
+            A cache that must only be read by domain.
+            """
+
+            def items(self):
+                raise AssertionError('cache scanned')
+
+        cache = RowCache(cache, **{f"d{i}.com": False for i in range(100)})
+        table = records.UserTable()
+        table.append_api({'email': 'd@example.com'})
+        self.assertEqual(table.match_domains(index, cache), [0])
+
+    def test_iter_tables_batches(self):
+        """
+        Test that streams are split into bounded batches.
+        """
+        tables = list(records.iter_tables(
+            (api_user(i, False) for i in range(25)), batch_size=10))
+        self.assertEqual([len(table) for table in tables], [10, 10, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Unit tests for report.py functionality.
+
+These tests validate the plain, HTML and gzipped CSV renderings and the
+size-aware splitting of large reports.
+"""
+
+import csv
+import gzip
+import io
+import unittest
+
+import records
+import report
+
+
+def user(i, enabled=False):
+    """
+    Build the record of a user.
+    """
+    return records.UserRecord(f"user{i}@example.com", f"User <{i}>",
+                              mfa_enabled=enabled)
+
+
+class TestReport(unittest.TestCase):
+    """
+    Unit tests for report.py functionality.
+    """
+
+    def test_render_plain(self):
+        """
+        Test the plain-text layout, including section headings.
+        """
+        body = report.render_plain('Intro', [('Heading', [user(1)])])
+        self.assertEqual(body, "Intro\n\nHeading:\n\n"
+                               "Name: User <1>\nEmail: user1@example.com\n\n")
+
+    def test_render_html_escapes(self):
+        """
+        Test that names are escaped in the HTML table.
+        """
+        body = report.render_html('Intro', [(None, [user(1)])])
+        self.assertIn('<td>User &lt;1&gt;</td>', body)
+
+    def test_render_csv_gz(self):
+        """
+        Test that the CSV attachment decompresses to one row per user.
+        """
+        data = report.render_csv_gz([(None, [user(1), user(2, True)])])
+        rows = list(csv.reader(io.StringIO(gzip.decompress(data)
+                                           .decode('utf-8'))))
+        self.assertEqual(rows[0], list(report.CSV_HEADER))
+        self.assertEqual(rows[2], ['noncompliant', 'User <2>',
+                                   'user2@example.com', 'True'])
+
+    def test_full_sections_filters_compliant_users(self):
+        """
+        Test that full reports only list non-compliant users.
+        """
+        sections = report.full_sections(
+            [user(1), user(2, True)],
+            lambda u: not u.mfa_enabled)
+        self.assertEqual(sections, [(None, [user(1)])])
+
+    def test_large_report_is_split(self):
+        """
+        Test that every user appears once across the split messages.
+        """
+        users = [user(i) for i in range(200)]
+        messages = report.build_messages(
+            'Intro', [('Heading', users)], 'Subject',
+            formats=('plain', 'html', 'csv'), max_bytes=5_000)
+        self.assertGreater(len(messages), 1)
+        self.assertEqual(messages[0]['Subject'],
+                         f"Subject (part 1 of {len(messages)})")
+        chunks = report.split_sections([('Heading', users)],
+                                       ('plain', 'html', 'csv'), 5_000)
+        self.assertEqual(sum(len(u) for chunk in chunks
+                             for _, u in chunk), 200)
+        for message in messages:
+            self.assertLess(len(message.as_string()), 5_000 * 1.5)
+
+    def test_small_report_is_not_split(self):
+        """
+        Test that a small report keeps the plain subject.
+        """
+        messages = report.build_messages('Intro', [(None, [user(1)])],
+                                         'Subject')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['Subject'], 'Subject')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Unit tests for scanner.py functionality.
+
+These tests validate that the library scanner reuses its clients and
+tokens across calls, streams users across targets and isolates failing
+targets.
+"""
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+import requests
+
+import records
+import scanner
+import token_cache
+
+
+def entry(email, enabled):
+    """
+    Build a user entry as returned by the Plextrac API.
+    """
+    return {'email': email, 'fullName': email.split('@')[0],
+            'mfa': {'enabled': enabled}}
+
+
+class TestMfaComplianceScanner(unittest.TestCase):
+    """
+    Unit tests for scanner.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Set up a scanner of two tenants sharing one mocked client.
+        """
+        self.config = {
+            'plextrac_url': 'http://test.plextrac.com',
+            'plextrac_username': 'test_username',
+            'plextrac_password': 'test_password',
+            'customer': 'Example',
+            'customer_domains': ['example.com'],
+            'instances': [{'tenant_id': 'a'}, {'tenant_id': 'b'}],
+            'token_cache_path': None,
+            'snapshot_db': None,
+            'mail_spool_dir': None
+        }
+        self.client = MagicMock()
+        self.client.authenticate.return_value = {'token': 'token',
+                                                 'tenant_id': 'a'}
+        self.tenants = {
+            'a': [entry('alice@example.com', True),
+                  entry('bob@example.com', False),
+                  entry('eve@other.com', False)],
+            'b': [entry('ALICE@example.com', False),
+                  entry('bob@example.com', False)]
+        }
+        self.client.iter_tenant_users.side_effect = \
+            lambda tenant_id, *args, **kwargs: iter(self.tenants[tenant_id])
+        self.scanner = scanner.MfaComplianceScanner(self.config)
+        self.scanner.clients[self.config['plextrac_url']] = self.client
+
+    def test_tokens_are_cached_in_memory(self):
+        """
+        Test that a scanner without a cache file reuses tokens in memory.
+        """
+        self.assertIsInstance(self.scanner.cache,
+                              token_cache.MemoryTokenCache)
+        list(self.scanner.iter_users())
+        list(self.scanner.iter_users())
+        self.assertEqual(self.client.authenticate.call_count, 2)
+
+    def test_iter_users_streams_each_email_once(self):
+        """
+        Test that users found on several tenants are yielded once, as
+        first seen.
+        """
+        users = list(self.scanner.iter_users())
+        self.assertEqual([user.email for user in users],
+                         ['alice@example.com', 'bob@example.com'])
+        self.assertTrue(users[0].mfa_enabled)
+
+    def test_iter_users_yields_page_by_page(self):
+        """
+        Test that users are yielded once a page of entries is read, not
+        once a whole batch of records.BATCH_SIZE is.
+        """
+        read = []
+
+        def entries():
+            for index in range(10):
+                read.append(index)
+                yield entry(f"user{index}@example.com", False)
+
+        self.config['page_size'] = 3
+        self.tenants['a'] = entries()
+        self.assertEqual(next(self.scanner.iter_users()).email,
+                         'user0@example.com')
+        self.assertEqual(len(read), 3)
+
+    def test_iter_noncompliant_uses_any_target(self):
+        """
+        Test that a user disabled on any tenant is non-compliant.
+        """
+        emails = [user.email for user in self.scanner.iter_noncompliant()]
+        self.assertEqual(emails, ['bob@example.com', 'ALICE@example.com'])
+
+    def test_failing_target_is_isolated(self):
+        """
+        Test that a failing tenant is recorded and the next one scanned.
+        """
+        error = requests.exceptions.ConnectionError('down')
+        self.tenants['a'] = MagicMock(__iter__=MagicMock(side_effect=error))
+        emails = [user.email for user in self.scanner.iter_users()]
+        self.assertEqual(emails, ['ALICE@example.com', 'bob@example.com'])
+        self.assertEqual([e for _, e in self.scanner.errors], [error])
+
+        self.tenants['b'] = self.tenants['a']
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            list(self.scanner.iter_users())
+
+    def test_report_renders_given_users(self):
+        """
+        Test that report renders the non-compliant users of the customer.
+        """
+        users = [records.UserRecord('bob@example.com', 'bob'),
+                 records.UserRecord('alice@example.com', 'alice',
+                                    mfa_enabled=True)]
+        text = self.scanner.report(users=users)
+        self.assertIn('Example requirement', text)
+        self.assertIn('bob@example.com', text)
+        self.assertNotIn('alice@example.com', text)
+
+    @patch('engine.scan_all')
+    def test_scan_shares_clients_and_cache(self, mock_scan_all):
+        """
+        Test that scan passes the scanner's clients and token cache.
+        """
+        mock_scan_all.return_value = (['user'], [])
+        self.assertEqual(self.scanner.scan(), ['user'])
+        mock_scan_all.assert_called_once_with(
+            self.config, self.scanner.clients, None,
+            cache=self.scanner.cache)
+
+    def test_close_closes_clients(self):
+        """
+        Test that leaving the context closes every client.
+        """
+        with self.scanner:
+            pass
+        self.client.close.assert_called_once_with()
+        self.assertEqual(self.scanner.clients, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+Unit tests for the idempotent steps of setup.py.
+
+These tests validate that setup skips the virtual environment and the
+dependency install while requirements.txt and the Python version are
+unchanged, installs from the local wheel cache first, and keeps a single
+crontab entry however often it runs.
+"""
+
+import io
+import os
+import subprocess
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import MagicMock, patch
+
+import setup
+
+
+class TestSetupEnvironment(unittest.TestCase):
+    """
+    Unit tests for the idempotent steps of setup.py.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary project directory with a requirements file and
+        an existing virtual environment.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self.tmp_dir.name
+        self.requirements = os.path.join(self.base_dir, 'requirements.txt')
+        with open(self.requirements, 'w', encoding='utf-8') as requirements:
+            requirements.write('requests==2.31.0\n')
+        self.venv = os.path.join(self.base_dir, 'venv')
+        python = setup.venv_python(self.venv, 'Linux')
+        os.makedirs(os.path.dirname(python))
+        open(python, 'w', encoding='utf-8').close()
+
+    def tearDown(self):
+        """
+        Clean up the temporary directory.
+        """
+        self.tmp_dir.cleanup()
+
+    def run_setup(self):
+        """
+        Run setup_environment on Linux in the temporary directory, with
+        commands and scheduling mocked, and return the commands run.
+        """
+        with patch.object(setup, '__file__',
+                          os.path.join(self.base_dir, 'setup.py')), \
+                patch('setup.platform.system', return_value='Linux'), \
+                patch('setup.subprocess.check_call') as mock_check_call, \
+                patch('setup.schedule_task_unix') as mock_schedule, \
+                redirect_stdout(io.StringIO()):
+            setup.setup_environment()
+        mock_schedule.assert_called_once()
+        return [call[0][0] for call in mock_check_call.call_args_list]
+
+    def stamp(self):
+        """
+        Return the stamp matching the current requirements and Python.
+        """
+        return {'requirements': setup.requirements_hash(self.requirements),
+                'python': setup.python_version()}
+
+    def test_unchanged_environment_is_skipped(self):
+        """
+        Test that nothing is installed when the stamp matches.
+        """
+        setup.write_stamp(self.venv, self.stamp())
+        self.assertEqual(self.run_setup(), [])
+
+    def test_changed_requirements_are_installed(self):
+        """
+        Test that new requirements are installed into the existing venv.
+        """
+        setup.write_stamp(self.venv, self.stamp())
+        with open(self.requirements, 'a', encoding='utf-8') as requirements:
+            requirements.write('python-dotenv==1.0.0\n')
+        commands = self.run_setup()
+        self.assertNotIn('venv', [arg for command in commands
+                                  for arg in command[1:3]])
+        self.assertEqual(commands[-1][2:4], ['pip', 'install'])
+        self.assertIn('--no-index', commands[-1])
+        self.assertEqual(setup.read_stamp(self.venv), self.stamp())
+
+    def test_new_python_recreates_venv(self):
+        """
+        Test that a venv built by another Python version is recreated.
+        """
+        setup.write_stamp(self.venv, dict(self.stamp(), python='CPython 2'))
+        with patch('setup.os.chmod'):
+            commands = self.run_setup()
+        self.assertEqual(commands[0][1:4], ['-m', 'venv', '--clear'])
+
+    def test_wheel_cache_is_tried_offline_first(self):
+        """
+        Test that a complete wheel cache installs without the index.
+        """
+        wheel_dir = os.path.join(self.base_dir, 'wheelhouse')
+        os.makedirs(wheel_dir)
+        open(os.path.join(wheel_dir, 'requests.whl'), 'w',
+             encoding='utf-8').close()
+        with patch('setup.subprocess.check_call') as mock_check_call:
+            setup.install_requirements('python', self.requirements,
+                                       wheel_dir)
+        mock_check_call.assert_called_once()
+        self.assertIn('--no-index', mock_check_call.call_args[0][0])
+
+        # An incomplete cache is filled from the index, then installed
+        with patch('setup.subprocess.check_call',
+                   side_effect=[subprocess.CalledProcessError(1, 'pip'),
+                                None, None]) as mock_check_call, \
+                redirect_stdout(io.StringIO()):
+            setup.install_requirements('python', self.requirements,
+                                       wheel_dir)
+        self.assertEqual(mock_check_call.call_args_list[1][0][0][2:4],
+                         ['pip', 'wheel'])
+
+    def test_crontab_keeps_one_entry(self):
+        """
+        Test that the cron job is updated in place, never duplicated.
+        """
+        job = '0 8 * * 5 . /app/venv/bin/activate && python /app/main.py'
+        legacy = '0 8 * * 5 source /app/venv/bin/activate && ' \
+            'python /app/main.py'
+        crontab = f"MAILTO=ops\n{legacy}\n{legacy}\n0 1 * * * backup\n"
+        updated = setup.update_crontab(crontab, job, '/app/main.py')
+        self.assertEqual(updated, f"MAILTO=ops\n{job} {setup.CRON_MARKER}\n"
+                                  "0 1 * * * backup\n")
+        self.assertEqual(setup.update_crontab(updated, job, '/app/main.py'),
+                         updated)
+
+        current = MagicMock(returncode=0, stdout=updated)
+        with patch('setup.subprocess.run',
+                   return_value=current) as mock_run:
+            setup.schedule_task_unix('/app/main.py',
+                                     '/app/venv/bin/activate')
+        # Already current: the crontab is read but not written
+        mock_run.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Unit tests for snapshot_store.py functionality.
+
+These tests validate the delta computed between consecutive scans and the
+trend rows recorded for each scan.
+"""
+
+import unittest
+
+import records
+import snapshot_store
+
+
+def user(email, enabled, user_id=None):
+    """
+    Build the record of a user.
+    """
+    return records.UserRecord(email, email, user_id or email, enabled)
+
+
+class TestSnapshotStore(unittest.TestCase):
+    """
+    Unit tests for snapshot_store.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Set up an in-memory store.
+        """
+        self.store = snapshot_store.SnapshotStore(':memory:')
+
+    def tearDown(self):
+        """
+        Close the store.
+        """
+        self.store.close()
+
+    @staticmethod
+    def emails(users):
+        """
+        Return the emails of a list of users.
+        """
+        return [u.email for u in users]
+
+    def test_first_scan_reports_everyone_as_new(self):
+        """
+        Test the delta of a scan into an empty store.
+        """
+        delta = self.store.record_scan([user('a@x.com', False),
+                                        user('b@x.com', True)], 1)
+        self.assertEqual(self.emails(delta.new), ['a@x.com', 'b@x.com'])
+        self.assertEqual(self.emails(delta.newly_noncompliant), ['a@x.com'])
+        self.assertEqual(delta.removed, [])
+
+    def test_changes_between_scans(self):
+        """
+        Test remediation, regression and removal between two scans.
+        """
+        self.store.record_scan([user('a@x.com', False), user('b@x.com', True),
+                                user('c@x.com', True)], 1)
+        delta = self.store.record_scan([user('A@x.com', True),
+                                        user('b@x.com', False),
+                                        user('d@x.com', True)], 2)
+        self.assertEqual(self.emails(delta.newly_remediated), ['a@x.com'])
+        self.assertEqual(self.emails(delta.newly_noncompliant), ['b@x.com'])
+        self.assertEqual(self.emails(delta.new), ['d@x.com'])
+        self.assertEqual(self.emails(delta.removed), ['c@x.com'])
+
+    def test_unchanged_scan_has_empty_delta(self):
+        """
+        Test that repeating a scan reports nothing.
+        """
+        users = [user('a@x.com', False)]
+        self.store.record_scan(users, 1)
+        self.assertEqual(self.store.record_scan(users, 2),
+                         snapshot_store.Delta([], [], [], []))
+
+    def test_trend_and_first_seen(self):
+        """
+        Test the per-scan counts and that first-seen times are kept.
+        """
+        self.store.record_scan([user('a@x.com', False)], 1)
+        self.store.record_scan([user('a@x.com', False),
+                                user('b@x.com', True)], 2)
+        self.assertEqual(self.store.trend(), [(1, 1, 1), (2, 2, 1)])
+        first_seen = self.store.connection.execute(
+            "SELECT first_seen, last_seen FROM users WHERE email = ?",
+            ('a@x.com',)).fetchone()
+        self.assertEqual(first_seen, (1, 2))
+        self.assertEqual(self.emails(self.store.noncompliant()), ['a@x.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
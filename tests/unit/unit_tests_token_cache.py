@@ -0,0 +1,170 @@
+"""
+Unit tests for token_cache.py functionality.
+
+These tests validate expiry-aware reuse of cached tokens and the retry with
+a fresh token when the API rejects a cached one.
+"""
+
+import base64
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import requests
+
+import engine
+import metrics
+import token_cache
+
+
+def make_jwt(exp):
+    """
+    Build an unsigned JWT carrying the given expiry claim.
+    """
+    payload = base64.urlsafe_b64encode(
+        json.dumps({'exp': exp}).encode('utf-8')).decode('ascii')
+    return f"header.{payload.rstrip('=')}.signature"
+
+
+class TestTokenCache(unittest.TestCase):
+    """
+    Unit tests for token_cache.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Set up a cache in a temporary directory.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = token_cache.TokenCache(
+            os.path.join(self.tmp_dir.name, 'tokens.json'))
+        self.key = token_cache.cache_key('http://test.plextrac.com', 'user')
+
+    def tearDown(self):
+        """
+        Clean up the temporary directory.
+        """
+        self.tmp_dir.cleanup()
+
+    def test_valid_token_is_reused(self):
+        """
+        Test that a token is returned while it is valid.
+        """
+        auth = {'token': make_jwt(time.time() + 3600), 'tenant_id': 't'}
+        self.cache.put(self.key, auth)
+        self.assertEqual(self.cache.get(self.key), auth)
+
+    def test_expired_token_is_ignored(self):
+        """
+        Test that a token close to its expiry is not returned.
+        """
+        self.cache.put(self.key, {'token': make_jwt(time.time() + 10),
+                                  'tenant_id': 't'})
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_opaque_token_uses_default_ttl(self):
+        """
+        Test that tokens without an expiry claim get the default lifetime.
+        """
+        expiry = token_cache.token_expiry('opaque', default_ttl=100)
+        self.assertAlmostEqual(expiry, time.time() + 100, delta=5)
+
+    def test_keys_differ_per_tenant(self):
+        """
+        Test that the tenant is part of the cache key.
+        """
+        self.assertNotEqual(
+            token_cache.cache_key('http://test.plextrac.com', 'user', 'a'),
+            token_cache.cache_key('http://test.plextrac.com', 'user', 'b'))
+
+    @patch('engine.collect_customer_users')
+    def test_unauthorized_cached_token_is_refreshed(self, mock_collect):
+        """
+        Test that a 401 on a cached token triggers a fresh authentication.
+        """
+        target = {'plextrac_url': 'http://test.plextrac.com',
+                  'plextrac_username': 'user', 'plextrac_password': 'pass'}
+        stale = {'token': 'stale', 'tenant_id': 't'}
+        fresh = {'token': 'fresh', 'tenant_id': 't'}
+        self.cache.put(self.key, stale)
+        rejected = MagicMock(status_code=401)
+        mock_collect.side_effect = [
+            requests.exceptions.HTTPError(response=rejected), ['user']]
+        client = MagicMock()
+        client.authenticate.return_value = fresh
+
+        self.assertEqual(engine.scan_target(target, client, self.cache),
+                         ['user'])
+        client.authenticate.assert_called_once_with('user', 'pass')
+        self.assertEqual(self.cache.get(self.key), fresh)
+
+    def test_rejected_attempt_is_not_counted(self):
+        """
+        Test that users fetched before a 401 are not counted twice.
+        """
+        target = {'plextrac_url': 'http://test.plextrac.com',
+                  'plextrac_username': 'user', 'plextrac_password': 'pass',
+                  'customer_domains': ['example.com']}
+        self.cache.put(self.key, {'token': 'stale', 'tenant_id': 't'})
+        rejected = requests.exceptions.HTTPError(
+            response=MagicMock(status_code=401))
+
+        def expiring():
+            yield {'email': 'a@example.com'}
+            raise rejected
+
+        client = MagicMock()
+        client.authenticate.return_value = {'token': 'fresh',
+                                            'tenant_id': 't'}
+        client.iter_tenant_users.side_effect = [
+            expiring(), iter([{'email': 'a@example.com'},
+                              {'email': 'b@other.com'}])]
+        run = metrics.Metrics()
+
+        users = engine.scan_target(target, client, self.cache, run)
+        self.assertEqual([user.email for user in users], ['a@example.com'])
+        self.assertEqual(run.total('users_fetched'), 2)
+        self.assertEqual(run.total('users_matched'), 1)
+
+    def test_unauthorized_cached_token_is_refreshed_when_streaming(self):
+        """
+        Test that a 401 before any user was streamed triggers a fresh
+        authentication.
+        """
+        target = {'plextrac_url': 'http://test.plextrac.com',
+                  'plextrac_username': 'user', 'plextrac_password': 'pass',
+                  'customer_domains': ['example.com']}
+        self.cache.put(self.key, {'token': 'stale', 'tenant_id': 't'})
+        rejected = requests.exceptions.HTTPError(
+            response=MagicMock(status_code=401))
+        client = MagicMock()
+        client.authenticate.return_value = {'token': 'fresh',
+                                            'tenant_id': 't'}
+        client.iter_tenant_users.side_effect = [
+            MagicMock(__iter__=MagicMock(side_effect=rejected)),
+            iter([{'email': 'a@example.com'}])]
+
+        users = list(engine.iter_target_users(target, client, self.cache))
+        self.assertEqual([user.email for user in users], ['a@example.com'])
+        self.assertEqual(self.cache.get(self.key)['token'], 'fresh')
+
+    def test_memory_cache_expires_tokens(self):
+        """
+        Test that the in-memory cache honours expiry and invalidation.
+        """
+        cache = token_cache.MemoryTokenCache()
+        valid = {'token': make_jwt(time.time() + 3600), 'tenant_id': 't'}
+        cache.put('valid', valid)
+        cache.put('expired', {'token': make_jwt(time.time() - 10),
+                              'tenant_id': 't'})
+        self.assertEqual(cache.get('valid'), valid)
+        self.assertIsNone(cache.get('expired'))
+        cache.invalidate('valid')
+        self.assertIsNone(cache.get('valid'))
+
+
+if __name__ == '__main__':
+    unittest.main()
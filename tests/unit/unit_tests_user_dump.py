@@ -0,0 +1,148 @@
+"""
+Unit tests for user_dump.py functionality.
+
+These tests validate that JSON, NDJSON and gzipped user dumps are read
+through the same filter as the API, including the parallel scan of
+memory-mapped NDJSON files.
+"""
+
+import gzip
+import io
+import json
+import mmap
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+import main
+import user_dump
+
+
+def make_users(count):
+    """
+    Build API user entries: odd ones on the customer domain, every third
+    one with MFA enabled.
+    """
+    return [{'id': str(index),
+             'email': f"user{index}@"
+                      f"{'mail.example.com' if index % 2 else 'other.com'}",
+             'fullName': f"User {index}",
+             'mfa': {'enabled': index % 3 == 0}}
+            for index in range(count)]
+
+
+class TestUserDump(unittest.TestCase):
+    """
+    Unit tests for user_dump.py functionality.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory and the users written to dumps.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.users = make_users(50)
+        self.expected = [user['email'] for user in self.users
+                         if user['email'].endswith('example.com')]
+
+    def tearDown(self):
+        """
+        Clean up the temporary directory.
+        """
+        self.tmp_dir.cleanup()
+
+    def write(self, name, text, compress=False):
+        """
+        Write a dump and return its path.
+        """
+        path = os.path.join(self.tmp_dir.name, name)
+        opener = gzip.open if compress else open
+        with opener(path, 'wt', encoding='utf-8') as dump:
+            dump.write(text)
+        return path
+
+    def test_every_layout_gives_the_same_users(self):
+        """
+        Test JSON payloads, arrays and NDJSON, plain and gzipped.
+        """
+        ndjson = ''.join(json.dumps(user) + '\n' for user in self.users)
+        dumps = [
+            self.write('users.json', json.dumps(
+                {'meta': {'total': 50}, 'data': self.users}, indent=2)),
+            self.write('array.json', json.dumps(self.users)),
+            self.write('users.ndjson', ndjson + '\n'),
+            self.write('users.dump', ndjson),
+            self.write('users.ndjson.gz', ndjson, compress=True),
+            self.write('users.json.gz', json.dumps({'data': self.users}),
+                       compress=True),
+            self.write('pages.ndjson', '\n'.join(
+                json.dumps({'data': self.users[i:i + 20]})
+                for i in range(0, 50, 20))),
+        ]
+        for path in dumps:
+            fetched, matches = user_dump.scan_file(path, ['example.com'],
+                                                   workers=1)
+            self.assertEqual(fetched, 50, path)
+            self.assertEqual([user.email for user in matches],
+                             self.expected, path)
+
+    @patch('user_dump.PARALLEL_MIN_BYTES', 0)
+    def test_ndjson_is_scanned_in_parallel_chunks(self):
+        """
+        Test that chunks scanned by worker processes keep file order.
+        """
+        path = self.write('users.ndjson', ''.join(
+            json.dumps(user) + '\n' for user in self.users))
+        fetched, matches = user_dump.scan_file(
+            path, ['example.com'], noncompliant_only=True, workers=2)
+        self.assertEqual(fetched, 50)
+        self.assertEqual([user.email for user in matches],
+                         [user['email'] for user in self.users
+                          if user['email'].endswith('example.com')
+                          and not user['mfa']['enabled']])
+
+    def test_ranges_end_on_line_boundaries(self):
+        """
+        Test that split ranges cover the file with whole lines.
+        """
+        path = self.write('users.ndjson', '{"a": 1}\n' * 7 + '{"a": 2}')
+        with open(path, 'rb') as dump, \
+                mmap.mmap(dump.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            ranges = user_dump.split_ranges(data, 4)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_invalid_line_is_reported(self):
+        """
+        Test that a corrupt NDJSON line names its position.
+        """
+        path = self.write('users.ndjson', '{"email": "a@example.com"}\n{"')
+        with self.assertRaisesRegex(ValueError, 'at byte 27'):
+            user_dump.scan_file(path, ['example.com'])
+
+    def test_scan_command_reads_input(self):
+        """
+        Test that --input feeds the dump to the scan command.
+        """
+        dump = self.write('users.ndjson', ''.join(
+            json.dumps(user) + '\n' for user in self.users))
+        config = self.write('config.json', json.dumps(
+            {'customer_domains': ['example.com'], 'snapshot_db': None,
+             'token_cache_path': None, 'mail_spool_dir': None}))
+        output = io.StringIO()
+        with redirect_stdout(output), \
+                patch('engine.scan_all') as mock_scan_all:
+            self.assertEqual(main.main(['scan', '--config', config,
+                                        '--input', dump]), 0)
+        mock_scan_all.assert_not_called()
+        self.assertIn('user1@mail.example.com', output.getvalue())
+        self.assertNotIn('user3@mail.example.com', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+"""
+This module keeps Plextrac bearer tokens on disk so that consecutive runs
+can skip the authentication request while a token is still valid.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Default location of the token cache file.
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser('~'), '.cache', 'plextrac_mfa', 'tokens.json'
+)
+# Lifetime assumed for tokens that do not carry an expiry claim.
+DEFAULT_TOKEN_TTL = 600
+# Tokens are considered expired this many seconds before their expiry.
+EXPIRY_MARGIN = 60
+
+
+def cache_key(url, username, tenant_id=None):
+    """
+    Build the cache key of a set of credentials.
+
+    Args:
+        url (str): The Plextrac instance URL.
+        username (str): The Plextrac username.
+        tenant_id (str): The tenant scanned, if one is configured.
+
+    Returns:
+        str: A hex digest identifying the credentials.
+    """
+    raw = '\n'.join([url.rstrip('/'), username, tenant_id or ''])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def token_expiry(token, default_ttl=DEFAULT_TOKEN_TTL):
+    """
+    Work out when a token expires.
+
+    Uses the 'exp' claim when the token is a JWT, and falls back to the
+    default lifetime otherwise.
+
+    Args:
+        token (str): The bearer token.
+        default_ttl (int): The lifetime in seconds of opaque tokens.
+
+    Returns:
+        float: The expiry as a Unix timestamp.
+    """
+    parts = token.split('.')
+    if len(parts) == 3:
+        payload = parts[1] + '=' * (-len(parts[1]) % 4)
+        try:
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+            return float(claims['exp'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            pass
+    return time.time() + default_ttl
+
+
+class TokenCache:
+    """
+    A JSON file of authentication payloads keyed by cache_key.
+
+    The file and its directory are only readable by the current user.
+    Updates are written to a temporary file and moved into place, so a
+    crash never leaves a truncated cache behind.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, default_ttl=DEFAULT_TOKEN_TTL):
+        self.path = path
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self, entries):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as cache_file:
+            json.dump(entries, cache_file)
+        os.replace(tmp_path, self.path)
+        os.chmod(self.path, 0o600)
+
+    def get(self, key):
+        """
+        Look up a cached authentication payload.
+
+        Args:
+            key (str): The cache key of the credentials.
+
+        Returns:
+            dict: The payload holding 'token' and 'tenant_id', or None when
+            nothing valid is cached.
+        """
+        with self._lock:
+            entry = self._load().get(key)
+        if not entry or entry.get('expires_at', 0) - EXPIRY_MARGIN \
+                <= time.time():
+            return None
+        return {'token': entry['token'], 'tenant_id': entry['tenant_id']}
+
+    def put(self, key, auth):
+        """
+        Store an authentication payload.
+
+        Args:
+            key (str): The cache key of the credentials.
+            auth (dict): The payload returned by the authenticate endpoint.
+        """
+        entry = {
+            'token': auth['token'],
+            'tenant_id': auth['tenant_id'],
+            'expires_at': token_expiry(auth['token'], self.default_ttl)
+        }
+        with self._lock:
+            entries = self._load()
+            now = time.time()
+            entries = {k: v for k, v in entries.items()
+                       if v.get('expires_at', 0) > now}
+            entries[key] = entry
+            self._save(entries)
+
+    def invalidate(self, key):
+        """
+        Drop a cached payload, e.g. after the API rejected its token.
+
+        Args:
+            key (str): The cache key of the credentials.
+        """
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
+
+
+class MemoryTokenCache:
+    """
+    Authentication payloads kept in memory for the life of the process.
+
+    Used by long-lived callers that scan repeatedly without a cache file.
+
+    Args:
+        default_ttl (int): The lifetime in seconds of opaque tokens.
+    """
+
+    def __init__(self, default_ttl=DEFAULT_TOKEN_TTL):
+        self.default_ttl = default_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up a cached authentication payload.
+
+        Args:
+            key (str): The cache key of the credentials.
+
+        Returns:
+            dict: The payload holding 'token' and 'tenant_id', or None when
+            nothing valid is cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if not entry or entry['expires_at'] - EXPIRY_MARGIN <= time.time():
+            return None
+        return {'token': entry['token'], 'tenant_id': entry['tenant_id']}
+
+    def put(self, key, auth):
+        """
+        Store an authentication payload.
+
+        Args:
+            key (str): The cache key of the credentials.
+            auth (dict): The payload returned by the authenticate endpoint.
+        """
+        entry = {
+            'token': auth['token'],
+            'tenant_id': auth['tenant_id'],
+            'expires_at': token_expiry(auth['token'], self.default_ttl)
+        }
+        with self._lock:
+            self._entries[key] = entry
+
+    def invalidate(self, key):
+        """
+        Drop a cached payload, e.g. after the API rejected its token.
+
+        Args:
+            key (str): The cache key of the credentials.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def open_token_cache(config):
+    """
+    Create the token cache described by the configuration.
+
+    Args:
+        config (dict): The loaded configuration. 'token_cache_path' sets the
+        cache file, or disables caching when null; 'token_ttl' sets the
+        lifetime of tokens without an expiry claim.
+
+    Returns:
+        TokenCache: The cache, or None when caching is disabled.
+    """
+    path = config.get('token_cache_path', DEFAULT_CACHE_PATH)
+    if not path:
+        return None
+    return TokenCache(path, config.get('token_ttl', DEFAULT_TOKEN_TTL))
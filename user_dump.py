@@ -0,0 +1,291 @@
+"""
+This module scans exported Plextrac user dumps instead of the API, for
+audits and for replaying saved data through the same filter and report.
+
+A dump is a JSON document, either the {"data": [...]} payload of the users
+endpoint or a bare array, or NDJSON with one user (or one saved page) per
+line, and may be gzipped. Large uncompressed NDJSON files are memory-mapped
+and split at line boundaries into chunks that worker processes parse and
+filter in parallel; other dumps are streamed in-process.
+"""
+
+import gzip
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import engine
+import json_stream
+
+# NDJSON files at least this large are split across worker processes.
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+# Chunks per worker process, so a slow chunk does not hold up the scan.
+CHUNKS_PER_WORKER = 4
+# Bytes read at a time from JSON documents and compressed dumps.
+READ_CHUNK_SIZE = 1024 * 1024
+# Bytes decoded to tell NDJSON from a JSON document.
+SNIFF_BYTES = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+
+
+def sniff(path):
+    """
+    Work out how a dump is stored.
+
+    Args:
+        path (str): The dump.
+
+    Returns:
+        tuple: Whether it is gzipped, and its layout: 'ndjson', 'array' or
+        'object'.
+
+    Raises:
+        OSError: If the file cannot be read.
+    """
+    with open(path, 'rb') as dump:
+        compressed = dump.read(2) == GZIP_MAGIC
+    name = path[:-3] if compressed and path.endswith('.gz') else path
+    if name.endswith(NDJSON_SUFFIXES):
+        return compressed, 'ndjson'
+    opener = gzip.open if compressed else open
+    with opener(path, 'rb') as dump:
+        head = dump.read(SNIFF_BYTES).lstrip()
+    if head.startswith(b'['):
+        return compressed, 'array'
+    try:
+        json.loads(head.split(b'\n', 1)[0])
+    except ValueError:
+        # The first line is not a whole value: a multi-line document
+        return compressed, 'object'
+    return compressed, 'ndjson'
+
+
+def parse_line(line, path, offset):
+    """
+    Parse one NDJSON line into user entries.
+
+    Args:
+        line (bytes): The line.
+        path (str): The dump, for error messages.
+        offset (int): The byte offset of the line, for error messages.
+
+    Returns:
+        list: The user entries of the line: the line itself, or the 'data'
+        of a saved page. Blank lines hold none.
+
+    Raises:
+        ValueError: If the line is not valid JSON.
+    """
+    line = line.strip()
+    if not line:
+        return []
+    try:
+        value = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"{path}: invalid JSON at byte {offset}: {e}") \
+            from None
+    if isinstance(value, dict) and isinstance(value.get('data'), list):
+        value = value['data']
+    if isinstance(value, list):
+        return [item for item in value if isinstance(item, dict)]
+    return [value] if isinstance(value, dict) else []
+
+
+def iter_range(data, start, end, path):
+    """
+    Yield the user entries of a range of whole NDJSON lines.
+
+    Args:
+        data (mmap.mmap): The mapped dump.
+        start (int): The offset of the first line.
+        end (int): The offset just past the last line.
+        path (str): The dump, for error messages.
+
+    Yields:
+        dict: Each user entry of the range.
+    """
+    position = start
+    while position < end:
+        newline = data.find(b'\n', position, end)
+        stop = end if newline == -1 else newline
+        yield from parse_line(data[position:stop], path, position)
+        position = stop + 1
+
+
+def split_ranges(data, parts):
+    """
+    Split a mapped dump into ranges of whole lines.
+
+    Args:
+        data (mmap.mmap): The mapped dump.
+        parts (int): The number of ranges wanted.
+
+    Returns:
+        list: (start, end) byte offsets, at most 'parts' of them.
+    """
+    size = len(data)
+    bounds = [0]
+    for part in range(1, parts):
+        newline = data.find(b'\n', max(size * part // parts, bounds[-1]))
+        if newline == -1:
+            break
+        if newline + 1 > bounds[-1]:
+            bounds.append(newline + 1)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def filter_entries(entries, domains, noncompliant_only):
+    """
+    Count a stream of user entries and keep the customer users.
+
+    Args:
+        entries (iterable): The user entries.
+        domains (list): The customer domains.
+        noncompliant_only (bool): Also drop the users with MFA enabled.
+
+    Returns:
+        tuple: The number of entries read and the matching
+        records.UserRecord objects.
+    """
+    counted = [0]
+
+    def count(items):
+        for item in items:
+            counted[0] += 1
+            yield item
+
+    matches = engine.search_emails_in_data(count(entries), domains,
+                                           noncompliant_only)
+    return counted[0], matches
+
+
+def scan_range(path, start, end, domains, noncompliant_only):
+    """
+    Parse and filter one range of an NDJSON dump, in a worker process.
+
+    Args:
+        path (str): The dump.
+        start (int): The offset of the first line.
+        end (int): The offset just past the last line.
+        domains (list): The customer domains.
+        noncompliant_only (bool): Also drop the users with MFA enabled.
+
+    Returns:
+        tuple: The number of users read and the matching
+        records.UserRecord objects.
+    """
+    with open(path, 'rb') as dump, \
+            mmap.mmap(dump.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return filter_entries(iter_range(data, start, end, path), domains,
+                              noncompliant_only)
+
+
+def iter_dump_users(path):
+    """
+    Stream the user entries of a dump of any layout, in-process.
+
+    Args:
+        path (str): The dump.
+
+    Yields:
+        dict: Each user entry of the dump.
+
+    Raises:
+        OSError: If the file cannot be read.
+        ValueError: If the dump is not valid JSON or NDJSON.
+    """
+    compressed, layout = sniff(path)
+    opener = gzip.open if compressed else open
+    with opener(path, 'rb') as dump:
+        if layout == 'ndjson':
+            offset = 0
+            for line in dump:
+                yield from parse_line(line, path, offset)
+                offset += len(line)
+            return
+        chunks = iter(lambda: dump.read(READ_CHUNK_SIZE), b'')
+        for item in json_stream.iter_array_items(
+                chunks, None if layout == 'array' else 'data'):
+            if isinstance(item, dict):
+                yield item
+
+
+def scan_file(path, domains, noncompliant_only=False, workers=None):
+    """
+    Find the customer users of a dump.
+
+    Args:
+        path (str): The dump.
+        domains (list): The customer domains.
+        noncompliant_only (bool): Also drop the users with MFA enabled.
+        workers (int): The worker processes for large NDJSON files;
+        defaults to the number of CPUs.
+
+    Returns:
+        tuple: The number of users read and the matching
+        records.UserRecord objects, in file order.
+
+    Raises:
+        OSError: If the file cannot be read.
+        ValueError: If the dump is not valid JSON or NDJSON.
+    """
+    workers = workers or os.cpu_count() or 1
+    compressed, layout = sniff(path)
+    if layout != 'ndjson' or compressed or workers < 2 \
+            or os.path.getsize(path) < PARALLEL_MIN_BYTES:
+        return filter_entries(iter_dump_users(path), domains,
+                              noncompliant_only)
+
+    with open(path, 'rb') as dump, \
+            mmap.mmap(dump.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        ranges = split_ranges(data, workers * CHUNKS_PER_WORKER)
+    starts, ends = zip(*ranges)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(scan_range, repeat(path), starts, ends,
+                                repeat(domains), repeat(noncompliant_only)))
+    return (sum(count for count, _ in results),
+            [user for _, matches in results for user in matches])
+
+
+def scan_dump(config, metrics=None):
+    """
+    Scan the dump named by the configuration in place of the API.
+
+    Args:
+        config (dict): The loaded configuration. 'input_path' names the
+        dump and 'input_workers' bounds the worker processes; the domains
+        of every customer and instance are looked for.
+        metrics (metrics.Metrics): Receives the 'fetch_filter' phase and
+        the users read and matched, labelled with the dump, and an audit
+        event for each non-compliant user.
+
+    Returns:
+        tuple: The customer users, one per email, and an empty list of
+        errors, as returned by engine.scan_all.
+
+    Raises:
+        OSError: If the dump cannot be read.
+        ValueError: If the dump is not valid JSON or NDJSON.
+    """
+    path = config['input_path']
+    domains = list(dict.fromkeys(
+        domain for target in engine.scan_targets(config)
+        for domain in target.get('customer_domains', [])))
+    noncompliant_only = config.get('noncompliant_only', False)
+    workers = config.get('input_workers')
+    if metrics is None:
+        _, matches = scan_file(path, domains, noncompliant_only, workers)
+        return engine.merge_users([matches]), []
+    label = f"input:{os.path.basename(path)}"
+    with metrics.phase('fetch_filter', target=label):
+        fetched, matches = scan_file(path, domains, noncompliant_only,
+                                     workers)
+    metrics.add('users_fetched', fetched, target=label)
+    metrics.add('users_matched', len(matches), target=label)
+    engine.audit_noncompliant(metrics, matches, target=label)
+    return engine.merge_users([matches]), []